@@ -1,7 +1,21 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import sys
 import os
+import contextlib
+
+import merge
+from cohort_index import CohortIndex
+from ledger import write_ledger
+from logs import SUMMARY, configure_logging, get_logger
+from panel_store import load_panel
+from pension_engine import (REQUIRED_COLUMNS, build_cohort_grid, compute_cohort_results,
+                            prepare_panel)
+from profiling import PROFILER, cprofile
+from rate_schedule import RateSchedule
+from regimes import load_special_regime_split, special_regimes
+from streaming import stream_cohort_results
+
+log = get_logger('Calculations')
 
 # -----------------------------------------------------------------------------
 # 1. USER INPUTS
@@ -17,6 +31,11 @@ FILE_PATH = "final_dataset_with_wages_1960-2100.csv"  # <<< SET THIS
 # E.g., 0.25 for 25%.
 PCT_PUBLIC = 0.15
 
+# Birth years to compute, as an inclusive (first, last) range, e.g.
+# (1960, 1980); None computes every cohort of the panel. Not applied in
+# streaming mode.
+COHORT_RANGE = None
+
 # The assumed age when a person in a cohort starts working.
 # E.g., 20.
 WORK_START_AGE = 20
@@ -27,7 +46,7 @@ FIXED_INCREASE_RATE = 0.2485 # <<< ADDED THIS
 
 # This table maps a retirement year to the "Proportional Rate" used
 # in the private pension calculation. This is the "Taux de majoration proportionnelle".
-# The script will find the closest year if an exact match is not found.
+# Years that are not in the table are interpolated with PROP_RATE_INTERPOLATION.
 # Format: {RetirementYear: Rate, ...}
 PROP_RATE_TABLE = {
     2020: 1.78,
@@ -37,26 +56,91 @@ PROP_RATE_TABLE = {
     # ... add more values ...
     2052: 1.60
 }
+
+# How the rate of a year missing from PROP_RATE_TABLE is found:
+# 'nearest' (closest year), 'linear' (between the surrounding years) or
+# 'step' (latest year at or before).
+PROP_RATE_INTERPOLATION = 'nearest'
+
+# Survival weighting: instead of summing benefits over the rounded life
+# expectancy at the work start age, every yearly contribution and benefit
+# is weighted by the cohort's survival probability, derived from the
+# Population column (see pension_engine.population_survival).
+SURVIVAL_WEIGHTING = False
+
+# Statutory salary limits: contributions and adjusted earnings are computed
+# on the Salary clipped to the minimum wage and the contribution ceiling of
+# each year (Minimum_salary and Contribution_ceiling columns of the panel,
+# from min_salary.xls and plafond.xls). There are no limits before the
+# first year of wage data (1990); after the last year of limit data they
+# move with the average wage (see merge.stage_salary_limits). False uses
+# the uncapped Salary.
+SALARY_LIMITS = True
+
+# Special regimes: the public-sector share (PCT_PUBLIC) is split across the
+# special regime funds (CGPO, CFL, CPFEC) by their number of personal
+# pensions in the year of retirement (specialregims2.xlsx, see regimes.py),
+# and the results get one benefit column per regime.
+# This only adds a per-fund breakdown. It does NOT model the special
+# regimes: the workbooks count pensions but hold no accrual rules, so every
+# fund accrues like the old public regime and Total_Benefits, Net_Benefit
+# and the other totals are exactly the same as with False.
+# specialregims1.xlsx (pensions by type, not by fund) is not read.
+# The same switch is the SPECIAL_REGIMES key of the scenarios.py and
+# stochastic.py scenarios (scenarios.py --special-regimes); the microsim.py,
+# ledger.py, streaming.py and incremental.py command lines use this
+# setting (see pension_regimes). It is a breakdown there too.
+SPECIAL_REGIMES = False
+
+# Cashflow ledger: when set, every yearly contribution and benefit flow of
+# every cohort (one row per Birth_Year and Year) is also written to this
+# file (.parquet or .csv, see ledger.py). Not written in streaming mode.
+LEDGER_FILE = None
+
+# Streaming mode: the panel is read and computed in chunks of cohorts and
+# the results are written as they are computed, so memory stays flat for
+# very large panels (see streaming.py). No plot is made in this mode.
+STREAMING_MODE = False
+
+# Console messages: 'INFO' (progress), 'DEBUG' (also every skipped cohort
+# and the results table) or 'WARNING' (quiet). Skipped cohorts and stage
+# timings are always collected in the run summary, written to
+# RUN_SUMMARY_FILE (None: not written).
+LOG_LEVEL = 'INFO'
+RUN_SUMMARY_FILE = 'pension_run_summary.json'
+
+# Profiling: when PROFILE is True, wall time, CPU time, peak memory and row
+# counts of every phase (load, validation, grouping, compute, output,
+# plotting) are written to PROFILE_REPORT_FILE (see profiling.py).
+# CPROFILE_FILE, when set, also dumps cProfile stats of the whole run.
+# PENSION_PROFILE=1 in the environment turns PROFILE on too.
+PROFILE = False
+PROFILE_REPORT_FILE = 'pension_profile.json'
+CPROFILE_FILE = None
 # -----------------------------------------------------------------------------
 
-def get_prop_rate(rate_map, retirement_year):
+def pension_regimes():
+    """Regimes of the run: the special regime split, or None (the default regimes)."""
+    if SPECIAL_REGIMES:
+        return special_regimes(load_special_regime_split())
+    return None
+
+def load_pension_panel():
     """
-    Helper function to get the proportional rate from the user-defined table.
-    If an exact year match is not found, it finds the closest year available.
+    Panel of the run, restricted to the COHORT_RANGE birth years. When
+    FILE_PATH is the final panel of merge.py and the pipeline is up to
+    date, its cached cohort index is used (no parsing; the range is a
+    slice of the rows sorted by cohort, see cohort_index.py).
     """
-    if retirement_year in rate_map:
-        return rate_map[retirement_year]
-    
-    # Fallback: find the closest year in the map
-    if not rate_map:
-        print(f"    - WARNING: PROP_RATE_TABLE is empty. Defaulting rate to 0.")
-        return 0
-        
-    closest_year = min(rate_map.keys(), key=lambda year: abs(year - retirement_year))
-    rate = rate_map[closest_year]
-    
-    print(f"    - INFO: No prop_rate for {retirement_year}. Using closest year {closest_year} with rate {rate}.")
-    return rate
+    index = None
+    if os.path.abspath(FILE_PATH) in map(os.path.abspath, merge.STAGES[-1]['outputs']):
+        index = merge.load_cohort_index()
+    if index is None:
+        df = load_panel(FILE_PATH)
+        if COHORT_RANGE is None:
+            return df
+        index = CohortIndex.from_frame(df)
+    return index.query(cohorts=COHORT_RANGE)
 
 def plot_results(results_df):
     """
@@ -64,7 +148,7 @@ def plot_results(results_df):
     The plot is saved as 'pension_lifetime_chart.png'.
     """
     if results_df.empty:
-        print("No data to plot.")
+        log.info("No data to plot.")
         return
 
     # Filter cohorts and create 5-year groups for plotting
@@ -134,239 +218,153 @@ def plot_results(results_df):
     # Save the plot
     save_path = 'pension_lifetime_chart.png'
     plt.savefig(save_path)
-    print(f"\n--- Plot saved to {os.path.abspath(save_path)} ---")
+    log.info(f"--- Plot saved to {os.path.abspath(save_path)} ---")
 
 def calculate_pension_wealth():
     """
     Main function to load data, process each cohort, and calculate results.
     """
-    print(f"--- Starting Pension Lifetime Calculator ---")
+    log.info(f"--- Starting Pension Lifetime Calculator ---")
     
     # --- 1. Load Data ---
-    print(f"Loading data from '{FILE_PATH}'...")
+    # The cached cohort index or a typed binary copy of the panel (written
+    # by merge.py) is used when available, so no CSV parsing or type
+    # coercion is needed.
+    log.info(f"Loading data from '{FILE_PATH}'...")
     try:
-        df = pd.read_csv(FILE_PATH)
+        with PROFILER.stage('calculations.load') as record:
+            df = load_pension_panel()
+            record['rows'] = len(df)
     except FileNotFoundError:
-        print(f"FATAL ERROR: File not found at '{FILE_PATH}'.")
-        print("Please check the FILE_PATH variable at the top of the script.")
+        log.error(f"FATAL ERROR: File not found at '{FILE_PATH}'.")
+        log.error("Please check the FILE_PATH variable at the top of the script.")
         return
     except Exception as e:
-        print(f"FATAL ERROR: Could not read file. Error: {e}")
+        log.error(f"FATAL ERROR: Could not read file. Error: {e}")
         return
 
     # --- 2. Data Preparation ---
-    # List of columns required for the calculation
-    required_cols = [
-        'Birth_Year', 'Year', 'Population', 'Life_Expectancy', 
-        'Retirement_age', 'Contribution_rate', '1999_dummy', 
-        'Reference_amount_1984', 'Revaleurisation_rate', 'Salary',
-        'Adjustment_factor_1984'
-    ]
-    
-    # Check if all required columns exist
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        print(f"FATAL ERROR: The CSV is missing the following required columns:")
-        for col in missing_cols:
-            print(f"- {col}")
-        return
+    # Columns required for the calculation: pension_engine.REQUIRED_COLUMNS
+    with PROFILER.stage('calculations.validate') as record:
+        # Check if all required columns exist
+        missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+        if missing_cols:
+            log.error(f"FATAL ERROR: The CSV is missing the following required columns:")
+            for col in missing_cols:
+                log.error(f"- {col}")
+            return
 
-    # Convert columns to numeric, handling any errors
-    for col in required_cols:
-        if col not in ['Birth_Year']: # Keep cohort as object for grouping
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-    # Drop rows where essential data is missing
-    df = df.dropna(subset=required_cols)
-    print("Data loaded and validated successfully.")
-
-    # --- 3. Process Data by Cohort ---
-    print("Grouping data by cohort ('Birth_Year')...")
-    grouped = df.groupby('Birth_Year')
-    cohort_results = []
-    
-    print(f"Found {len(grouped)} cohorts. Starting calculations...")
+        # Drop rows where essential data is missing
+        df = prepare_panel(df)
+        record['rows'] = len(df)
+    log.info("Data loaded and validated successfully.")
 
-    for cohort, cohort_data in grouped:
-        print(f"\nProcessing Cohort: {cohort}")
-        
-        try:
-            # --- A. Get Cohort-Level Data ---
-            Y_start_work = cohort + WORK_START_AGE
-            
-            # Get cohort-wide stats from the row corresponding to their start-of-work year
-            work_start_row = cohort_data[cohort_data['Year'] == Y_start_work]
-            
-            if work_start_row.empty:
-                print(f"  - SKIPPING: No data found for assumed work start year {Y_start_work}.")
-                continue
-                
-            work_start_row = work_start_row.iloc[0]
-            
-            # Read float values from data
-            retirement_age_float = work_start_row['Retirement_age']
-            life_expectancy_float = work_start_row['Life_Expectancy']
-            dummy_1999 = work_start_row['1999_dummy']
-            
-            # --- FIX: Round ages to nearest integer ---
-            # This converts float ages (e.g., 61.4) to integers (e.g., 61)
-            # to ensure all year calculations result in integers.
-            retirement_age = round(retirement_age_float)
-            life_expectancy = round(life_expectancy_float)
-            
-            # These calculations will now produce integer years
-            Y_retire = cohort + retirement_age
-            Y_end_work = Y_retire - 1
-            Y_end_life = Y_start_work + life_expectancy
-            
-            print(f"  - Cohort Lifecycle: Born {cohort} | Work Start {Y_start_work} | Retire {Y_retire} | Life End {Y_end_life}")
-
-            # --- B. Filter Data to Lifespan ---
-            # This is critical: only consider the years this cohort is alive and relevant
-            lifespan_data = cohort_data[
-                (cohort_data['Year'] >= Y_start_work) & 
-                (cohort_data['Year'] < Y_end_life)
-            ]
-            
-            if lifespan_data.empty:
-                print(f"  - SKIPPING: No lifespan data found between {Y_start_work} and {Y_end_life}.")
-                continue
-
-            # --- C. Formula 1: Total Lifetime Contributions ---
-            working_life_data = lifespan_data[
-                (lifespan_data['Year'] >= Y_start_work) & 
-                (lifespan_data['Year'] <= Y_end_work)
-            ]
-            
-            if working_life_data.empty:
-                print(f"  - SKIPPING: No working life data found between {Y_start_work} and {Y_end_work}.")
-                continue
-                
-            # Calculate total contributions
-            total_contributions = (
-                working_life_data['Salary'] * working_life_data['Contribution_rate']
-            ).sum()
-            
-            print(f"  - Total Contributions: {total_contributions:,.0f}")
-
-            # --- D. Formula 2: Total Lifetime Benefits ---
-            
-            # --- Stage 1: Calculate Initial Annual Pension (IAP) ---
-            N_years = min(retirement_age - WORK_START_AGE, 40)
-            
-            # --- A. IAP Private ("Régime Général") ---
-            
-            # Get data from the year of retirement
-            # This lookup will now use an integer Y_retire
-            retirement_row = lifespan_data[lifespan_data['Year'] == Y_retire]
-            if retirement_row.empty:
-                print(f"  - SKIPPING: No data found for retirement year {Y_retire}.")
-                continue
-                
-            reference_amount = retirement_row.iloc[0]['Reference_amount_1984']
-            
-            # 1. Fixed Increases
-            fixed_increases = (N_years / 40) * reference_amount
-            
-            # 2. Proportional Increases
-            sum_adjusted_earnings = (
-                working_life_data['Salary'] / working_life_data['Adjustment_factor_1984'] / working_life_data['Revaleurisation_rate']
-            ).sum()
-            
-            prop_rate = get_prop_rate(PROP_RATE_TABLE, Y_retire)
-            proportional_increases = sum_adjusted_earnings * prop_rate
-            
-            iap_private = fixed_increases + proportional_increases
-            
-            # --- B. IAP Public Old ("Régime Spécial Transitoire") ---
-            
-            # Get data from the final working year
-            # This lookup will now use an integer Y_end_work
-            final_salary_row = working_life_data[working_life_data['Year'] == Y_end_work]
-            if final_salary_row.empty:
-                print(f"  - SKIPPING: No data found for final working year {Y_end_work}.")
-                continue
-                
-            final_salary = final_salary_row.iloc[0]['Salary']
-            
-            iap_public_old = (5 / 6) * final_salary * (N_years / 40)
-            
-            # --- Core IAP Formula (Weighted Average) ---
-            # This handles all cases as described in the logic
-            iap_C = (1 - PCT_PUBLIC * (1 - dummy_1999)) * iap_private + \
-                    (PCT_PUBLIC * (1 - dummy_1999)) * iap_public_old
-            
-            # --- Stage 2: Sum IAP Over Retirement ---
-            # This calculation will now use the rounded integer ages
-            num_retire_years = (WORK_START_AGE + life_expectancy) - retirement_age
-            if num_retire_years < 0:
-                num_retire_years = 0
-                print(f"  - WARNING: Life Expectancy ({life_expectancy}) is less than Retirement Age ({retirement_age}). Setting retirement years to 0.")
-                
-            total_lifetime_benefits = iap_C * num_retire_years
-            print(f"  - Total Benefits: {total_lifetime_benefits:,.0f}")
-
-            # --- E. Formula 3: Net Lifetime Benefit ---
-            net_benefit = total_lifetime_benefits - total_contributions
-            print(f"  - Net Benefit: {net_benefit:,.0f}")
-
-            # --- F. Store Results ---
-            # Disaggregate benefits for reporting
-            weight_private = 1 - PCT_PUBLIC * (1 - dummy_1999)
-            weight_public = PCT_PUBLIC * (1 - dummy_1999)
-            
-            lifetime_fixed_benefit = fixed_increases * weight_private * num_retire_years
-            lifetime_prop_benefit = proportional_increases * weight_private * num_retire_years
-            lifetime_public_benefit = iap_public_old * weight_public * num_retire_years
-
-            cohort_results.append({
-                'Cohort': cohort,
-                'Total_Contributions': total_contributions,
-                'Total_Benefits': total_lifetime_benefits,
-                'Net_Benefit': net_benefit,
-                'Lifetime_Fixed_Benefit': lifetime_fixed_benefit,
-                'Lifetime_Prop_Benefit': lifetime_prop_benefit,
-                'Lifetime_Public_Benefit': lifetime_public_benefit
-            })
-            
-        except Exception as e:
-            print(f"  - ERROR processing cohort {cohort}: {e}")
-            # Continue to the next cohort
-            pass
+    # --- 3. Process All Cohorts at Once ---
+    # The panel is pivoted onto a (Birth_Year x Age) grid and every cohort is
+    # evaluated with array operations (see pension_engine.py).
+    log.info("Building the cohort grid ('Birth_Year' x 'Age')...")
+    with PROFILER.stage('calculations.grouping') as record:
+        grid = build_cohort_grid(df)
+        record['rows'] = len(grid['cohorts'])
+    log.info(f"Found {len(grid['cohorts'])} cohorts. Starting calculations...")
+
+    # Built once, for the results and the ledger
+    regimes = pension_regimes()
+
+    with PROFILER.stage('calculations.compute') as record:
+        results_df, skipped_df = compute_cohort_results(
+            df, PCT_PUBLIC, WORK_START_AGE,
+            RateSchedule.of(PROP_RATE_TABLE, PROP_RATE_INTERPOLATION), grid=grid,
+            survival_weighting=SURVIVAL_WEIGHTING, salary_limits=SALARY_LIMITS,
+            regimes=regimes
+        )
+        record['rows'] = len(results_df)
+
+    if LEDGER_FILE:
+        with PROFILER.stage('calculations.ledger') as record:
+            record['rows'] = write_ledger(
+                df, LEDGER_FILE, PCT_PUBLIC, WORK_START_AGE,
+                RateSchedule.of(PROP_RATE_TABLE, PROP_RATE_INTERPOLATION), grid=grid,
+                survival_weighting=SURVIVAL_WEIGHTING, salary_limits=SALARY_LIMITS,
+                regimes=regimes
+            )
+        log.info(f"--- Cashflow ledger saved to {os.path.abspath(LEDGER_FILE)} ---")
+
+    # Skipped cohorts go to the run summary (one line each at DEBUG level)
+    SUMMARY.add_warnings('skipped_cohorts', skipped_df.to_dict('records'))
+    for cohort, reason in zip(skipped_df['Cohort'], skipped_df['Reason']):
+        log.debug(f"  - SKIPPING cohort {cohort}: {reason}.")
 
     # --- 4. Final Output ---
-    if not cohort_results:
-        print("\n--- No cohorts were successfully processed. ---")
+    if results_df.empty:
+        log.info("--- No cohorts were successfully processed. ---")
         return
 
-    print("\n--- All cohorts processed. ---")
-    
-    # Convert results to a DataFrame
-    results_df = pd.DataFrame(cohort_results)
+    log.info(f"--- All cohorts processed ({len(results_df)} computed, {len(skipped_df)} skipped). ---")
     
     # Set display options for printing
     pd.set_option('display.float_format', '{:,.0f}'.format)
     pd.set_option('display.width', 1000)
     
-    print("\n--- Results Summary Table ---")
-    print(results_df)
+    log.debug("--- Results Summary Table ---")
+    log.debug("%s", results_df)
     
     # Save results to CSV
     results_save_path = 'pension_lifetime_results.csv'
-    results_df.to_csv(results_save_path, index=False, float_format='%.2f')
-    print(f"\n--- Results table saved to {os.path.abspath(results_save_path)} ---")
+    with PROFILER.stage('calculations.output') as record:
+        results_df.to_csv(results_save_path, index=False, float_format='%.2f')
+        record['rows'] = len(results_df)
+    log.info(f"--- Results table saved to {os.path.abspath(results_save_path)} ---")
     
     # Generate the plot
-    plot_results(results_df)
+    with PROFILER.stage('calculations.plotting'):
+        plot_results(results_df)
+
+def calculate_pension_wealth_streaming():
+    """
+    Streaming version of calculate_pension_wealth: cohorts are computed
+    chunk by chunk and appended to the results file.
+    """
+    log.info(f"--- Starting Pension Lifetime Calculator (streaming mode) ---")
+    log.info(f"Streaming data from '{FILE_PATH}'...")
+    results_save_path = 'pension_lifetime_results.csv'
+    try:
+        with PROFILER.stage('calculations.streaming') as record:
+            computed, skipped = stream_cohort_results(
+                FILE_PATH, results_save_path, PCT_PUBLIC, WORK_START_AGE,
+                RateSchedule.of(PROP_RATE_TABLE, PROP_RATE_INTERPOLATION),
+                survival_weighting=SURVIVAL_WEIGHTING, salary_limits=SALARY_LIMITS,
+                regimes=pension_regimes()
+            )
+            record['rows'] = computed
+    except FileNotFoundError:
+        log.error(f"FATAL ERROR: File not found at '{FILE_PATH}'.")
+        log.error("Please check the FILE_PATH variable at the top of the script.")
+        return
+    log.info(f"--- All cohorts processed ({computed} computed, {skipped} skipped). ---")
+    log.info(f"--- Results table saved to {os.path.abspath(results_save_path)} ---")
 
 # --- Run the main function ---
 if __name__ == "__main__":
+    configure_logging(LOG_LEVEL)
     # Check for minimal PROP_RATE_TABLE
     if not PROP_RATE_TABLE:
-        print("WARNING: The 'PROP_RATE_TABLE' is empty.")
-        print("Calculations for the 'Proportional Increases' will be 0.")
-        print("Please edit the script to add retirement years and rates.")
+        log.warning("The 'PROP_RATE_TABLE' is empty.")
+        log.warning("Calculations for the 'Proportional Increases' will be 0.")
+        log.warning("Please edit the script to add retirement years and rates.")
         
-    calculate_pension_wealth()
+    if PROFILE:
+        PROFILER.enable()
+    with cprofile(CPROFILE_FILE) if CPROFILE_FILE else contextlib.nullcontext():
+        if STREAMING_MODE:
+            calculate_pension_wealth_streaming()
+        else:
+            calculate_pension_wealth()
+    if PROFILER.enabled:
+        PROFILER.write_report(PROFILE_REPORT_FILE)
+
+    SUMMARY.log_counts(log)
+    if RUN_SUMMARY_FILE:
+        SUMMARY.write(RUN_SUMMARY_FILE)
 
 
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -6,32 +7,26 @@ import pandas as pd
 def Wages_Calculation(Wages_data_annually, tous_les_onglets):
     list_years = list(range(1990,2051))
     list_ages = list(range(15,66))
-    Tableau_Output = pd.DataFrame()
     Ratio_dict = {}
-    ################ Reading the Excel file ############
-    for year in list_years:
-        for age in list_ages:
-            if str(year) in tous_les_onglets.keys():
-                df_int={'Year':[year],
-                'Age': [age],
-                'Income_per_year': [tous_les_onglets[str(year)].loc[tous_les_onglets[str(year)]['Age']==age,'Total'].values[0]]}
-                Tableau_Output=pd.concat([Tableau_Output,pd.DataFrame(df_int)])
-            else:
-                df_int=pd.DataFrame({'Year':[year],
-                        'Age': [age],
-                        'Income_per_year': [0]})
-                Tableau_Output=pd.concat([Tableau_Output,df_int])     
     ################ Treatment of the data ############
+    # Average ratio between the income at each age and the annual wage,
+    # over all the years available in the income workbook
     for year in tous_les_onglets.keys():
         Annual_Price=Wages_data_annually[year].values[0]
         liste_wage=list(tous_les_onglets[year]['Total']/Annual_Price)
         Ratio_dict[year]=liste_wage
     Ration_dict=pd.DataFrame(Ratio_dict)
-    Ratio_moyen=list(Ration_dict.mean(axis=1))
-    for year in list_years:
-        for age in list_ages:
-            Annual_Price=Wages_data_annually[str(year)].values[0]
-            Tableau_Output.loc[(Tableau_Output['Year']==year) & (Tableau_Output['Age']==age),'Income_per_year']=Ratio_moyen[age-15]*(Annual_Price)
+    Ratio_moyen=Ration_dict.mean(axis=1).to_numpy()
+    ################ Building the Year x Age panel ############
+    # Income_per_year(year, age) = Ratio_moyen[age-15] * Annual_Price(year),
+    # computed for the whole grid at once (rows: years, columns: ages)
+    Annual_Prices=Wages_data_annually[[str(year) for year in list_years]].values[0].astype(float)
+    Ratios=Ratio_moyen[np.array(list_ages)-15]
+    Income_grid=Ratios[np.newaxis, :]*Annual_Prices[:, np.newaxis]
+    Tableau_Output=pd.DataFrame({
+        'Year': np.repeat(list_years, len(list_ages)),
+        'Age': np.tile(list_ages, len(list_years)),
+        'Income_per_year': Income_grid.ravel()})
     return Tableau_Output
 
 def Reval_avg_An_wages(Wages_data_annually):
@@ -0,0 +1,143 @@
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Annuity factors for benefit streams
+# -----------------------------------------------------------------------------
+# Stage 2 of the calculation multiplies the Initial Annual Pension by the
+# number of retirement years. With an indexation rate g (pensions adjusted
+# every year) and a discount rate r, the value of the stream at the
+# retirement year is the IAP times the annuity factor
+#
+#     a(n, r, g) = sum_{t=0}^{n-1} ((1 + g) / (1 + r))^t
+#
+# (first payment in the retirement year). With r = g = 0 it is n, the
+# current model. annuity_factor() is the closed form.
+#
+# AnnuityTable precomputes the factors once for every (retirement year,
+# duration, discount rate, indexation rate), optionally weighted by the
+# probability of surviving t years after retirement, so a sweep over
+# discount and indexation assumptions is a lookup per cohort instead of a
+# recomputation of the yearly flows.
+#
+# Survival-weighted runs (see pension_engine.evaluate_cohorts) weight each
+# payment by the survival curve of the cohort, not of the retirement year,
+# so they use a table built per birth year instead (AnnuityTable.for_survival):
+# its durations are counted from the first age of the grid, and the value
+# of the payments from the retirement age on is the difference of two
+# lookups.
+
+
+def annuity_factor(duration, discount_rate=0.0, indexation_rate=0.0):
+    """
+    Closed-form a(n, r, g) (see above). Vectorized over all arguments;
+    negative durations count as 0.
+    """
+    n = np.maximum(np.asarray(duration, dtype=np.float64), 0)
+    q = ((1 + np.asarray(indexation_rate, dtype=np.float64))
+         / (1 + np.asarray(discount_rate, dtype=np.float64)))
+    q, n = np.broadcast_arrays(q, n)
+    flat = np.isclose(q, 1.0)
+    safe_q = np.where(flat, 0.5, q)
+    return np.where(flat, n, (1 - safe_q ** n) / (1 - safe_q))
+
+
+class AnnuityTable:
+    """
+    Annuity factors on a grid of consecutive retirement years, durations
+    (0 to max_duration years), discount rates and indexation rates.
+    """
+
+    def __init__(self, retirement_years, discount_rates, indexation_rates, factors,
+                 by_cohort=False):
+        # Retirement years, or birth years for a survival table (by_cohort)
+        self.retirement_years = np.asarray(retirement_years, dtype=np.int64)
+        self.discount_rates = np.asarray(discount_rates, dtype=np.float64)
+        self.indexation_rates = np.asarray(indexation_rates, dtype=np.float64)
+        # factors[year, duration, discount rate, indexation rate]
+        self.factors = factors
+        self.by_cohort = by_cohort
+
+    @classmethod
+    def build(cls, retirement_years, max_duration, discount_rates=(0.0,), indexation_rates=(0.0,),
+              survival=None):
+        """
+        Precomputes the table.
+
+        survival, when given, is a (len(retirement_years) x max_duration)
+        array: the probability, for someone retiring that year, of still
+        being alive t years later (t = 0 .. max_duration - 1). Payments are
+        weighted by it.
+        """
+        retirement_years = np.asarray(retirement_years, dtype=np.int64)
+        discount_rates = np.asarray(discount_rates, dtype=np.float64)
+        indexation_rates = np.asarray(indexation_rates, dtype=np.float64)
+
+        t = np.arange(max_duration, dtype=np.float64)
+        # Value of the payment of year t, per (discount, indexation): (T x R x G)
+        q = (1 + indexation_rates[None, :]) / (1 + discount_rates[:, None])
+        payment = q[None, :, :] ** t[:, None, None]
+
+        if survival is None:
+            weight = np.ones((len(retirement_years), max_duration))
+        else:
+            weight = np.asarray(survival, dtype=np.float64)
+        # Cumulative value for durations 0 .. max_duration: (Y x T+1 x R x G)
+        factors = np.zeros((len(retirement_years), max_duration + 1,
+                            len(discount_rates), len(indexation_rates)))
+        np.cumsum(weight[:, :, None, None] * payment[None], axis=1, out=factors[:, 1:])
+        return cls(retirement_years, discount_rates, indexation_rates, factors)
+
+    @classmethod
+    def for_grid(cls, grid, discount_rates=(0.0,), indexation_rates=(0.0,), **kwargs):
+        """
+        Table covering every retirement year and duration possible on a
+        cohort grid (see pension_engine.build_cohort_grid).
+        """
+        cohorts, ages = grid['cohorts'], grid['ages']
+        if len(cohorts) and len(ages):
+            years = np.arange(cohorts.min() + ages.min(), cohorts.max() + ages.max() + 1)
+        else:
+            years = np.arange(0)
+        return cls.build(years, len(ages), discount_rates, indexation_rates, **kwargs)
+
+    @classmethod
+    def for_survival(cls, grid, survival, discount_rates=(0.0,), indexation_rates=(0.0,)):
+        """
+        Survival-weighted table of the cohorts of a grid, keyed by birth
+        year: lookup(birth_year, n) is the value at the first age of the
+        grid of a unit payment at each of its first n ages, weighted by
+        `survival` (Birth_Year x Age, see pension_engine.population_survival)
+        where the cohort has a row.
+        """
+        weight = np.where(grid['present'], survival, 0.0)
+        table = cls.build(grid['cohorts'], len(grid['ages']), discount_rates, indexation_rates,
+                          survival=weight)
+        table.by_cohort = True
+        return table
+
+    @property
+    def max_duration(self):
+        return self.factors.shape[1] - 1
+
+    def _rate_index(self, rates, value, name):
+        match = np.flatnonzero(np.isclose(rates, value))
+        if not len(match):
+            raise KeyError(f"{name} {value} is not in the annuity table ({list(rates)}).")
+        return int(match[0])
+
+    def lookup(self, retirement_year, duration, discount_rate=0.0, indexation_rate=0.0):
+        """
+        Annuity factors for arrays of retirement years and durations (in
+        years, rounded down and clipped to [0, max_duration]). Retirement
+        years outside the table take the nearest one. NaN inputs give NaN.
+        """
+        r = self._rate_index(self.discount_rates, discount_rate, 'Discount rate')
+        g = self._rate_index(self.indexation_rates, indexation_rate, 'Indexation rate')
+
+        retirement_year = np.asarray(retirement_year, dtype=np.float64)
+        duration = np.asarray(duration, dtype=np.float64)
+        missing = np.isnan(retirement_year) | np.isnan(duration)
+        year_idx = np.nan_to_num(retirement_year).astype(np.int64) - self.retirement_years[0]
+        year_idx = np.clip(year_idx, 0, len(self.retirement_years) - 1)
+        n = np.clip(np.floor(np.nan_to_num(duration)).astype(np.int64), 0, self.max_duration)
+        return np.where(missing, np.nan, self.factors[year_idx, n, r, g])
@@ -0,0 +1,435 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import numpy as np
+import pandas as pd
+
+from ingest import DATA_DIR
+from panel_store import apply_schema, save_panel
+
+# -----------------------------------------------------------------------------
+# Benchmarks of the pipeline and calculator hot paths
+# -----------------------------------------------------------------------------
+# Times the main entry points on synthetic inputs at several scales (1x is
+# the size of the current panel, ~12.8k Age x Year rows; larger scales add
+# cohorts by extending the year range) and records the peak memory of one
+# extra run under tracemalloc. The calculator is also timed on a panel
+# with AGE_SCALE times more single-year age bands, which widens the
+# (Birth_Year x Age) grid instead of lengthening it (the panel's ages are
+# whole years, so the age axis grows by range, not by sub-annual steps).
+#
+# Results are written to RESULTS_FILE (JSON) and compared with
+# BASELINE_FILE: a benchmark whose best time is more than TOLERANCE above
+# its baseline is flagged as a regression (exit code 1). Timings depend on
+# the machine, so the baseline is not in the repository: save one with
+# --save-baseline before making changes (without it, nothing is compared).
+#
+#   python benchmark.py                    # all benchmarks at 1x, 10x, 100x
+#   python benchmark.py --scales 1 10 --only engine firstTry
+#   python benchmark.py --save-baseline    # store the results as the baseline
+#
+# The merge.py stages and the wage functions read fixed-size sources, so
+# they are timed at 1x only, on the files in ingest.DATA_DIR. Every run of
+# a stage gets an empty stage and source cache in a temporary directory
+# (see cold_cache), so its workbooks are parsed cold and nothing is
+# written to the working directory.
+
+RESULTS_FILE = 'benchmark_results.json'
+BASELINE_FILE = 'benchmark_baseline.json'
+
+SCALES = (1, 10, 100)
+REPEAT = 3
+
+# Allowed slowdown over the baseline before a result is flagged
+TOLERANCE = 0.25
+
+# Layout of the 1x synthetic panel: 141 years x 91 ages ~ 12.8k rows
+BASE_FIRST_YEAR = 1960
+BASE_YEARS = 141
+AGES = (15, 105)
+
+# Age bands of the wide panel of the calculator benchmark, relative to AGES
+AGE_SCALE = 4
+
+# Rows of the 1x firstTry panel
+MOCK_FLOWS_ROWS = 12800
+
+
+# -----------------------------------------------------------------------------
+# Synthetic inputs
+# -----------------------------------------------------------------------------
+
+def make_panel(scale=1, seed=0, age_scale=1):
+    """
+    Synthetic final panel with the columns of final_dataset_with_wages.
+    The year range is scale times longer than the real one and the age
+    range age_scale times wider (from the same first age).
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(BASE_FIRST_YEAR, BASE_FIRST_YEAR + BASE_YEARS * scale)
+    ages = np.arange(AGES[0], AGES[0] + (AGES[1] - AGES[0] + 1) * age_scale)
+    year, age = [a.ravel() for a in np.meshgrid(years, ages, indexing='ij')]
+    birth_year = year - age
+    t = year - BASE_FIRST_YEAR
+
+    reval = np.minimum(0.49 + 0.02 * t, 1.595)
+    income = (20000 + 30000 * np.exp(-((age - 50) / 20.0) ** 2)) * 1.01 ** np.minimum(t, 90)
+    panel = pd.DataFrame({
+        'Age': age,
+        'Year': year,
+        'Population': 10000 * np.exp(-((age - 40) / 40.0) ** 2) + rng.uniform(0, 100, len(age)),
+        'Life_Expectancy': np.maximum(82.0 - age, 2.0) + 0.02 * np.minimum(t, 140),
+        'Retirement_age': 61.6 + rng.normal(0, 0.3, len(years)).repeat(len(ages)),
+        'Contribution_rate': 0.24,
+        '1999_dummy': (birth_year >= 1975).astype(int),
+        'Reference_amount_1984': 2085.0,
+        'Birth_Year': birth_year,
+        'Revaleurisation_rate': reval,
+        'Adjustment_factor_1984': np.minimum(0.35 + 0.015 * t, 2.27),
+        'Salary': income / reval,
+        'Income_per_year': income,
+    })
+    return apply_schema(panel)
+
+
+def make_mock_flows_panel(scale=1):
+    """
+    Synthetic firstTry panel (same columns and rules as
+    firstTry.create_mock_data), built without its per-row loop.
+    """
+    n_years = MOCK_FLOWS_ROWS * scale // 64
+    start_year = 1982
+    years = np.arange(start_year, start_year + n_years)
+    # Ages 22-85 of every cohort alive in the years range
+    ages = np.arange(22, 86)
+    year, age = [a.ravel() for a in np.meshgrid(years, ages, indexing='ij')]
+    cohort = year - age
+    t = year - start_year
+
+    is_1960 = cohort == 1960
+    avg_retirement_age = np.where(is_1960, 61, 63)
+    df = pd.DataFrame({
+        'year': year,
+        'cohort': cohort,
+        'age': age,
+        'cohort_size': 1000,
+        'life_expectancy': 85,
+        'avg_retirement_age': avg_retirement_age,
+        'avg_salary': 40000 + (age - 22) * 1000,
+        'contribution_rate': 0.24,
+        'revaluation_factor_salary_adj': 1.1 + t * 0.005,
+        'pension_adjustment_rate': 0.015,
+        'public_private_split': np.where(is_1960, 0.20, 0.18),
+        'is_pre_1999_regime': is_1960.astype(int),
+        'reference_amount': 2000 + t * 10,
+        'adjustment_factor_1984': 0.8 + t * 0.005,
+        'contribution_ceiling': 100000 + t * 500,
+        'retirement_year': cohort + avg_retirement_age,
+    })
+    df = df.sort_values(['cohort', 'year'], kind='stable')
+    return df.set_index(['year', 'cohort'])
+
+
+def make_age_groups(scale=1, seed=0):
+    """
+    Long table of 5-year age groups as read from a Eurostat extract, with
+    `scale` extracts stacked under a 'Source' key (65 years x 16 groups each).
+    """
+    rng = np.random.default_rng(seed)
+    starts = np.arange(5, 85, 5)
+    labels = [f"From {a} to {a + 4} years" for a in starts]
+    sources, years = np.arange(scale), np.arange(1960, 2025)
+    source, year, group = [a.ravel() for a in np.meshgrid(sources, years, np.arange(len(starts)),
+                                                         indexing='ij')]
+    return pd.DataFrame({
+        'Source': source,
+        'Year': year,
+        'Age_Group_5y': np.array(labels)[group],
+        'Population_5y_Group': rng.uniform(5000, 40000, len(group)).round(),
+    })
+
+
+def write_population_workbook(path, scale=1, seed=0):
+    """
+    Synthetic Eurostat population extract in the layout read by
+    nikita.disaggregate_population_data: 'Sheet 1', years as the headers
+    of row 12, each followed by an empty flag column, and the age group
+    codes and labels in columns B and C, with the 16 five-year groups
+    (plus a 'Total' row) repeated `scale` times.
+    """
+    groups = make_age_groups(1, seed)
+    wide = groups.pivot(index='Age_Group_5y', columns='Year', values='Population_5y_Group')
+    wide = pd.concat([wide] * scale + [wide.sum().to_frame('Total').T])
+    codes = [label.replace('From ', 'Y').replace(' to ', '-').replace(' years', '')
+             for label in wide.index]
+    columns = {'AGE': codes, 'AGE (Labels)': wide.index}
+    for year in wide.columns:
+        columns[year] = wide[year].to_numpy()
+        columns[f'flag {year}'] = ''
+    sheet = pd.DataFrame(columns)
+    header = [c if not str(c).startswith('flag') else '' for c in sheet.columns]
+    sheet.to_excel(path, sheet_name='Sheet 1', startrow=11, startcol=1, index=False, header=header)
+    return len(sheet)
+
+
+@contextlib.contextmanager
+def cold_cache():
+    """
+    Points the merge.py stage cache and the ingest.py source cache at a new
+    empty temporary directory, removed on exit.
+    """
+    import ingest
+    import merge
+    saved = merge.CACHE_DIR, ingest.SOURCE_CACHE_DIR
+    with tempfile.TemporaryDirectory(prefix='pension_bench_cache_') as cache_dir:
+        merge.CACHE_DIR = cache_dir
+        ingest.SOURCE_CACHE_DIR = os.path.join(cache_dir, 'sources')
+        try:
+            yield cache_dir
+        finally:
+            merge.CACHE_DIR, ingest.SOURCE_CACHE_DIR = saved
+
+
+# -----------------------------------------------------------------------------
+# Measurement
+# -----------------------------------------------------------------------------
+
+def measure(setup, func, repeat=REPEAT):
+    """
+    Best wall time of func(*setup()) over `repeat` runs (setup not timed),
+    and the peak traced memory (MB) of one more run.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak / 2**20
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+# Each benchmark yields (name, rows, setup, func) for one scale.
+
+def bench_engine(scale):
+    """
+    Calculations.calculate_pension_wealth, end to end on a Parquet panel,
+    with the real age range and with AGE_SCALE times more age bands.
+    """
+    import Calculations
+    workdir = tempfile.mkdtemp(prefix='pension_bench_')
+
+    def calculator(panel_path):
+        def run():
+            cwd, file_path = os.getcwd(), Calculations.FILE_PATH
+            os.chdir(workdir)
+            Calculations.FILE_PATH = panel_path
+            try:
+                Calculations.calculate_pension_wealth()
+            finally:
+                Calculations.FILE_PATH = file_path
+                os.chdir(cwd)
+                plt.close('all')
+        return run
+
+    for name, age_scale in [('calculate_pension_wealth', 1),
+                            (f'calculate_pension_wealth[ages x{AGE_SCALE}]', AGE_SCALE)]:
+        panel = make_panel(scale, age_scale=age_scale)
+        panel_path = os.path.join(workdir, f'panel_ages{age_scale}.parquet')
+        save_panel(panel, panel_path)
+        rows = len(panel)
+        del panel
+        yield name, rows, tuple, calculator(panel_path)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_firstTry(scale):
+    """firstTry.calculate_lifetime_flows."""
+    from firstTry import calculate_lifetime_flows
+    df = make_mock_flows_panel(scale)
+    yield 'calculate_lifetime_flows', len(df), lambda: (df.copy(),), calculate_lifetime_flows
+
+
+def bench_disaggregation(scale):
+    """
+    nikita.disaggregate_population_data, end to end on a synthetic workbook
+    (read, reshape, split, write), and its core disaggregate_age_groups.
+    """
+    from nikita import SPLIT_METHODS, disaggregate_age_groups, disaggregate_population_data
+    workdir = tempfile.mkdtemp(prefix='pension_bench_')
+    input_path = os.path.join(workdir, 'population.xlsx')
+    output_path = os.path.join(workdir, 'disaggregated.xlsx')
+    rows = write_population_workbook(input_path, scale)
+    for method in SPLIT_METHODS:
+        suffix = '' if method == 'uniform' else f'[{method}]'
+        yield (f'disaggregate_population_data{suffix}', rows,
+               lambda method=method: (input_path, output_path, method), disaggregate_population_data)
+
+    groups = make_age_groups(scale)
+    yield 'disaggregate_age_groups', len(groups), lambda: (groups,), disaggregate_age_groups
+    yield 'disaggregate_age_groups[spline]', len(groups), lambda: (groups, 'spline'), disaggregate_age_groups
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_wages(scale):
+    """Wages_Calculation and Reval_avg_An_wages on the real sources (1x only)."""
+    if scale != 1:
+        return
+    import merge
+    from Wages_Calculation import Reval_avg_An_wages, Wages_Calculation
+    if not (os.path.exists(merge.WAGES_FILE) and os.path.exists(merge.INCOME_FILE)):
+        print(f"Skipping wage benchmarks: '{merge.WAGES_FILE}' or '{merge.INCOME_FILE}' not found.")
+        return
+    wages = pd.read_excel(merge.WAGES_FILE, header=0)
+    income = pd.read_excel(merge.INCOME_FILE, sheet_name=None)
+    projected = Reval_avg_An_wages(wages.copy())
+
+    yield 'Reval_avg_An_wages', wages.shape[1], lambda: (wages.copy(),), Reval_avg_An_wages
+    rows = len(Wages_Calculation(projected, income))
+    yield 'Wages_Calculation', rows, lambda: (projected, income), Wages_Calculation
+
+
+def bench_merge(scale):
+    """Every merge.py stage on the real sources (1x only), with a cold cache."""
+    if scale != 1:
+        return
+    import merge
+    missing = [path for stage in merge.STAGES for path in stage['inputs'] if not os.path.exists(path)]
+    if missing:
+        print(f"Skipping merge.py stages: {len(missing)} source files not found in '{DATA_DIR}'.")
+        return
+
+    # Upstream panel of every stage, built once (not timed)
+    upstream = [None]
+    with contextlib.redirect_stdout(io.StringIO()), cold_cache():
+        for stage in merge.STAGES[:-1]:
+            upstream.append(stage['run'](upstream[-1], stage['params'])[0])
+
+    def run_cold(stage, panel):
+        with cold_cache():
+            return stage['run'](panel, stage['params'])
+
+    for stage, panel in zip(merge.STAGES, upstream):
+        setup = (lambda panel=panel, stage=stage:
+                 (stage, None if panel is None else panel.copy()))
+        rows = 0 if panel is None else len(panel)
+        yield f"merge.stage_{stage['name']}", rows, setup, run_cold
+
+
+BENCHMARKS = {
+    'engine': bench_engine,
+    'firstTry': bench_firstTry,
+    'disaggregation': bench_disaggregation,
+    'wages': bench_wages,
+    'merge': bench_merge,
+}
+
+
+def run_benchmarks(scales=SCALES, only=None, repeat=REPEAT):
+    """Runs the selected benchmarks at every scale. Returns a list of result dicts."""
+    results = []
+    for group, bench in BENCHMARKS.items():
+        if only and group not in only:
+            continue
+        for scale in scales:
+            for name, rows, setup, func in bench(scale):
+                seconds, peak_mb = measure(setup, func, repeat)
+                print(f"{name:<36} {scale:>4}x {rows:>10,} rows {seconds:>10.4f} s {peak_mb:>10.1f} MB")
+                results.append({'name': name, 'scale': scale, 'rows': rows,
+                                'seconds': seconds, 'peak_mb': peak_mb})
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=TOLERANCE):
+    """
+    Matches results with the baseline on (name, scale). Returns the list of
+    regressions: benchmarks whose time exceeds the baseline by more than
+    `tolerance` (relative).
+    """
+    reference = {(r['name'], r['scale']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = reference.get((result['name'], result['scale']))
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] > 0 else float('inf')
+        result['baseline_seconds'] = base['seconds']
+        result['ratio'] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline and calculator hot paths.")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help=f"Allowed relative slowdown (default: {TOLERANCE}).")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store these results as the new baseline.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.only, args.repeat)
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': results,
+    }
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"--- Baseline saved to {os.path.abspath(args.baseline)} ---")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        report['regressions'] = [(r['name'], r['scale']) for r in regressions]
+        for r in regressions:
+            print(f"  - REGRESSION {r['name']} ({r['scale']}x): {r['seconds']:.4f} s "
+                  f"vs {r['baseline_seconds']:.4f} s baseline ({r['ratio']:.2f}x)")
+        print(f"Compared with '{args.baseline}': {len(regressions)} regressions.")
+    else:
+        print(f"No baseline found at '{args.baseline}' (use --save-baseline to create one).")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"--- Results saved to {os.path.abspath(args.output)} ---")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
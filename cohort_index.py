@@ -0,0 +1,115 @@
+import pickle
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Cohort-diagonal index of the panel
+# -----------------------------------------------------------------------------
+# The panel rows are stored sorted by Birth_Year, then Year, so every cohort's
+# life-course is one contiguous block of rows (ages ascending). The index
+# keeps the first row of each block: extracting a cohort is a slice of the
+# frame (no copy, no scan), and a query over a range of cohorts and ages
+# only touches the rows of those cohorts (binary search per cohort).
+#
+# merge.py stores the index of the final panel next to its cache entry
+# (see merge.cohort_index_path); Calculations.load_pension_panel reads the
+# panel from it and slices the COHORT_RANGE out of it.
+
+
+class CohortIndex:
+    """Panel sorted by (Birth_Year, Year) with the row range of every cohort."""
+
+    def __init__(self, frame, cohorts, starts):
+        self.frame = frame
+        self.cohorts = np.asarray(cohorts, dtype=np.int64)
+        # starts[i]:starts[i + 1] are the rows of cohorts[i]
+        self.starts = np.asarray(starts, dtype=np.int64)
+        ages = self._ages()
+        self._min_age = int(ages.min()) if len(ages) else 0
+        self._age_span = int(ages.max()) - self._min_age + 1 if len(ages) else 1
+        # Sorted (cohort, age) key of every row, for the range queries
+        birth_year = self.frame['Birth_Year'].to_numpy(dtype=np.int64)
+        self._keys = self._key(birth_year, ages)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Sorts a panel by Birth_Year then Year and indexes it. Birth_Year is
+        derived from Year - Age when the panel has no such column.
+        """
+        if 'Birth_Year' not in df.columns:
+            df = df.assign(Birth_Year=df['Year'] - df['Age'])
+        frame = df.sort_values(['Birth_Year', 'Year'], kind='stable').reset_index(drop=True)
+        cohorts, starts = np.unique(frame['Birth_Year'].to_numpy(dtype=np.int64), return_index=True)
+        return cls(frame, cohorts, np.append(starts, len(frame)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            stored = pickle.load(f)
+        return cls(stored['frame'], stored['cohorts'], stored['starts'])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'frame': self.frame, 'cohorts': self.cohorts, 'starts': self.starts}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _ages(self):
+        if 'Age' in self.frame.columns:
+            return self.frame['Age'].to_numpy(dtype=np.int64)
+        return (self.frame['Year'] - self.frame['Birth_Year']).to_numpy(dtype=np.int64)
+
+    def _key(self, birth_year, age):
+        return birth_year * self._age_span + (age - self._min_age)
+
+    def __len__(self):
+        return len(self.cohorts)
+
+    def __contains__(self, birth_year):
+        i = np.searchsorted(self.cohorts, birth_year)
+        return i < len(self.cohorts) and self.cohorts[i] == birth_year
+
+    def rows(self, birth_year):
+        """(start, stop) rows of a cohort; an empty range if it is not in the panel."""
+        i = np.searchsorted(self.cohorts, birth_year)
+        if i < len(self.cohorts) and self.cohorts[i] == birth_year:
+            return int(self.starts[i]), int(self.starts[i + 1])
+        return int(self.starts[i]), int(self.starts[i])
+
+    def cohort(self, birth_year):
+        """Life-course of one cohort (a slice of the frame, ages ascending)."""
+        start, stop = self.rows(birth_year)
+        return self.frame.iloc[start:stop]
+
+    def query(self, cohorts=None, ages=None, columns=None):
+        """
+        Rows of the cohorts born in [cohorts[0], cohorts[1]] at ages in
+        [ages[0], ages[1]] (both ranges inclusive, None for no limit), e.g.
+        query(cohorts=(1960, 1980), ages=(20, 65)).
+
+        Without an age range the result is a single slice of the frame.
+        """
+        first, last = (None, None) if cohorts is None else cohorts
+        lo = 0 if first is None else np.searchsorted(self.cohorts, first)
+        hi = len(self.cohorts) if last is None else np.searchsorted(self.cohorts, last, side='right')
+        frame = self.frame if columns is None else self.frame[columns]
+
+        if ages is None:
+            return frame.iloc[self.starts[lo]:self.starts[hi]]
+
+        # One binary search per selected cohort for the first and last age
+        min_age, max_age = ages
+        selected = self.cohorts[lo:hi]
+        # Clipped to the ages of the panel, so the keys stay within each cohort
+        low_age = self._min_age if min_age is None else max(min_age, self._min_age)
+        high_age = self._min_age + self._age_span - 1
+        if max_age is not None:
+            high_age = min(max_age, high_age)
+        row_lo = np.searchsorted(self._keys, self._key(selected, low_age), side='left')
+        row_hi = np.searchsorted(self._keys, self._key(selected, high_age), side='right')
+        # A range can be empty
+        row_hi = np.maximum(row_hi, row_lo)
+
+        lengths = row_hi - row_lo
+        offsets = np.repeat(row_lo - (np.cumsum(lengths) - lengths), lengths)
+        return frame.iloc[offsets + np.arange(lengths.sum())]
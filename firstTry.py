@@ -1,12 +1,16 @@
 import pandas as pd
 import numpy as np
 
-def create_mock_data():
+from rate_schedule import RateSchedule
+
+def create_mock_data(cohorts=(1960, 1980), start_year=1982, end_year=2068):
     """
     Creates a mock pandas DataFrame that matches the user's description.
     
-    This function generates a panel dataset for two sample cohorts (born 1960 and 1980)
-    over their full lifespan, populating all the data fields you specified.
+    By default this function generates a panel dataset for two sample cohorts
+    (born 1960 and 1980) over their full lifespan, populating all the data
+    fields you specified. Other cohorts and years can be passed to build a
+    larger panel (every cohort other than 1960 gets the 1980 characteristics).
     
     This is necessary to make the main script runnable and to demonstrate
     the logic.
@@ -28,9 +32,7 @@ def create_mock_data():
     # ---
     
     data = []
-    cohorts = [1960, 1980]
-    start_year = 1982
-    end_year = 2068 # Allows 1980 cohort to live to 88
+    # Default end_year (2068) allows the 1980 cohort to live to 88
     
     base_salary = 40000
     base_ceiling = 100000
@@ -107,65 +109,46 @@ def create_mock_data():
     print("Mock data created successfully.")
     return df
 
+# The 2012 reform: the proportional rate goes linearly from 1.85% (for 2012
+# retirement) to 1.60% (for 2052 retirement), flat outside 2012-2052.
+PROPORTIONAL_RATE_SCHEDULE = RateSchedule({2012: 1.85 / 100, 2052: 1.60 / 100}, method='linear')
+
 def get_proportional_rate(retirement_year):
     """
-    Calculates the 'taux de majoration proportionnelle' (Ingredient D).
-    
-    This implements the 2012 reform, which linearly reduces the
-    proportional rate from 1.85% (for 2012 retirement) to 1.60%
-    (for 2052 retirement).
+    Calculates the 'taux de majoration proportionnelle' (Ingredient D),
+    following PROPORTIONAL_RATE_SCHEDULE.
+
+    Works on a single year or on an array of years.
     """
-    start_rate = 1.85 / 100 # 1.85%
-    end_rate = 1.60 / 100   # 1.60%
-    start_year = 2012
-    end_year = 2052
-
-    if retirement_year <= start_year:
-        return start_rate
-    if retirement_year >= end_year:
-        return end_rate
-    
-    # Linear interpolation
-    progress = (retirement_year - start_year) / (end_year - start_year)
-    rate = start_rate - (start_rate - end_rate) * progress
-    
-    return rate
+    return PROPORTIONAL_RATE_SCHEDULE.rates(np.asarray(retirement_year, dtype=float))
 
 def get_lifetime_adjusted_earnings(working_data_slice, is_public):
     """
     Calculates the 'Sum of All Adjusted Lifetime Earnings' (Ingredient C).
     
-    This is the most complex part of the benefit formula. It iterates
+    This is the most complex part of the benefit formula. It sums
     over an agent's entire career to get the total "points"
     for their proportional pension.
     """
-    total_adjusted_earnings = 0
+    return _adjusted_earnings(working_data_slice, is_public).sum()
+
+def _adjusted_earnings(data, is_public):
+    """Adjusted salary of every row (see get_lifetime_adjusted_earnings)."""
+    salary = data['avg_salary']
     
-    for year, row in working_data_slice.iterrows():
-        salary = row['avg_salary']
-        
-        # --- Apply Contribution Ceiling (Régime Général only) ---
-        if not is_public:
-            ceiling = row['contribution_ceiling']
-            contributable_salary = min(salary, ceiling)
-        else:
-            # Public sector ("Régimes Spéciaux") has NO ceiling
-            contributable_salary = salary
-            
-        # --- Adjust Salary (Two-Step Process) ---
-        
-        # 1. Adjust to 1984 Base Year
-        # (This is your 'ajustement factor pour 1984 euros')
-        salary_1984_base = contributable_salary / row['adjustment_factor_1984']
-        
-        # 2. Revalue to Current Standard of Living
-        # (This is your 'revalorisation rate', which I've named
-        # 'revaluation_factor_salary_adj' for clarity)
-        final_adjusted_salary = salary_1984_base * row['revaluation_factor_salary_adj']
-        
-        total_adjusted_earnings += final_adjusted_salary
+    # --- Apply Contribution Ceiling (Régime Général only) ---
+    if not is_public:
+        contributable_salary = np.minimum(salary, data['contribution_ceiling'])
+    else:
+        # Public sector ("Régimes Spéciaux") has NO ceiling
+        contributable_salary = salary
         
-    return total_adjusted_earnings
+    # --- Adjust Salary (Two-Step Process) ---
+    # 1. Adjust to 1984 Base Year ('ajustement factor pour 1984 euros')
+    salary_1984_base = contributable_salary / data['adjustment_factor_1984']
+    
+    # 2. Revalue to Current Standard of Living ('revalorisation rate')
+    return salary_1984_base * data['revaluation_factor_salary_adj']
 
 def calculate_initial_annual_pension(cohort_data):
     """
@@ -178,86 +161,86 @@ def calculate_initial_annual_pension(cohort_data):
     It calculates this separately for the Private and Public agents
     and returns a single, weighted-average IAP.
     """
-    
+    iap = calculate_initial_annual_pensions(cohort_data)
+    return iap['iap'].iloc[0], iap['retirement_year'].iloc[0]
+
+def calculate_initial_annual_pensions(df):
+    """
+    Calculates the "Initial Annual Pension" (IAP) of every cohort at once.
+
+    Returns a DataFrame indexed by cohort with the weighted-average 'iap'
+    and the cohort's 'retirement_year'. Cohorts without working years get
+    an IAP of 0.
+    """
+    years = df.index.get_level_values('year').to_numpy()
+    cohort_of_row = df.index.get_level_values('cohort')
+
     # --- Get key cohort-wide variables ---
-    # We can take these from the first row, they are constant for the cohort
-    first_row = cohort_data.iloc[0]
-    cohort_birth_year = first_row.name[1] # Get cohort from index
-    avg_retirement_age = first_row['avg_retirement_age']
-    public_private_split = first_row['public_private_split']
-    is_pre_1999_regime = first_row['is_pre_1999_regime']
-    
-    retirement_year = cohort_birth_year + avg_retirement_age
-    
-    # Get a DataFrame slice containing only the *working* years for this cohort
-    # The index is (year, cohort), so we access the year part of the index
-    working_years_mask = cohort_data.index.get_level_values('year') < retirement_year
-    working_data = cohort_data[working_years_mask]
-    
-    if working_data.empty:
-        # This cohort hasn't started working yet in the dataset
-        return 0, retirement_year
-        
-    # Get parameters from the *year of retirement*
-    # We need to query the original df for the retirement year data
-    try:
-        retirement_year_data = cohort_data.loc[(retirement_year, cohort_birth_year)]
-        ref_amount_at_retirement = retirement_year_data['reference_amount']
-    except KeyError:
-        # Data for retirement year not in slice, use last available
-        ref_amount_at_retirement = working_data.iloc[-1]['reference_amount']
-
-    career_length = len(working_data)
-
-    # --- 1. Calculate IAP for the "Private Agent" (Régime Général) ---
-    
-    # 1a. Fixed Part (Majorations Forfaitaires)
-    # Based on duration, capped at 40 years
-    fixed_part_private = (min(career_length, 40) / 40) * ref_amount_at_retirement
-    
-    # 1b. Proportional Part (Majorations Proportionnelles)
-    # Based on lifetime income
-    lifetime_earnings_private = get_lifetime_adjusted_earnings(working_data, is_public=False)
-    prop_rate = get_proportional_rate(retirement_year)
-    prop_part_private = lifetime_earnings_private * prop_rate
-    
-    iap_private = fixed_part_private + prop_part_private
+    # These are taken from each cohort's first row, they are constant for the cohort
+    first_rows = df[~cohort_of_row.duplicated()]
+    cohorts = first_rows.index.get_level_values('cohort')
+    per_cohort = pd.DataFrame({
+        'avg_retirement_age': first_rows['avg_retirement_age'].to_numpy(),
+        'public_private_split': first_rows['public_private_split'].to_numpy(),
+        'is_pre_1999_regime': first_rows['is_pre_1999_regime'].to_numpy(),
+    }, index=cohorts)
+    per_cohort['retirement_year'] = per_cohort.index + per_cohort['avg_retirement_age']
 
-    # --- 2. Calculate IAP for the "Public Agent" (Régime Spécial) ---
-    
-    if is_pre_1999_regime == 1:
-        # --- "Old System" (Régime Transitoire) ---
-        # Benefit is based on *last salary*, not lifetime earnings
-        final_salary = working_data.iloc[-1]['avg_salary']
-        iap_public = final_salary * (5/6) # 83.3% of final salary
-        
-    else:
-        # --- "New System" (Post-1999) ---
-        # Benefit formula is same as private, but with NO ceilings
-        
-        # 2a. Fixed Part
-        fixed_part_public = (min(career_length, 40) / 40) * ref_amount_at_retirement
-        
-        # 2b. Proportional Part
-        # We pass is_public=True to ignore the contribution ceiling
-        lifetime_earnings_public = get_lifetime_adjusted_earnings(working_data, is_public=True)
-        # Proportional rate is the same
-        prop_rate_public = get_proportional_rate(retirement_year) 
-        prop_part_public = lifetime_earnings_public * prop_rate_public
-        
-        iap_public = fixed_part_public + prop_part_public
-        # Note: We are ignoring the "no maximum pension" rule for simplicity,
-        # but it could be added here.
+    # Broadcast the retirement year back to the rows
+    row_retirement_year = per_cohort['retirement_year'].reindex(cohort_of_row).to_numpy()
 
-    # --- 3. Calculate Weighted Average IAP for the Cohort ---
-    iap_weighted = (iap_private * (1 - public_private_split)) + (iap_public * public_private_split)
-    
-    return iap_weighted, retirement_year
+    # The *working* years of each cohort
+    working = df[years < row_retirement_year]
+    working_by_cohort = working.groupby(level='cohort', sort=False)
+
+    career_length = working_by_cohort.size().reindex(cohorts, fill_value=0)
+    last_working_row = working_by_cohort.tail(1).droplevel('year')
+
+    # Parameters from the *year of retirement*, or the last working year
+    # when the retirement year is not in the data
+    at_retirement = df[years == row_retirement_year]
+    at_retirement = at_retirement[~at_retirement.index.get_level_values('cohort').duplicated()]
+    ref_amount_at_retirement = (
+        at_retirement['reference_amount'].droplevel('year')
+        .reindex(cohorts)
+        .fillna(last_working_row['reference_amount'].reindex(cohorts))
+    )
+
+    # --- 1. IAP for the "Private Agent" (Régime Général) ---
+    fixed_part = (np.minimum(career_length, 40) / 40) * ref_amount_at_retirement
+    prop_rate = get_proportional_rate(per_cohort['retirement_year'].to_numpy())
+
+    earnings_private = (
+        _adjusted_earnings(working, is_public=False)
+        .groupby(level='cohort', sort=False).sum().reindex(cohorts)
+    )
+    iap_private = fixed_part + earnings_private * prop_rate
+
+    # --- 2. IAP for the "Public Agent" (Régime Spécial) ---
+    # "Old System" (Régime Transitoire): 5/6 of the *last salary*
+    iap_public_old = last_working_row['avg_salary'].reindex(cohorts) * (5/6)
+    # "New System" (Post-1999): same as private, but with NO ceiling
+    earnings_public = (
+        _adjusted_earnings(working, is_public=True)
+        .groupby(level='cohort', sort=False).sum().reindex(cohorts)
+    )
+    iap_public_new = fixed_part + earnings_public * prop_rate
+    iap_public = iap_public_new.where(per_cohort['is_pre_1999_regime'] != 1, iap_public_old)
+
+    # --- 3. Weighted Average IAP for the Cohort ---
+    split = per_cohort['public_private_split']
+    per_cohort['iap'] = (iap_private * (1 - split)) + (iap_public * split)
+
+    # This cohort hasn't started working yet in the dataset
+    per_cohort.loc[career_length == 0, 'iap'] = 0
+    return per_cohort[['iap', 'retirement_year']]
 
 def calculate_in_year_contributions(row):
     """
     Calculates the total contribution for a single year-cohort.
     This is the "tax" paid *in this year*.
+
+    Works on a single row or on a whole DataFrame (one value per row).
     """
     # This agent is working in this year.
     avg_salary = row['avg_salary']
@@ -266,7 +249,7 @@ def calculate_in_year_contributions(row):
     ceiling = row['contribution_ceiling']
     
     # --- Private Sector Contribution (has ceiling) ---
-    contributable_salary_private = min(avg_salary, ceiling)
+    contributable_salary_private = np.minimum(avg_salary, ceiling)
     contribution_private = (1 - split) * contributable_salary_private * rate
     
     # --- Public Sector Contribution (no ceiling) ---
@@ -282,68 +265,55 @@ def calculate_lifetime_flows(df):
     """
     Main function to process the entire panel DataFrame.
     
-    It iterates cohort by cohort, calculates the Initial Annual Pension (IAP)
-    for each, and then iterates year by year to populate the
-    contributions (during work) and benefits (during retirement).
+    It calculates the Initial Annual Pension (IAP) of every cohort, then
+    fills in the contributions (during work) and benefits (during
+    retirement) of every row with column operations.
     """
     print("Calculating lifetime flows...")
+
+    cohort_of_row = df.index.get_level_values('cohort')
+    years = df.index.get_level_values('year').to_numpy()
     
-    # Create new columns, initialized to zero
-    df['total_contributions_paid_in_year'] = 0.0
-    df['total_benefits_received_in_year'] = 0.0
-    
-    # We must process one cohort at a time
-    # We group by the 'cohort' level of the index
-    for cohort_birth_year, cohort_data in df.groupby(level='cohort'):
-        
-        print(f"  Processing Cohort: {cohort_birth_year}")
-        
-        # --- STEP 1: Calculate the IAP for this entire cohort ---
-        # This gives us a single "base pension" value for this cohort
-        # and their average retirement year.
-        initial_annual_pension, retirement_year = calculate_initial_annual_pension(cohort_data)
-        
-        if initial_annual_pension == 0:
-            print(f"    Skipping cohort {cohort_birth_year} (no working data).")
-            continue
-            
-        print(f"    Cohort {cohort_birth_year} IAP: {initial_annual_pension:.2f} (retiring in {retirement_year})")
+    # --- STEP 1: Calculate the IAP of every cohort ---
+    # This gives us a single "base pension" value per cohort
+    # and their average retirement year.
+    iap = calculate_initial_annual_pensions(df)
 
-        # --- STEP 2: Iterate through each year of this cohort's life ---
-        # We now "play" this cohort's life, year by year, and fill in
-        # either the contribution they pay or the benefit they receive.
-        
-        # We need to store the "live" adjusted pension as it grows
-        current_projected_pension = initial_annual_pension
-        
-        for index, row in cohort_data.iterrows():
-            current_year = index[0] # Get year from index
-            age = row['age']
-            avg_retirement_age = row['avg_retirement_age']
-
-            if age < avg_retirement_age:
-                # --- WORKING PHASE ---
-                # Calculate the contributions paid in this year
-                contribution = calculate_in_year_contributions(row)
-                df.loc[index, 'total_contributions_paid_in_year'] = contribution
-                
-            elif age >= avg_retirement_age:
-                # --- RETIREMENT PHASE ---
-                
-                # For the *first year* of retirement, they get the IAP
-                # For all subsequent years, we must adjust the *previous*
-                # year's pension by the new adjustment rate.
-                
-                if current_year == retirement_year:
-                    # First year of retirement
-                    current_projected_pension = initial_annual_pension
-                else:
-                    # Adjust the *previous* year's pension for this year
-                    # This is Ingredient F: Projecting the pension
-                    adjustment_rate = row['pension_adjustment_rate']
-                    current_projected_pension = current_projected_pension * (1 + adjustment_rate)
-
-                df.loc[index, 'total_benefits_received_in_year'] = current_projected_pension
+    skipped = iap.index[iap['iap'] == 0]
+    for cohort_birth_year in skipped:
+        print(f"    Skipping cohort {cohort_birth_year} (no working data).")
+
+    row_iap = iap['iap'].reindex(cohort_of_row).to_numpy()
+    row_retirement_year = iap['retirement_year'].reindex(cohort_of_row).to_numpy()
+    active = row_iap != 0
+
+    # --- STEP 2: Fill in each year of each cohort's life ---
+    is_working = active & (df['age'] < df['avg_retirement_age']).to_numpy()
+    is_retired = active & (df['age'] >= df['avg_retirement_age']).to_numpy()
+
+    # WORKING PHASE: the contributions paid in this year
+    df['total_contributions_paid_in_year'] = np.where(
+        is_working, calculate_in_year_contributions(df), 0.0
+    )
+
+    # RETIREMENT PHASE: the IAP in the retirement year, then the previous
+    # year's pension adjusted by this year's rate (Ingredient F). This is a
+    # cumulative product of (1 + rate) per cohort, restarting at the IAP on
+    # the retirement-year row.
+    retired = df[is_retired]
+    restart = years[is_retired] == row_retirement_year[is_retired]
+    growth = np.where(restart, 1.0, 1 + retired['pension_adjustment_rate'].to_numpy())
+    segment = pd.Series(restart.astype(int), index=retired.index).groupby(level='cohort').cumsum()
+    cumulative_growth = (
+        pd.Series(growth, index=retired.index)
+        .groupby([retired.index.get_level_values('cohort'), segment.to_numpy()])
+        .cumprod()
+    )
+
+    df['total_benefits_received_in_year'] = 0.0
+    df.loc[is_retired, 'total_benefits_received_in_year'] = (
+        row_iap[is_retired] * cumulative_growth.to_numpy()
+    )
 
     print("Calculations complete.")
     return df
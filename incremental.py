@@ -0,0 +1,262 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import merge
+from logs import configure_logging, get_logger, quiet
+from panel_store import load_panel, save_panel, with_format
+from pension_engine import (REGIME_RESULT_COLUMN, RESULT_COLUMNS, compute_cohort_results,
+                            prepare_panel)
+from rate_schedule import RateSchedule
+
+log = get_logger('incremental')
+
+# -----------------------------------------------------------------------------
+# Incremental update after a revision of a yearly series
+# -----------------------------------------------------------------------------
+# index.xls and adapt_salaire.xlsx are yearly series: every (Age, Year) cell
+# of the panel takes the value of its Year. When one of them is revised,
+# only the cells of the revised years change, and only the cohorts living
+# through those years need new results.
+#
+# Instead of rerunning merge.py and Calculations.py, this script:
+#   1. runs the revised stage on a one-row-per-year frame to get the new
+#      value of every year, and compares it with the cached panel,
+#   2. patches the revised years (and the columns derived from them, e.g.
+#      Salary = Income_per_year / Revaleurisation_rate) in the cached panel
+#      of that stage and of every later stage, plus their written files,
+#      and re-keys the cache (and the cohort index of the final panel) so
+#      merge.py sees the pipeline as up to date,
+#   3. recomputes the affected cohorts (Birth_Year = Year - Age of the
+#      patched cells) and merges them into pension_lifetime_results.csv.
+#
+# Only stages with 'year_columns' (see merge.STAGES) can be updated this
+# way; any other change still needs a full run of merge.py.
+
+RESULTS_FILE = 'pension_lifetime_results.csv'
+
+# Columns computed from other columns in a later stage: {column: (inputs, formula)}
+DERIVED_COLUMNS = {
+    'Salary': (['Income_per_year', 'Revaleurisation_rate'],
+               lambda df: df['Income_per_year'] / df['Revaleurisation_rate']),
+}
+
+
+def find_cached(stage, cache_dir=merge.CACHE_DIR):
+    """Path of the cached panel of a stage (any key), or None."""
+    if not os.path.isdir(cache_dir):
+        return None
+    for name in os.listdir(cache_dir):
+        if name.startswith(stage['name'] + '-') and name.endswith('.pkl'):
+            return os.path.join(cache_dir, name)
+    return None
+
+
+def year_values(stage, years):
+    """
+    Value of each of the stage's year_columns for every year, obtained by
+    running the stage itself on one row per year (its output is silenced).
+    """
+    frame = pd.DataFrame({'Age': 0, 'Year': np.asarray(years, dtype=int)})
+    with quiet():
+        frame, _ = stage['run'](frame, stage['params'])
+    return frame.groupby('Year')[stage['year_columns']].first()
+
+
+def revised_years(panel, new_values):
+    """
+    Rows of new_values (one per year) that differ from the panel. The
+    columns of the result hold the new value, NaN where unchanged.
+    """
+    old_values = panel.groupby('Year')[list(new_values.columns)].first()
+    old_values = old_values.reindex(new_values.index)
+    same = np.isclose(old_values.to_numpy(float), new_values.to_numpy(float), equal_nan=True)
+    revised = new_values.where(~same)
+    return revised.dropna(how='all')
+
+
+def patch_frame(df, revisions):
+    """
+    Writes the revised yearly values (see revised_years) into a panel, then
+    recomputes the derived columns on the patched rows. Returns the patched
+    copy and the boolean mask of the patched rows.
+    """
+    df = df.copy()
+    patched = np.zeros(len(df), dtype=bool)
+    patched_columns = []
+    for col in revisions.columns:
+        if col not in df.columns:
+            continue
+        new = df['Year'].map(revisions[col]).to_numpy(float)
+        rows = ~np.isnan(new)
+        if rows.any():
+            df.loc[rows, col] = new[rows]
+            patched |= rows
+            patched_columns.append(col)
+
+    for col, (inputs, formula) in DERIVED_COLUMNS.items():
+        if (col in df.columns and all(c in df.columns for c in inputs)
+                and any(c in patched_columns for c in inputs)):
+            df.loc[patched, col] = formula(df.loc[patched])
+    return df, patched
+
+
+def patch_outputs(stage, revisions, panel, panel_format=merge.PANEL_FORMAT):
+    """Patches the files a stage wrote (typed copy, CSV copy and reports)."""
+    for path in stage['outputs']:
+        binary = with_format(path, panel_format)
+        source = binary if os.path.exists(binary) else path
+        if not os.path.exists(source):
+            continue
+        frame, patched = patch_frame(load_panel(source), revisions)
+        if patched.any():
+            written = save_panel(frame, binary, fmt=panel_format, csv=os.path.exists(path))
+            log.info(f"Patched {int(patched.sum())} rows of '{written}'")
+    for path in stage.get('reports', []):
+        # The stage reports are summary statistics of the panel
+        panel.describe().to_csv(path)
+        log.info(f"Refreshed '{path}'")
+
+
+def update_pipeline(changed_files=None, stages=merge.STAGES, cache_dir=merge.CACHE_DIR,
+                    panel_format=merge.PANEL_FORMAT):
+    """
+    Patches the cached panels (and written files) after a revision of the
+    input of one or more year-only stages. changed_files lists the revised
+    source files; by default the first out-of-date stage is taken as
+    revised, and every year-only stage after it is checked as well.
+
+    Returns (final panel, revisions); revisions holds the new value of every
+    revised year. Returns (None, None) when the revision cannot be applied
+    incrementally and merge.py has to be run instead.
+    """
+    changed_files = [os.path.normpath(path) for path in (changed_files or [])]
+    upstream_key = ''
+    revisions = pd.DataFrame()
+    patching = False
+    panel = None
+
+    for stage in stages:
+        key = merge.stage_cache_key(stage, upstream_key)
+        up_to_date = os.path.exists(merge.cache_path(stage, key, cache_dir))
+        if changed_files:
+            revised = any(os.path.normpath(path) in changed_files for path in stage['inputs'])
+        elif patching:
+            # A later year-only stage may have been revised as well
+            revised = bool(stage.get('year_columns'))
+        else:
+            revised = not up_to_date
+
+        if not revised and not patching:
+            if not up_to_date:
+                log.warning(f"Stage '{stage['name']}' is out of date for another reason. Run merge.py.")
+                return None, None
+            upstream_key = key
+            continue
+
+        old_cache = find_cached(stage, cache_dir)
+        if old_cache is None:
+            log.warning(f"Stage '{stage['name']}' has never been built. Run merge.py.")
+            return None, None
+        panel = pd.read_pickle(old_cache)
+
+        if revised:
+            if not stage.get('year_columns'):
+                log.warning(f"Stage '{stage['name']}' cannot be updated incrementally. Run merge.py.")
+                return None, None
+            new_values = year_values(stage, np.sort(panel['Year'].unique()))
+            stage_revisions = revised_years(panel, new_values)
+            log.info(f"=== Stage '{stage['name']}': {len(stage_revisions)} revised years "
+                  f"{stage_revisions.index.tolist()} ===")
+            revisions = stage_revisions.combine_first(revisions) if patching else stage_revisions
+            patching = True
+        else:
+            log.info(f"=== Stage '{stage['name']}': patching ===")
+
+        panel, patched = patch_frame(panel, revisions)
+        log.info(f"Patched {int(patched.sum())} (Age, Year) cells")
+        patch_outputs(stage, revisions, panel, panel_format)
+        merge.write_cache(stage, key, panel, cache_dir)
+        upstream_key = key
+
+    if panel is None:
+        log.info("No revision found, the pipeline is up to date.")
+    else:
+        merge.write_cohort_index(upstream_key, panel, cache_dir)
+    return panel, revisions
+
+
+def affected_cohorts(panel, revisions):
+    """Birth years with at least one cell in a revised year."""
+    rows = panel['Year'].isin(revisions.index)
+    return np.unique((panel.loc[rows, 'Year'] - panel.loc[rows, 'Age']).to_numpy())
+
+
+def update_results(panel, cohorts, pct_public, work_start_age, prop_rate_table,
+                   results_path=RESULTS_FILE, survival_weighting=False, salary_limits=True,
+                   regimes=None):
+    """
+    Recomputes the given cohorts and merges them into the results file
+    (the other cohorts are kept as they are). Recomputes every cohort if
+    the file is missing or has other columns. The options must be the
+    ones the file was computed with (see compute_cohort_results). Returns
+    the merged table.
+    """
+    columns = RESULT_COLUMNS + [REGIME_RESULT_COLUMN.format(regime['name'])
+                                for regime in (regimes or [])]
+    existing = pd.read_csv(results_path) if os.path.exists(results_path) else None
+    if existing is None or list(existing.columns) != columns:
+        log.info(f"'{results_path}' is missing or outdated, recomputing every cohort.")
+        existing = None
+        subset = panel
+    else:
+        subset = panel[(panel['Year'] - panel['Age']).isin(cohorts)]
+
+    results_df, skipped_df = compute_cohort_results(
+        prepare_panel(subset), pct_public, work_start_age, prop_rate_table,
+        survival_weighting=survival_weighting, salary_limits=salary_limits, regimes=regimes
+    )
+    log.info(f"Recomputed {len(results_df)} cohorts ({len(skipped_df)} skipped).")
+
+    if existing is not None:
+        kept = existing[~existing['Cohort'].isin(cohorts)]
+        results_df = pd.concat([kept, results_df], ignore_index=True)
+        results_df = results_df.sort_values('Cohort').reset_index(drop=True)
+
+    results_df.to_csv(results_path, index=False, float_format='%.2f')
+    log.info(f"--- Results table saved to {os.path.abspath(results_path)} ---")
+    return results_df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply a revision of index.xls / adapt_salaire.xlsx without a full rebuild.")
+    parser.add_argument('files', nargs='*',
+                        help="Revised source files (default: detected from the cache).")
+    parser.add_argument('--cache-dir', default=merge.CACHE_DIR)
+    parser.add_argument('--format', default=merge.PANEL_FORMAT,
+                        choices=['parquet', 'feather', 'pickle'])
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+
+    panel, revisions = update_pipeline(args.files, cache_dir=args.cache_dir,
+                                       panel_format=args.format)
+    if panel is None or revisions.empty:
+        return
+
+    import Calculations
+    cohorts = affected_cohorts(panel, revisions)
+    log.info(f"{len(cohorts)} cohorts affected ({cohorts.min()}-{cohorts.max()}).")
+    update_results(panel, cohorts, Calculations.PCT_PUBLIC, Calculations.WORK_START_AGE,
+                   RateSchedule.of(Calculations.PROP_RATE_TABLE, Calculations.PROP_RATE_INTERPOLATION),
+                   results_path=args.results, survival_weighting=Calculations.SURVIVAL_WEIGHTING,
+                   salary_limits=Calculations.SALARY_LIMITS, regimes=Calculations.pension_regimes())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from logs import get_logger
+
+log = get_logger('ingest')
+
+# -----------------------------------------------------------------------------
+# Source workbooks
+# -----------------------------------------------------------------------------
+# Every Excel source of the pipeline, with the options it is read with.
+# Parsing the workbooks is the slowest part of a cold run, so each parsed
+# source is cached (pickle, keeps the column types) and only parsed again
+# when the file changes. A file whose modification time and size are
+# unchanged is not even hashed; otherwise its SHA-256 decides.
+#
+# load_sources() parses all the out-of-date sources at once in a process
+# pool and returns {path: DataFrame} ({path: {sheet: DataFrame}} for
+# workbooks read with sheet_name=None). load_source() reads a single one
+# through the same cache.
+
+DATA_DIR = os.path.join('Data', 'Manually_cleaned_data')
+SOURCE_CACHE_DIR = os.path.join('.pipeline_cache', 'sources')
+
+POPULATION_FILE = os.path.join(DATA_DIR, 'Population 1960-2024 by age.xlsx')
+PROJECTION_FILE = os.path.join(DATA_DIR, 'Projection total population 2022-2100 by age.xlsx')
+LIFETIME_FILE = os.path.join(DATA_DIR, 'Lifetime 1960-2024 by age.xlsx')
+RETIREMENT_FILE = os.path.join(DATA_DIR, 'ageretraite.xlsx')
+REVALUATION_FILE = os.path.join(DATA_DIR, 'adapt_salaire.xlsx')
+INDEX_FILE = os.path.join(DATA_DIR, 'index.xls')
+WAGES_FILE = os.path.join(DATA_DIR, 'Annual wages.xlsx')
+INCOME_FILE = os.path.join(DATA_DIR, 'Income per year - cleaned_version.xls')
+CEILING_FILE = os.path.join(DATA_DIR, 'plafond.xls')
+MIN_SALARY_FILE = os.path.join(DATA_DIR, 'min_salary.xls')
+SPECIAL_REGIMES_FILE = os.path.join(DATA_DIR, 'specialregims2.xlsx')
+
+# The two columns of ageretraite.xlsx used by the model
+RETIREMENT_COLUMNS = ['Année', 'Pensions de vieillesse et de vieillesse annticipée']
+
+# The two columns of plafond.xls used by the model (annual ceiling, nominal)
+CEILING_COLUMNS = ['Année', 'Plafond cotisable annuel Montant nominal']
+
+# pd.read_excel options of each source
+SOURCES = {
+    POPULATION_FILE: {},
+    PROJECTION_FILE: {},
+    LIFETIME_FILE: {},
+    RETIREMENT_FILE: {'usecols': RETIREMENT_COLUMNS},
+    # The real headers are in the first row, see merge.stage_revaluation
+    REVALUATION_FILE: {'header': None},
+    INDEX_FILE: {},
+    WAGES_FILE: {'header': 0},
+    # Every sheet (one per year)
+    INCOME_FILE: {'sheet_name': None},
+    CEILING_FILE: {'usecols': CEILING_COLUMNS},
+    # Title block above the headers, see merge.stage_salary_limits
+    MIN_SALARY_FILE: {'header': None},
+    SPECIAL_REGIMES_FILE: {},
+}
+
+
+def file_hash(path):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_paths(path, options, cache_dir):
+    """Data and metadata files of the cache entry of (path, options)."""
+    ident = json.dumps([os.path.abspath(path), options], sort_keys=True, default=str)
+    stem = f"{os.path.basename(path)}-{hashlib.sha1(ident.encode()).hexdigest()[:12]}"
+    return os.path.join(cache_dir, stem + '.pkl'), os.path.join(cache_dir, stem + '.json')
+
+
+def _cached(path, options, cache_dir):
+    """
+    Cached parse of a source if the file has not changed, else None.
+    Raises FileNotFoundError if the source does not exist.
+    """
+    stat = os.stat(path)
+    data_path, meta_path = _entry_paths(path, options, cache_dir)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    if meta['mtime'] != stat.st_mtime or meta['size'] != stat.st_size:
+        if meta['hash'] != file_hash(path):
+            return None
+        # Touched but not modified: remember the new modification time
+        meta.update(mtime=stat.st_mtime, size=stat.st_size)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    return pd.read_pickle(data_path)
+
+
+def _store(path, options, data, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = _entry_paths(path, options, cache_dir)
+    stat = os.stat(path)
+    pd.to_pickle(data, data_path)
+    with open(meta_path, 'w') as f:
+        json.dump({'path': path, 'options': options, 'mtime': stat.st_mtime,
+                   'size': stat.st_size, 'hash': file_hash(path)}, f, default=str)
+
+
+def _parse(path, options):
+    """Worker: parses one workbook."""
+    return pd.read_excel(path, **options)
+
+
+def load_source(path, cache_dir=None, **options):
+    """
+    Reads one source workbook through the cache (default: SOURCE_CACHE_DIR).
+    The options default to the ones registered in SOURCES. Raises
+    FileNotFoundError if it is missing.
+    """
+    cache_dir = cache_dir or SOURCE_CACHE_DIR
+    if not options:
+        options = SOURCES.get(path, {})
+    data = _cached(path, options, cache_dir)
+    if data is None:
+        data = _parse(path, options)
+        _store(path, options, data, cache_dir)
+    return data
+
+
+def load_sources(sources=None, cache_dir=None, workers=None):
+    """
+    Reads several source workbooks: {path: options} (default: SOURCES) or
+    a list of paths registered in SOURCES. Cached sources are loaded
+    directly; the others are parsed concurrently, `workers` processes at
+    most (default: one per workbook, up to the number of cores).
+
+    Returns {path: DataFrame}. Raises FileNotFoundError for a missing file.
+    The cache is in cache_dir (default: SOURCE_CACHE_DIR).
+    """
+    cache_dir = cache_dir or SOURCE_CACHE_DIR
+    if sources is None:
+        sources = SOURCES
+    elif not isinstance(sources, dict):
+        sources = {path: SOURCES.get(path, {}) for path in sources}
+
+    loaded, to_parse = {}, []
+    for path, options in sources.items():
+        data = _cached(path, options, cache_dir)
+        if data is None:
+            to_parse.append(path)
+        else:
+            loaded[path] = data
+
+    if to_parse:
+        workers = min(workers or os.cpu_count() or 1, len(to_parse))
+        log.info(f"Parsing {len(to_parse)} source workbooks ({workers} processes)...")
+        if workers == 1:
+            parsed = [_parse(path, sources[path]) for path in to_parse]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = list(pool.map(_parse, to_parse, [sources[path] for path in to_parse]))
+        for path, data in zip(to_parse, parsed):
+            _store(path, sources[path], data, cache_dir)
+            loaded[path] = data
+
+    return {path: loaded[path] for path in sources}
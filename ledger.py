@@ -0,0 +1,170 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from logs import configure_logging, get_logger
+from panel_store import load_panel
+from pension_engine import build_cohort_grid, evaluate_cohorts, prepare_panel
+from rate_schedule import RateSchedule
+from streaming import ResultWriter
+
+log = get_logger('ledger')
+
+# -----------------------------------------------------------------------------
+# Year-by-year cashflow ledger
+# -----------------------------------------------------------------------------
+# The results table holds lifetime totals per cohort. The ledger holds the
+# flows behind them: one row per (Birth_Year, Year) where the cohort
+# contributes or receives a pension, with the contribution and the benefit
+# of one member of the cohort that year (see the `ledger` option of
+# pension_engine.evaluate_cohorts), the cohort's Population and the
+# Contributing / Retired flags. Under microsimulation there is one row per
+# agent and year (Agent column), and Population is the agent's share of
+# the cohort (see microsim.run_microsimulation).
+#
+# The flows are computed for all cohorts at once on the (Birth_Year x Age)
+# grid; the rows are then picked with one np.nonzero per chunk of cohorts
+# and appended to a columnar file (Parquet, or CSV) chunk by chunk, so the
+# whole long table is never held in memory.
+#
+# Aggregates over the system are then a groupby on the file instead of a
+# new run of the model, e.g. system_balance(): contributions, benefits,
+# contributors and pensioners per year (weighted by Population) and the
+# dependency ratio. Benefit years past the last year of the panel are in
+# the ledger with a NaN Population.
+
+LEDGER_COLUMNS = [
+    'Birth_Year', 'Year', 'Age', 'Population', 'Contribution', 'Benefit',
+    'Contributing', 'Retired'
+]
+
+# Ledger column of each flow array returned by the engine
+LEDGER_FLOWS = {
+    'Contribution': 'Contribution_flows',
+    'Benefit': 'Benefit_flows',
+    'Contributing': 'Contributing',
+    'Retired': 'Retired',
+}
+
+COHORTS_PER_CHUNK = 20
+
+
+def ledger_frame(grid, rows, flows, population_weight=1.0, agents=None):
+    """
+    Long ledger rows of a block of (row x age) flow arrays: `rows` gives
+    the grid row (cohort) of each row of the arrays, `flows` the arrays by
+    engine name (LEDGER_FLOWS). Only the years where the row contributes
+    or is retired are kept, in (row, Age) order. population_weight scales
+    the Population (e.g. 1 / n_agents); `agents`, when given, is the Agent
+    id of each row.
+    """
+    row_idx, age_idx = np.nonzero(flows['Contributing'] | flows['Retired'])
+    grid_row = np.asarray(rows)[row_idx]
+    birth_year = grid['cohorts'][grid_row]
+    age = grid['ages'][age_idx]
+
+    ledger = {'Birth_Year': birth_year}
+    if agents is not None:
+        ledger['Agent'] = np.asarray(agents)[row_idx]
+    ledger.update({
+        'Year': birth_year + age,
+        'Age': age,
+        'Population': grid['Population'][grid_row, age_idx] * population_weight,
+    })
+    for column, name in LEDGER_FLOWS.items():
+        ledger[column] = flows[name][row_idx, age_idx]
+    return pd.DataFrame(ledger)
+
+
+def iter_ledger(grid, pct_public, work_start_age, prop_rate_table,
+                cohorts_per_chunk=COHORTS_PER_CHUNK, **options):
+    """
+    Generator of ledger chunks (DataFrames with the LEDGER_COLUMNS) for
+    every cohort of the grid, cohorts_per_chunk birth years at a time.
+    `options` are passed to pension_engine.evaluate_cohorts.
+    """
+    results = evaluate_cohorts(grid, pct_public, work_start_age, prop_rate_table,
+                               ledger=True, **options)
+    flows = {name: results[name] for name in LEDGER_FLOWS.values()}
+    if flows['Contributing'].ndim != 2:
+        raise ValueError("The ledger needs a (Birth_Year x Age) grid without path dimensions.")
+    for first in range(0, len(grid['cohorts']), cohorts_per_chunk):
+        block = slice(first, first + cohorts_per_chunk)
+        rows = np.arange(len(grid['cohorts']))[block]
+        yield ledger_frame(grid, rows, {name: values[block] for name, values in flows.items()})
+
+
+def write_ledger(df, path, pct_public, work_start_age, prop_rate_table, grid=None,
+                 cohorts_per_chunk=COHORTS_PER_CHUNK, **options):
+    """
+    Computes the ledger of the panel and writes it to `path` (.parquet or
+    .csv) chunk by chunk. A prebuilt grid (see build_cohort_grid) can be
+    passed instead of re-pivoting the panel. Returns the number of rows.
+    """
+    if grid is None:
+        grid = build_cohort_grid(prepare_panel(df))
+    with ResultWriter(path) as writer:
+        for chunk in iter_ledger(grid, pct_public, work_start_age, prop_rate_table,
+                                 cohorts_per_chunk=cohorts_per_chunk, **options):
+            writer.write(chunk)
+    return writer.rows
+
+
+def system_balance(path, by='Year'):
+    """
+    Aggregates a ledger file per `by` (default: per year): total
+    contributions and benefits (flows weighted by Population), Balance,
+    Contributors and Pensioners (Population contributing or retired) and
+    the Dependency_ratio (pensioners per contributor).
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    ledger = load_panel(path, columns=keys + ['Population', 'Contribution', 'Benefit',
+                                              'Contributing', 'Retired'])
+    population = ledger['Population'].fillna(0)
+    weighted = pd.DataFrame({
+        'Contributions': ledger['Contribution'] * population,
+        'Benefits': ledger['Benefit'] * population,
+        'Contributors': population.where(ledger['Contributing'].astype(bool), 0),
+        'Pensioners': population.where(ledger['Retired'].astype(bool), 0),
+    })
+    for key in keys:
+        weighted[key] = ledger[key]
+    balance = weighted.groupby(keys, sort=True).sum().reset_index()
+    balance['Balance'] = balance['Contributions'] - balance['Benefits']
+    balance['Dependency_ratio'] = balance['Pensioners'] / balance['Contributors'].replace(0, np.nan)
+    return balance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the yearly cashflow ledger of every cohort.")
+    parser.add_argument('--panel', default=None,
+                        help="Panel file (default: Calculations.FILE_PATH).")
+    parser.add_argument('--output', default='pension_ledger.parquet',
+                        help="Ledger file, .parquet or .csv.")
+    parser.add_argument('--cohorts-per-chunk', type=int, default=COHORTS_PER_CHUNK)
+    parser.add_argument('--balance', default=None,
+                        help="Also write the system balance per year to this CSV file.")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    import Calculations
+    panel_path = args.panel or Calculations.FILE_PATH
+    log.info(f"Writing the cashflow ledger of '{panel_path}'...")
+    rows = write_ledger(
+        load_panel(panel_path), args.output, Calculations.PCT_PUBLIC, Calculations.WORK_START_AGE,
+        RateSchedule.of(Calculations.PROP_RATE_TABLE, Calculations.PROP_RATE_INTERPOLATION),
+        cohorts_per_chunk=args.cohorts_per_chunk,
+        survival_weighting=Calculations.SURVIVAL_WEIGHTING,
+        salary_limits=Calculations.SALARY_LIMITS, regimes=Calculations.pension_regimes())
+    log.info(f"--- Ledger ({rows} rows) saved to {os.path.abspath(args.output)} ---")
+
+    if args.balance:
+        system_balance(args.output).to_csv(args.balance, index=False, float_format='%.2f')
+        log.info(f"--- System balance per year saved to {os.path.abspath(args.balance)} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------
+# Logging and run summary
+# -----------------------------------------------------------------------------
+# Every module logs through a child of the 'pension' logger (get_logger) with
+# levels instead of print():
+#   - INFO:    progress messages (what the scripts used to print),
+#   - DEBUG:   DataFrame previews and per-cohort details (only formatted
+#              when DEBUG is on, so they cost nothing otherwise),
+#   - WARNING: problems worth a look.
+# Nothing is shown until configure_logging() is called. The interactive
+# scripts (merge.py, Calculations.py, ...) call it at INFO; batch entry
+# points (sweeps, Monte Carlo, microsimulation) call it with batch=True,
+# which only lets errors through. PENSION_LOG_LEVEL overrides the level.
+#
+# Warnings that repeat per cohort (e.g. cohorts skipped for missing data)
+# are collected in the run summary instead of being printed one by one:
+# SUMMARY holds them by category, together with the time spent in each
+# stage (SUMMARY.timed), and can be written to a JSON file.
+
+LOGGER_NAME = 'pension'
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+
+def get_logger(name):
+    """Logger of a module, e.g. get_logger('merge')."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class _ConsoleFormatter(logging.Formatter):
+    """Plain messages; warnings and errors are prefixed with their level."""
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+
+def configure_logging(level='INFO', batch=False, log_file=None):
+    """
+    Sends the 'pension' logs to the console (and to log_file, with
+    timestamps, when given). batch=True only shows errors. The
+    PENSION_LOG_LEVEL environment variable overrides both.
+    """
+    level = os.environ.get('PENSION_LOG_LEVEL', 'ERROR' if batch else level)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    for handler in list(logger.handlers):
+        if not isinstance(handler, logging.NullHandler):
+            logger.removeHandler(handler)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(_ConsoleFormatter('%(message)s'))
+    logger.addHandler(console)
+    if log_file:
+        to_file = logging.FileHandler(log_file)
+        to_file.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(to_file)
+    return logger
+
+
+@contextmanager
+def quiet(level=logging.ERROR):
+    """Silences the 'pension' logs below `level` inside the block."""
+    logger = logging.getLogger(LOGGER_NAME)
+    previous = logger.level
+    logger.setLevel(max(level, logger.getEffectiveLevel()))
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
+
+
+class RunSummary:
+    """Stage timings and aggregated warnings of a run."""
+
+    def __init__(self):
+        self.timings = []
+        self.warnings = {}
+
+    def reset(self):
+        self.timings = []
+        self.warnings = {}
+
+    @contextmanager
+    def timed(self, stage):
+        """Records the wall time spent in the block under `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append({'stage': stage, 'seconds': round(time.perf_counter() - start, 6)})
+
+    def add_warning(self, category, item):
+        """Adds one item (e.g. {'Cohort': 1932, 'Reason': ...}) to a warning category."""
+        self.warnings.setdefault(category, []).append(item)
+
+    def add_warnings(self, category, items):
+        self.warnings.setdefault(category, []).extend(items)
+
+    def log_counts(self, logger):
+        """One warning line per category, with the number of items."""
+        for category, items in self.warnings.items():
+            logger.warning(f"{category}: {len(items)} (details in the run summary)")
+
+    def to_dict(self):
+        return {'timings': list(self.timings), 'warnings': dict(self.warnings)}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        return path
+
+
+# Summary of the current run
+SUMMARY = RunSummary()
@@ -1,824 +1,934 @@
+import argparse
+import contextlib
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+
 import pandas as pd
 import numpy as np
 
-# Define the file path
-input_file = r'Data\Manually_cleaned_data\Population 1960-2024 by age.xlsx'
-
-# --- 1. Load and Prepare the Data ---
-try:
-    df = pd.read_excel(input_file)
-except FileNotFoundError:
-    print(f"Error: The file '{input_file}' was not found.")
-    # Exit or handle error appropriately
-    exit()
-
-# Rename the 'TIME' column to 'Age'
-df = df.rename(columns={'TIME': 'Age'})
-
-# --- 2. Transform the Data ---
-# Use pd.melt() to 'unpivot' the table
-# - id_vars: The column(s) to keep as identifiers (don't unpivot).
-# - var_name: The name for the new column holding the old column headers (the years).
-# - value_name: The name for the new column holding the values.
-print("Starting data transformation with melt()...")
-panel_df = df.melt(id_vars=['Age'], 
-                   var_name='Year', 
-                   value_name='Population')
-
-# --- 3. Clean Final DataFrame ---
-# Same cleaning steps as in Solution 1
-panel_df['Population'] = panel_df['Population'].astype(str).str.replace(',', '')
-panel_df['Population'] = pd.to_numeric(panel_df['Population'], errors='coerce')
-panel_df = panel_df.dropna(subset=['Population'])
-
-# Convert Year column to integer and sort
-panel_df['Year'] = panel_df['Year'].astype(int)
-panel_df = panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-print("Transformation complete.")
-print(panel_df.head())
-panel_df.to_csv('population_panel_data.csv', index=False)
-
-panel_pop_1960_2024 = panel_df
-
-
-
-
-
-# Define the file path
-input_file = r'Data\Manually_cleaned_data\Projection total population 2022-2100 by age.xlsx'
-
-# --- 1. Load and Prepare the Data ---
-try:
-    df = pd.read_excel(input_file)
-except FileNotFoundError:
-    print(f"Error: The file '{input_file}' was not found.")
-    # Exit or handle error appropriately
-    exit()
-
-# Rename the 'TIME' column to 'Age'
-df = df.rename(columns={'TIME': 'Age'})
-
-# --- 2. Transform the Data ---
-# Use pd.melt() to 'unpivot' the table
-# - id_vars: The column(s) to keep as identifiers (don't unpivot).
-# - var_name: The name for the new column holding the old column headers (the years).
-# - value_name: The name for the new column holding the values.
-print("Starting data transformation with melt()...")
-panel_df = df.melt(id_vars=['Age'], 
-                   var_name='Year', 
-                   value_name='Population')
-
-# --- 3. Clean Final DataFrame ---
-# Same cleaning steps as in Solution 1
-panel_df['Population'] = panel_df['Population'].astype(str).str.replace(',', '')
-panel_df['Population'] = pd.to_numeric(panel_df['Population'], errors='coerce')
-panel_df = panel_df.dropna(subset=['Population'])
-
-# Convert Year column to integer and sort
-panel_df['Year'] = panel_df['Year'].astype(int)
-panel_df = panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-print("Transformation complete.")
-print(panel_df.head())
-panel_df.to_csv('population_panel_data_projected.csv', index=False)
-
-
-panel_pop_2025_2100 = panel_df
-
-
-# --- 4. Combine the DataFrames ---
-# This code handles the overlap in years (e.g., 2022-2024) by
-# keeping the data from the first file (historical) and only
-# adding new years from the second file (projection).
-
-print("Combining DataFrames...")
-
-# Get the last year from the historical data (panel_pop_1960_2024)
-last_historical_year = panel_pop_1960_2024['Year'].max()
-print(f"Last year in historical data: {last_historical_year}")
-
-# Filter the projection data to only include years *after* the last historical year
-panel_pop_future_only = panel_pop_2025_2100[panel_pop_2025_2100['Year'] > last_historical_year]
-
-# Use pd.concat() to stack the two DataFrames vertically
-# panel_pop_1960_2024 (contains 1960 -> 2024)
-# panel_pop_future_only (contains 2025 -> 2100)
-combined_panel_df = pd.concat([panel_pop_1960_2024, panel_pop_future_only], ignore_index=True)
-
-# Sort the final combined DataFrame by Age and then Year for a clean, continuous timeline
-combined_panel_df = combined_panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-# --- 5. Save the Final Combined DataFrame ---
-combined_panel_df.to_csv('population_panel_data_combined_1960-2100.csv', index=False)
-
-print("Final combined DataFrame created and saved as 'population_panel_data_combined_1960-2100.csv'")
-print("\nCombined DataFrame Head:")
-print(combined_panel_df.head())
-print("\nCombined DataFrame Tail (showing future data):")
-print(combined_panel_df.tail())
-
-
-
-
-
-
-
-# Define the file path
-input_file = r'Data\Manually_cleaned_data\Lifetime 1960-2024 by age.xlsx'
-
-# --- 1. Load and Prepare the Data ---
-try:
-    df = pd.read_excel(input_file)
-except FileNotFoundError:
-    print(f"Error: The file '{input_file}' was not found.")
-    # Exit or handle error appropriately
-    exit()
-
-# Rename the 'TIME' column to 'Age'
-df = df.rename(columns={'TIME': 'Age'})
-
-# --- 2. Transform the Data ---
-# Use pd.melt() to 'unpivot' the table
-# - id_vars: The column(s) to keep as identifiers (don't unpivot).
-# - var_name: The name for the new column holding the old column headers (the years).
-# - value_name: The name for the new column holding the values.
-print("Starting data transformation with melt()...")
-panel_df = df.melt(id_vars=['Age'], 
-                   var_name='Year', 
-                   value_name='Life_Expectancy')
-
-# --- 3. Clean Final DataFrame ---
-# Same cleaning steps as in Solution 1
-panel_df['Life_Expectancy'] = panel_df['Life_Expectancy'].astype(str).str.replace(',', '')
-panel_df['Life_Expectancy'] = pd.to_numeric(panel_df['Life_Expectancy'], errors='coerce')
-panel_df = panel_df.dropna(subset=['Life_Expectancy'])
-
-# Convert Year column to integer and sort
-panel_df['Year'] = panel_df['Year'].astype(int)
-panel_df = panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-# Ensure 'Age' is numeric (coerce non-numeric to NaN) so comparison works
-panel_df['Age'] = pd.to_numeric(panel_df['Age'], errors='coerce')
-
-# panel_df.loc[panel_df['Age'] > 90, 'Life_Expectancy'] = 5
-
-
-
-print("Transformation complete.")
-print(panel_df.head())
-panel_df.to_csv('life_expectancy_panel_data.csv', index=False)
-
-
-panel_lifeexp = panel_df
-
-
-
-
-
-
-
-
-# --- 5. Prepare Life Expectancy Data for Merging ---
-# This section "stretches" the panel_lifeexp data to match the
-# full Age and Year range of combined_panel_df, using your rules.
-
-print("--- Starting Life Expectancy Data Preparation ---")
-
-# First, get the boundaries from the life expectancy data
-max_le_age = panel_lifeexp['Age'].max()
-min_le_year = panel_lifeexp['Year'].min()
-max_le_year = panel_lifeexp['Year'].max()
-
-# Then, get the target boundaries from the main combined data
-target_max_age = combined_panel_df['Age'].max()
-target_min_year = combined_panel_df['Year'].min()
-target_max_year = combined_panel_df['Year'].max()
-
-print(f"Life Expectancy data bounds: Age <= {max_le_age}, Years {min_le_year}-{max_le_year}")
-print(f"Target data bounds: Age <= {target_max_age}, Years {target_min_year}-{target_max_year}")
-
-# --- Rule 3: Extrapolate Ages > 83 ---
-# "For all ages above 83 the life expectancy must be the same as for person of age 83."
-
-# Get the complete life expectancy data for the oldest available age
-lifeexp_at_max_age = panel_lifeexp[panel_lifeexp['Age'] == max_le_age]
-
-# This list will hold our original data + the new extrapolated age data
-age_dfs_to_append = [panel_lifeexp]
-
-if target_max_age > max_le_age:
-    print(f"Extrapolating data for ages {max_le_age + 1} to {target_max_age}...")
-    # Loop from the next age up to the target max age
-    for age in range(max_le_age + 1, target_max_age + 1):
-        # Copy the data from the max age (e.g., 83)
-        new_age_df = lifeexp_at_max_age.copy()
-        # Re-assign the 'Age' column to the new, older age
-        new_age_df['Age'] = age
-        age_dfs_to_append.append(new_age_df)
-
-# Rebuild the DataFrame with the new ages included
-panel_lifeexp_filled_age = pd.concat(age_dfs_to_append, ignore_index=True)
-
-
-# --- Rules 1 & 2: Extrapolate Years < 1971 and > 2023 ---
-# "For all years before 1971... use the value of 1971"
-# "For all years after 2023... use the same as in 2023"
-
-# Get the data for the earliest and latest available years
-# (from the new, age-filled DataFrame)
-lifeexp_at_min_year = panel_lifeexp_filled_age[panel_lifeexp_filled_age['Year'] == min_le_year]
-lifeexp_at_max_year = panel_lifeexp_filled_age[panel_lifeexp_filled_age['Year'] == max_le_year]
-
-# This list will hold our age-filled data + the new extrapolated year data
-year_dfs_to_append = [panel_lifeexp_filled_age]
-
-# Rule 1: Fill past years (e.g., 1960 to 1970)
-if target_min_year < min_le_year:
-    print(f"Extrapolating data for past years {target_min_year} to {min_le_year - 1}...")
-    for year in range(target_min_year, min_le_year):
-        # Copy the data from the earliest year (e.g., 1971)
-        new_year_df = lifeexp_at_min_year.copy()
-        # Re-assign the 'Year' to the new, past year
-        new_year_df['Year'] = year
-        year_dfs_to_append.append(new_year_df)
-
-# Rule 2: Fill future years (e.g., 2024 to 2100)
-if target_max_year > max_le_year:
-    print(f"Extrapolating data for future years {max_le_year + 1} to {target_max_year}...")
-    for year in range(max_le_year + 1, target_max_year + 1):
-        # Copy the data from the latest year (e.g., 2023)
-        new_year_df = lifeexp_at_max_year.copy()
-        # Re-assign the 'Year' to the new, future year
-        new_year_df['Year'] = year
-        year_dfs_to_append.append(new_year_df)
-
-# Rebuild the final, fully-filled DataFrame
-# This DataFrame now has a 'Life_Expectancy' value for every 'Age'/'Year' combination
-panel_lifeexp_ready_to_merge = pd.concat(year_dfs_to_append, ignore_index=True)
-
-
-# --- 6. Perform the Final Merge ---
-print("Merging population data with prepared life expectancy data...")
-
-# We use a 'left' merge to ensure we keep all rows from the main
-# 'combined_panel_df' and add the 'Life_Expectancy' column.
-# Because we manually filled the data, there will be no new NaNs.
-final_combined_df = pd.merge(
-    combined_panel_df,
-    panel_lifeexp_ready_to_merge,
-    on=['Age', 'Year'],
-    how='left'
-)
-
-# Sort for a clean final table
-final_combined_df = final_combined_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-# Save the final result
-final_combined_df.to_csv('population_and_life_exp_panel_data_1960-2100.csv', index=False)
-
-print("\n--- Merge Complete ---")
-print("Final combined DataFrame with Population and Life Expectancy:")
-print(final_combined_df.head())
-print("...")
-print(final_combined_df.tail())
-print("Saved to 'population_and_life_exp_panel_data_1960-2100.csv'")
-
-
-
-try:
-    # Get the 2023 Life Expectancy for each unique Age group
-    le_2023_by_age = final_combined_df[final_combined_df['Year'] == 2023].set_index('Age')['Life_Expectancy']
-except KeyError:
-    # This handles cases where 2023 data might not be present for all ages,
-    # or if the data structure is unexpected, focusing on robustness.
-    print("Warning: Could not find 'Life_Expectancy' for all 'Age' groups in 2023. Check your data.")
-    # Fallback: fill only for those where 2023 data exists
-    le_2023_by_age = final_combined_df[final_combined_df['Year'] == 2023].set_index('Age')['Life_Expectancy']
-
-
-# Step 2: Fill the missing 'Life_Expectancy' values (NaN) only for years > 2023.
-
-# a. Filter to the rows that are missing 'Life_Expectancy' AND are after 2023.
-missing_le_mask = final_combined_df['Life_Expectancy'].isna()
-future_years_mask = final_combined_df['Year'] > 2023
-impute_mask = missing_le_mask & future_years_mask
-
-# b. For these specific rows, use the 'Age' column to look up the corresponding 2023 value
-# from our pre-calculated 'le_2023_by_age' Series.
-final_combined_df.loc[impute_mask, 'Life_Expectancy'] = final_combined_df.loc[impute_mask, 'Age'].map(le_2023_by_age)
-
-# Save the final result
-final_combined_df.to_csv('population_and_life_exp_panel_data_1960-2100_interpolated.csv', index=False)
-
-
-
-
-
-
-
-
-
-
-# --- 7. Load and Prepare Retirement Age Data ---
-print("\n--- Starting Retirement Age Data Preparation ---")
-
-# Define file path and the *only* columns to load
-retire_file = r'Data\Manually_cleaned_data\ageretraite.xlsx'
-target_cols = ['Année', 'Pensions de vieillesse et de vieillesse annticipée']
-
-try:
-    # Use 'usecols' to load only the two required columns
-    df_retire = pd.read_excel(retire_file, usecols=target_cols)
-except FileNotFoundError:
-    print(f"Error: The file '{retire_file}' was not found.")
-    # Exit or handle error appropriately
-    exit()
-except ValueError as e:
-    # This error happens if the specified columns aren't in the file
-    print(f"Error: Could not find required columns in '{retire_file}'. Check names.")
-    print(f"Details: {e}")
-    exit()
-
-# Rename columns for clarity and consistency
-df_retire = df_retire.rename(columns={
-    'Année': 'Year',
-    'Pensions de vieillesse et de vieillesse annticipée': 'Retirement_age'
-})
-
-# --- 8. Extrapolate Retirement Age Data (1960-2100) ---
-
-# Get boundaries from the loaded retirement data
-min_retire_year = df_retire['Year'].min() # Should be 1991
-max_retire_year = df_retire['Year'].max() # Should be 2023
-
-# Get target boundaries from the main combined DataFrame
-target_min_year = final_combined_df['Year'].min() # Should be 1960
-target_max_year = final_combined_df['Year'].max() # Should be 2100
-
-print(f"Retirement data bounds: Years {min_retire_year}-{max_retire_year}")
-print(f"Target data bounds: Years {target_min_year}-{target_max_year}")
-
-# Get the specific values for extrapolation as per the rules
-# Value for years before 1991 (use 1991's value)
-val_pre_1991 = df_retire[df_retire['Year'] == min_retire_year]['Retirement_age'].iloc[0]
-# Value for years after 2023 (use 2023's value)
-val_post_2023 = df_retire[df_retire['Year'] == max_retire_year]['Retirement_age'].iloc[0]
-
-# This list will hold our original data + new extrapolated data
-dfs_to_append = [df_retire]
-
-# Rule 1: Fill past years (e.g., 1960 to 1990)
-if target_min_year < min_retire_year:
-    print(f"Extrapolating retirement age for past years {target_min_year} to {min_retire_year - 1}...")
-    # Create a DataFrame for all past years at once
-    past_years = range(target_min_year, min_retire_year)
-    df_past = pd.DataFrame({
-        'Year': past_years,
-        'Retirement_age': val_pre_1991
-    })
-    dfs_to_append.append(df_past)
-
-# Rule 2: Fill future years (e.g., 2024 to 2100)
-if target_max_year > max_retire_year:
-    print(f"Extrapolating retirement age for future years {max_retire_year + 1} to {target_max_year}...")
-    # Create a DataFrame for all future years at once
-    future_years = range(max_retire_year + 1, target_max_year + 1)
-    df_future = pd.DataFrame({
-        'Year': future_years,
-        'Retirement_age': val_post_2023
+from Wages_Calculation import Reval_avg_An_wages, Wages_Calculation
+from cohort_index import CohortIndex
+from ingest import (CEILING_COLUMNS, CEILING_FILE, INCOME_FILE, INDEX_FILE,
+                    LIFETIME_FILE, MIN_SALARY_FILE, POPULATION_FILE, PROJECTION_FILE,
+                    RETIREMENT_COLUMNS, RETIREMENT_FILE, REVALUATION_FILE, WAGES_FILE,
+                    file_hash, load_source, load_sources)
+from logs import SUMMARY, configure_logging, get_logger
+from panel_extend import extend_panel
+from panel_store import default_format, save_panel, with_format
+from profiling import PROFILER, cprofile
+
+log = get_logger('merge')
+
+# -----------------------------------------------------------------------------
+# Staged build of the 1960-2100 panel
+# -----------------------------------------------------------------------------
+# The panel is built by a chain of named stages (population -> projection ->
+# life_expectancy -> retirement_age -> revaluation -> index -> salary_limits
+# -> wages). Each stage declares the source files it reads, its parameters
+# and the panels it writes (typed Parquet, plus an optional CSV export, see panel_store.py).
+# The source workbooks are parsed in parallel and cached (see ingest.py).
+# Source tables that stop short of the panel's ages or years are extended
+# to it in one pass (see panel_extend.py) and joined onto the sorted panel
+# without re-sorting it (see join_sources).
+# The panel produced by a stage is cached under a hash of its
+# input files, parameters, code (the stage function and the helpers it
+# calls) and upstream stage, so a rerun only rebuilds
+# the stages that are out of date (e.g. editing ageretraite.xlsx rebuilds
+# retirement_age and the stages after it). The final panel is also cached
+# sorted by cohort, with its cohort-diagonal index (see cohort_index.py),
+# which Calculations.py loads instead of parsing the panel file.
+
+CACHE_DIR = '.pipeline_cache'
+
+# Format of the written panels and whether a CSV copy is exported too
+PANEL_FORMAT = default_format()
+WRITE_CSV = True
+
+# Whether the intermediate panels of the stages before the last one are
+# written too (the final panel and the reports always are)
+WRITE_SNAPSHOTS = True
+
+# Yearly growth of the wages after the last projected year (2050), shared
+# by the wages and the salary limits indexed to them
+FUTURE_WAGE_GROWTH = 1
+
+
+def read_excel_or_exit(input_file, **kwargs):
+    """
+    Reads an Excel source file (through the parsed-workbook cache, see
+    ingest.py), stopping the pipeline if it is missing.
+    """
+    try:
+        return load_source(input_file, **kwargs)
+    except FileNotFoundError:
+        log.error(f"Error: The file '{input_file}' was not found.")
+        sys.exit(1)
+
+
+def load_age_year_panel(input_file, value_name, coerce_age=False):
+    """
+    Loads an (Age x Year) Excel table and unpivots it to a long panel
+    with the columns Age, Year and <value_name>.
+    """
+    # --- 1. Load and Prepare the Data ---
+    df = read_excel_or_exit(input_file)
+
+    # Rename the 'TIME' column to 'Age'
+    df = df.rename(columns={'TIME': 'Age'})
+
+    # --- 2. Transform the Data ---
+    # Use pd.melt() to 'unpivot' the table
+    # - id_vars: The column(s) to keep as identifiers (don't unpivot).
+    # - var_name: The name for the new column holding the old column headers (the years).
+    # - value_name: The name for the new column holding the values.
+    log.info("Starting data transformation with melt()...")
+    panel_df = df.melt(id_vars=['Age'],
+                       var_name='Year',
+                       value_name=value_name)
+
+    # --- 3. Clean Final DataFrame ---
+    panel_df[value_name] = panel_df[value_name].astype(str).str.replace(',', '')
+    panel_df[value_name] = pd.to_numeric(panel_df[value_name], errors='coerce')
+    panel_df = panel_df.dropna(subset=[value_name])
+
+    # Convert Year column to integer and sort
+    panel_df['Year'] = panel_df['Year'].astype(int)
+    panel_df = panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
+
+    if coerce_age:
+        # Ensure 'Age' is numeric (coerce non-numeric to NaN) so comparison works
+        panel_df['Age'] = pd.to_numeric(panel_df['Age'], errors='coerce')
+
+    log.info("Transformation complete.")
+    log.debug("%s", panel_df.head())
+    return panel_df
+
+
+# -----------------------------------------------------------------------------
+# Joining sources onto the panel
+# -----------------------------------------------------------------------------
+# The panel is sorted by (Age, Year) once, when the population is combined.
+# join_sources() then adds the columns of any number of sources to it in a
+# single step: each source, keyed by Year or by (Age, Year), is aligned on
+# the panel's keys with an index lookup and its columns are assigned as new
+# columns. Unlike a chain of pd.merge + sort_values, this neither copies
+# nor re-sorts the panel for every source, and the panel keeps its row order.
+
+PANEL_KEYS = ['Age', 'Year']
+
+
+def join_sources(panel_df, sources):
+    """
+    Adds the columns of the sources (DataFrames with a Year column, and an
+    Age column for (Age, Year) tables) to the panel, like a left merge on
+    their keys: cells without a row in a source get NaN. A source column
+    already in the panel replaces it. Returns a new panel; the one passed
+    in is not modified.
+    """
+    keys = pd.MultiIndex.from_arrays([panel_df[key] for key in PANEL_KEYS])
+    if not keys.is_monotonic_increasing:
+        panel_df = panel_df.sort_values(by=PANEL_KEYS).reset_index(drop=True)
+        keys = pd.MultiIndex.from_arrays([panel_df[key] for key in PANEL_KEYS])
+    panel_df = panel_df.copy(deep=False)
+
+    for source in sources:
+        source_keys = [key for key in PANEL_KEYS if key in source.columns]
+        table = source.set_index(source_keys)
+        if not table.index.is_unique:
+            raise ValueError(f"Source has duplicate {source_keys} rows; cannot join it to the panel.")
+        target = keys if len(source_keys) == 2 else keys.get_level_values('Year')
+        aligned = table.reindex(target)
+        for col in aligned.columns:
+            panel_df[col] = aligned[col].to_numpy()
+    return panel_df
+
+
+# -----------------------------------------------------------------------------
+# Stages
+# -----------------------------------------------------------------------------
+# Every stage function receives the panel produced by the previous stage
+# (None for the first one) and the stage parameters, and returns the new
+# panel together with a {file_name: DataFrame} dict of the files to write.
+
+def stage_population(panel_df, params):
+    """Historical population 1960-2024."""
+    panel_pop_1960_2024 = load_age_year_panel(POPULATION_FILE, 'Population')
+    return panel_pop_1960_2024, {'population_panel_data.csv': panel_pop_1960_2024}
+
+
+def stage_projection(panel_pop_1960_2024, params):
+    """Appends the 2025-2100 population projection to the historical data."""
+    panel_pop_2025_2100 = load_age_year_panel(PROJECTION_FILE, 'Population')
+
+    # --- 4. Combine the DataFrames ---
+    # This code handles the overlap in years (e.g., 2022-2024) by
+    # keeping the data from the first file (historical) and only
+    # adding new years from the second file (projection).
+    log.info("Combining DataFrames...")
+
+    # Get the last year from the historical data (panel_pop_1960_2024)
+    last_historical_year = panel_pop_1960_2024['Year'].max()
+    log.info(f"Last year in historical data: {last_historical_year}")
+
+    # Filter the projection data to only include years *after* the last historical year
+    panel_pop_future_only = panel_pop_2025_2100[panel_pop_2025_2100['Year'] > last_historical_year]
+
+    # Use pd.concat() to stack the two DataFrames vertically
+    # panel_pop_1960_2024 (contains 1960 -> 2024)
+    # panel_pop_future_only (contains 2025 -> 2100)
+    combined_panel_df = pd.concat([panel_pop_1960_2024, panel_pop_future_only], ignore_index=True)
+
+    # Sort the final combined DataFrame by Age and then Year for a clean, continuous timeline
+    combined_panel_df = combined_panel_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
+
+    log.debug("Combined DataFrame Head:")
+    log.debug("%s", combined_panel_df.head())
+    log.debug("Combined DataFrame Tail (showing future data):")
+    log.debug("%s", combined_panel_df.tail())
+
+    return combined_panel_df, {
+        'population_panel_data_projected.csv': panel_pop_2025_2100,
+        'population_panel_data_combined_1960-2100.csv': combined_panel_df,
+    }
+
+
+def stage_life_expectancy(combined_panel_df, params):
+    """Stretches the life expectancy table over the full panel and merges it."""
+    panel_lifeexp = load_age_year_panel(LIFETIME_FILE, 'Life_Expectancy', coerce_age=True)
+
+    # --- 5. Prepare Life Expectancy Data for Merging ---
+    # This section "stretches" the panel_lifeexp data to match the
+    # full Age and Year range of combined_panel_df, using your rules.
+    log.info("--- Starting Life Expectancy Data Preparation ---")
+
+    # First, get the boundaries from the life expectancy data
+    max_le_age = panel_lifeexp['Age'].max()
+    min_le_year = panel_lifeexp['Year'].min()
+    max_le_year = panel_lifeexp['Year'].max()
+
+    # Then, get the target boundaries from the main combined data
+    target_max_age = combined_panel_df['Age'].max()
+    target_min_year = combined_panel_df['Year'].min()
+    target_max_year = combined_panel_df['Year'].max()
+
+    log.info(f"Life Expectancy data bounds: Age <= {max_le_age}, Years {min_le_year}-{max_le_year}")
+    log.info(f"Target data bounds: Age <= {target_max_age}, Years {target_min_year}-{target_max_year}")
+
+    # --- Extrapolate Ages > 83 and Years < 1971 / > 2023 ---
+    # "For all ages above 83 the life expectancy must be the same as for person of age 83."
+    # "For all years before 1971... use the value of 1971"
+    # "For all years after 2023... use the same as in 2023"
+    # The ages are extended first, so the older ages in the extrapolated
+    # years take the value of the oldest age in the edge year.
+    log.info(f"Extrapolating data for ages {max_le_age + 1} to {target_max_age} "
+             f"and years {target_min_year}-{min_le_year - 1}, {max_le_year + 1}-{target_max_year}...")
+    # This DataFrame now has a 'Life_Expectancy' value for every 'Age'/'Year' combination
+    panel_lifeexp_ready_to_merge = extend_panel(
+        panel_lifeexp,
+        axes={'Age': combined_panel_df['Age'].unique(), 'Year': combined_panel_df['Year'].unique()},
+        fill={'Age': {'after': 'edge'}, 'Year': 'edge'},
+    )
+
+    # --- 6. Perform the Final Merge ---
+    log.info("Merging population data with prepared life expectancy data...")
+
+    # We join on (Age, Year) to keep all rows from the main
+    # 'combined_panel_df' and add the 'Life_Expectancy' column.
+    # Because we manually filled the data, there will be no new NaNs.
+    final_combined_df = join_sources(combined_panel_df, [panel_lifeexp_ready_to_merge])
+    merged_snapshot = final_combined_df
+
+    log.info("--- Merge Complete ---")
+    log.debug("Final combined DataFrame with Population and Life Expectancy:")
+    log.debug("%s", final_combined_df.head())
+    log.debug("%s", final_combined_df.tail())
+
+    # Fill the missing 'Life_Expectancy' values (NaN) only for years after
+    # the last observed year, using that year's value for the same age.
+    last_year = params['last_observed_year']
+    le_last_by_age = final_combined_df[final_combined_df['Year'] == last_year].set_index('Age')['Life_Expectancy']
+
+    missing_le_mask = final_combined_df['Life_Expectancy'].isna()
+    future_years_mask = final_combined_df['Year'] > last_year
+    impute_mask = missing_le_mask & future_years_mask
+    # (new column on a shallow copy, so the snapshot keeps the merged values)
+    final_combined_df = final_combined_df.copy(deep=False)
+    final_combined_df['Life_Expectancy'] = final_combined_df['Life_Expectancy'].mask(
+        impute_mask, final_combined_df['Age'].map(le_last_by_age))
+
+    return final_combined_df, {
+        'life_expectancy_panel_data.csv': panel_lifeexp,
+        'population_and_life_exp_panel_data_1960-2100.csv': merged_snapshot,
+        'population_and_life_exp_panel_data_1960-2100_interpolated.csv': final_combined_df,
+    }
+
+
+def stage_retirement_age(final_combined_df, params):
+    """Merges the average retirement age and the statutory constants."""
+    # --- 7. Load and Prepare Retirement Age Data ---
+    log.info("--- Starting Retirement Age Data Preparation ---")
+
+    # Load *only* the two required columns
+    target_cols = RETIREMENT_COLUMNS
+    try:
+        df_retire = read_excel_or_exit(RETIREMENT_FILE, usecols=target_cols)
+    except ValueError as e:
+        # This error happens if the specified columns aren't in the file
+        log.error(f"Error: Could not find required columns in '{RETIREMENT_FILE}'. Check names.")
+        log.error(f"Details: {e}")
+        sys.exit(1)
+
+    # Rename columns for clarity and consistency
+    df_retire = df_retire.rename(columns={
+        'Année': 'Year',
+        'Pensions de vieillesse et de vieillesse annticipée': 'Retirement_age'
     })
-    dfs_to_append.append(df_future)
-
-# Rebuild the final, fully-filled DataFrame
-# This DataFrame now has a 'Retirement_age' value for every 'Year' from 1960-2100
-panel_retire_ready_to_merge = pd.concat(dfs_to_append, ignore_index=True)
-panel_retire_ready_to_merge = panel_retire_ready_to_merge.sort_values(by='Year')
-
-
-# --- 9. Perform Final Merge with Retirement Age ---
-print("Merging main data with prepared retirement age data...")
-
-# We use a 'left' merge to add the 'Retirement_age' column.
-# It will match each 'Year' in the main df to the single value
-# in the panel_retire_ready_to_merge df.
-final_combined_df = pd.merge(
-    final_combined_df,
-    panel_retire_ready_to_merge,
-    on=['Year'],
-    how='left'
-)
-
-# Sort for a clean final table
-final_combined_df = final_combined_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-# Save the new final result
-output_filename = 'population_life_exp_retire_panel_data_1960-2100.csv'
-final_combined_df.to_csv(output_filename, index=False)
-
-print("\n--- Merge Complete ---")
-print(f"Final combined DataFrame with Population, Life Expectancy, and Retirement Age:")
-print(final_combined_df.head())
-print("...")
-print(final_combined_df.tail())
-print(f"Saved to '{output_filename}'")
-
-
-
-
-
-
-
-
-# Assume final_combined_df is already loaded
-
-# Add the new column and set the constant rate
-final_combined_df['Contribution_rate'] = 0.24
-final_combined_df.loc[final_combined_df['Year'] < 1990, 'Contribution_rate'] = 0.24
-
-
 
-# Assume final_combined_df is already loaded and has a 'Year' column
-
-final_combined_df['1999_dummy'] = (final_combined_df['Year'] > 1999).astype(int)
-
-final_combined_df['Reference_amount_1984'] = 2085
-
-final_combined_df['Birth_Year'] = final_combined_df['Year'] - final_combined_df['Age']
-
-# Save the new final result
-output_filename = 'population_life_exp_retire_crate_panel_data_1960-2100.csv'
-final_combined_df.to_csv(output_filename, index=False)
-
-
-
-
-
-
-
-# --- 7. Load, Prepare, and Merge Revalorisation Rate ---
-print("\n--- Starting Revalorisation Rate Merge ---")
-input_file_reval = r'Data\Manually_cleaned_data\adapt_salaire.xlsx'
-
-# --- 7.1 Load and Clean Data ---
-try:
+    # --- 8. Extrapolate Retirement Age Data (1960-2100) ---
+
+    # Get boundaries from the loaded retirement data
+    min_retire_year = df_retire['Year'].min() # Should be 1991
+    max_retire_year = df_retire['Year'].max() # Should be 2023
+
+    # Get target boundaries from the main combined DataFrame
+    target_min_year = final_combined_df['Year'].min() # Should be 1960
+    target_max_year = final_combined_df['Year'].max() # Should be 2100
+
+    log.info(f"Retirement data bounds: Years {min_retire_year}-{max_retire_year}")
+    log.info(f"Target data bounds: Years {target_min_year}-{target_max_year}")
+
+    # Rule 1: past years (e.g., 1960 to 1990) take the value of 1991
+    # Rule 2: future years (e.g., 2024 to 2100) take the value of 2023
+    log.info(f"Extrapolating retirement age for past years {target_min_year} to {min_retire_year - 1} "
+             f"and future years {max_retire_year + 1} to {target_max_year}...")
+    # This DataFrame now has a 'Retirement_age' value for every 'Year' from 1960-2100
+    panel_retire_ready_to_merge = extend_panel(
+        df_retire,
+        axes={'Year': final_combined_df['Year'].unique()},
+        fill={'Year': 'edge'},
+    )
+
+    # --- 9. Perform Final Merge with Retirement Age ---
+    log.info("Merging main data with prepared retirement age data...")
+
+    # The join adds the 'Retirement_age' column.
+    # It will match each 'Year' in the main df to the single value
+    # in the panel_retire_ready_to_merge df.
+    final_combined_df = join_sources(final_combined_df, [panel_retire_ready_to_merge])
+    retire_snapshot = final_combined_df
+
+    log.info("--- Merge Complete ---")
+    log.debug("Final combined DataFrame with Population, Life Expectancy, and Retirement Age:")
+    log.debug("%s", final_combined_df.head())
+    log.debug("%s", final_combined_df.tail())
+
+    # --- 10. Statutory constants ---
+    final_combined_df = final_combined_df.copy(deep=False)
+    final_combined_df['Contribution_rate'] = params['contribution_rate']
+    final_combined_df['1999_dummy'] = (final_combined_df['Year'] > params['reform_year']).astype(int)
+    final_combined_df['Reference_amount_1984'] = params['reference_amount_1984']
+    final_combined_df['Birth_Year'] = final_combined_df['Year'] - final_combined_df['Age']
+
+    return final_combined_df, {
+        'population_life_exp_retire_panel_data_1960-2100.csv': retire_snapshot,
+        'population_life_exp_retire_crate_panel_data_1960-2100.csv': final_combined_df,
+    }
+
+
+def stage_revaluation(final_combined_df, params):
+    """Merges the revalorisation factor (adapt_salaire.xlsx)."""
+    log.info("--- Starting Revalorisation Rate Merge ---")
+
+    # --- 7.1 Load and Clean Data ---
     # Load the file *without* assuming a header (header=None).
     # This reads the *actual* headers ('Adaptation des...') as the first row of data.
-    df_reval = pd.read_excel(input_file_reval, header=None)
-except FileNotFoundError:
-    print(f"Error: The file '{input_file_reval}' was not found.")
-    # Exit or handle error appropriately
-    exit()
-
-# Now, set the column names using the data from the first row (iloc[0])
-df_reval.columns = df_reval.iloc[0]
-
-# Remove the first row, as it's now just a redundant header
-df_reval = df_reval.iloc[1:].reset_index(drop=True)
-
-print(f"Successfully loaded and set headers: {df_reval.columns.to_list()}")
-
-# Now, the rename will work because the columns are correct
-df_reval = df_reval.rename(columns={
-    'Adaptation des salaires de ': 'Year',
-    'Facteur de revalorisation': 'Revaleurisation_rate'
-})
-
-# Clean data types
-df_reval['Year'] = pd.to_numeric(df_reval['Year'], errors='coerce')
-df_reval['Revaleurisation_rate'] = pd.to_numeric(df_reval['Revaleurisation_rate'], errors='coerce')
-df_reval = df_reval.dropna(subset=['Year', 'Revaleurisation_rate'])
-df_reval['Year'] = df_reval['Year'].astype(int)
-
-
-# --- 7.2 Extrapolate Future Values (Rule: ffill) ---
-# We must fill the 'Revaleurisation_rate' for years after its data ends (e.g., 2023).
-# Rule: "for years after 2023 keep Revaleurisation_rate at 1.595"
-# This is a "forward fill" (ffill).
-
-# Find the boundaries
-target_max_year = final_combined_df['Year'].max() # e.g., 2100
-max_reval_year = df_reval['Year'].max()           # e.g., 2023
-
-# Get the last available rate from the data
-last_rate_value = df_reval.loc[df_reval['Year'] == max_reval_year, 'Revaleurisation_rate'].values[0]
-
-# This list will hold our original data + the new extrapolated data
-dfs_to_append = [df_reval]
-
-if target_max_year > max_reval_year:
-    print(f"Extrapolating revalorisation rate for years {max_reval_year + 1} to {target_max_year}...")
-    print(f"Using rate from {max_reval_year}: {last_rate_value}")
-    
-    # Create a list of all the years we need to add
-    future_years = list(range(max_reval_year + 1, target_max_year + 1))
-    
-    # Create a DataFrame for these new future years
-    df_future_reval = pd.DataFrame({
-        'Year': future_years,
-        'Revaleurisation_rate': [last_rate_value] * len(future_years)
-    })
-    
-    dfs_to_append.append(df_future_reval)
-
-# Combine the original revaluation data with the new future data
-reval_ready_to_merge = pd.concat(dfs_to_append, ignore_index=True)
-
-
-# --- 7.3 Perform the Final Merge ---
-# Merge the complete revaluation data into the main DataFrame
-print("Merging revalorisation rate into final DataFrame...")
-final_combined_df = pd.merge(
-    final_combined_df,
-    reval_ready_to_merge,
-    on='Year',
-    how='left'
-)
-
-# --- 7.4 Extrapolate Past Values (Rule: bfill) ---
-# Fill any early years (e.g., 1960-1969) with the *first* available
-# rate (e.g., from 1970). This is a "backward fill".
-final_combined_df['Revaleurisation_rate'] = final_combined_df['Revaleurisation_rate'].bfill()
-
-# Sort and save the final, complete DataFrame
-final_combined_df = final_combined_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-final_combined_df.to_csv('population_and_life_exp_reval_panel_data_1960-2100.csv', index=False)
-
-print("\n--- Merge Complete ---")
-print("Final DataFrame with Population, Life Expectancy, and Revaleurisation Rate:")
-print(final_combined_df.head())
-print("...")
-print(final_combined_df.tail())
-print("Saved to 'population_and_life_exp_reval_panel_data_1960-2100.csv'")
-
-
-
-
-
-
-
+    df_reval = read_excel_or_exit(REVALUATION_FILE, header=None)
 
-# --- 8. Load, Prepare, and Merge Adjustment Factor ---
-print("\n--- Starting Adjustment Factor 1984 Merge ---")
-input_file_index = r'Data\Manually_cleaned_data\index.xls'
+    # Now, set the column names using the data from the first row (iloc[0])
+    df_reval.columns = df_reval.iloc[0]
 
-# --- 8.1 Load and Clean Data ---
-try:
-    # Attempt to read the .xls file
-    df_index = pd.read_excel(input_file_index)
-except FileNotFoundError:
-    print(f"Error: The file '{input_file_index}' was not found.")
-    exit()
-except Exception as e:
-    print(f"Error reading Excel file: {e}")
-    print("This might be a file format issue (e.g., .xls vs .xlsx) or a protected file.")
-    exit()
+    # Remove the first row, as it's now just a redundant header
+    df_reval = df_reval.iloc[1:].reset_index(drop=True)
 
-# Rename columns
-df_index = df_index.rename(columns={
-    'Année et mois': 'Year',
-    'raccordés à la base 1948': 'Adjustment_factor_1984'
-})
+    log.info(f"Successfully loaded and set headers: {df_reval.columns.to_list()}")
 
-# Clean data
-df_index['Year'] = pd.to_numeric(df_index['Year'], errors='coerce')
-df_index['Adjustment_factor_1984'] = pd.to_numeric(df_index['Adjustment_factor_1984'], errors='coerce')
-df_index = df_index.dropna(subset=['Year', 'Adjustment_factor_1984'])
-df_index['Year'] = df_index['Year'].astype(int)
-print(f"Loaded index data from {df_index['Year'].min()} to {df_index['Year'].max()}.")
-
-
-# --- 8.2 Perform the Merge ---
-# Merge the index data. This will create NaNs where the years don't match.
-print("Merging adjustment factor into final DataFrame...")
-final_combined_df = pd.merge(
-    final_combined_df,
-    df_index,
-    on='Year',
-    how='left'
-)
-
-# --- 8.3 Fill Missing Values Based on Rules ---
-# We apply the rules in a specific order to get the desired outcome
-
-# 1. Forward-fill: This fills all NaNs *after* 1983 with the 1983 value.
-#    (e.g., 1984-2100 will be filled with the 1983 value).
-#    NaNs before 1970 remain NaN.
-print("Applying gap-fill rule (ffill)...")
-final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'].ffill()
-
-# 2. Backward-fill: This fills the remaining NaNs *before* 1970 with the 1970 value.
-#    (e.g., 1960-1969 will be filled with 166.4).
-#    This also satisfies the "before 1970" rule.
-print("Applying past-fill rule (bfill)...")
-final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'].bfill()
-
-# 3. Explicit Rule: "For all years after 2024 replace missing values with 981.89"
-#    Now, we *over-write* the forward-filled values for years > 2024.
-print("Applying future rule (for years > 2024)...")
-final_combined_df.loc[final_combined_df['Year'] > 2024, 'Adjustment_factor_1984'] = 981.89
-
-final_combined_df.loc[final_combined_df['Year'] < 1970, 'Adjustment_factor_1984'] = 150
-
-final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'] / 432.37
-
-# --- 8.4 Final Save ---
-# Sort and save
-final_combined_df = final_combined_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-final_combined_df.to_csv('population_and_life_exp_reval_index_panel_data_1960-2100.csv', index=False)
-
-print("\n--- Merge Complete ---")
-print("Final DataFrame with Population, Life Expectancy, Reval Rate, and Index:")
-print(final_combined_df.head())
-print("...")
-# Print a sample from the gap (e.g., 2024) and the future (e.g., 2025)
-print(final_combined_df[final_combined_df['Year'].isin([1969, 1970, 1983, 2024, 2025]) & (final_combined_df['Age'] == 1)].to_string())
-print("...")
-print(final_combined_df.tail())
-print("Saved to 'population_and_life_exp_reval_index_panel_data_1960-2100.csv'")
-
-
-
-
-
-
-
-
-
-
-
-
-num_rows = len(final_combined_df)
-# Generate a random integer between 30,000 (inclusive) and 120,001 (exclusive)
-# for each row in the DataFrame.
-random_salaries = np.random.randint(30000, 120001, size=num_rows)
-# Assign the array of random salaries to the new 'Salary' column
-final_combined_df['Salary'] = random_salaries
-
-final_combined_df.to_csv('final_1960-2100.csv', index=False)
-
-
-
-############ Name of the file to be read ############
-Wages_File = r'Data\Benefits\Annual wages.xlsx'
-Income_File = r'Data\Benefits\Income per year - cleaned_version.xls'
-
-wages_File=r'Data\Manually_cleaned_data\Annual wages.xlsx'
-Wages_data_annually = pd.read_excel(wages_File, header=0)
-incomefile=r'Data\Manually_cleaned_data\Income per year - cleaned_version.xls'
-income_data = pd.read_excel(incomefile, sheet_name=None) 
- 
-
-from Wages_Calculation import *
-
-df_new123 = Reval_avg_An_wages(Wages_data_annually)
-
-wage_panel_df = Wages_Calculation(df_new123, income_data)
-
-print("Final DataFrame with Population, Life Expectancy, Reval Rate, and Index:")
-print(wage_panel_df.head())
-print("...")
-# Print a sample from the gap (e.g., 2024) and the future (e.g., 2025)
-print(wage_panel_df[wage_panel_df['Year'].isin([1969, 1970, 1983, 2024, 2025]) & (wage_panel_df['Age'] == 1)].to_string())
-print("...")
-print(wage_panel_df.tail())
-
-
-# --- 11. Load, Prepare, and Merge Wage Data ---
-print("\n--- Starting Wage Data Merge ---")
-
-# --- 11.1 (Rule 1) Filter main DataFrame ---
-# Drop ages 14 or younger from the main DataFrame *before* merging
-print(f"Original main df shape: {final_combined_df.shape}")
-final_combined_df = final_combined_df[final_combined_df['Age'] > 14].reset_index(drop=True)
-print(f"New main df shape (ages 15+): {final_combined_df.shape}")
-
-# --- 11.2 Prepare Wage Panel (Extrapolate Ages) ---
-# (Rule 2: "For people with age above maximum... keep the salary at the max age")
-
-# Find the boundaries of the wage data
-max_wage_age = wage_panel_df['Age'].max()
-min_wage_age = wage_panel_df['Age'].min()
-max_wage_year = wage_panel_df['Year'].max()
-min_wage_year = wage_panel_df['Year'].min()
-
-# Find the target boundaries from the main DataFrame
-target_max_age = final_combined_df['Age'].max()
-
-# Get the income data for the oldest available age (e.g., age 65)
-wage_at_max_age = wage_panel_df[wage_panel_df['Age'] == max_wage_age]
-
-# This list will hold the original data + new extrapolated age data
-age_dfs_to_append = [wage_panel_df]
-
-if target_max_age > max_wage_age:
-    print(f"Extrapolating wages for ages {max_wage_age + 1} to {target_max_age}...")
-    # Loop from the next age up to the target max age
-    for age in range(max_wage_age + 1, target_max_age + 1):
-        # Copy the data from the max age
-        new_age_df = wage_at_max_age.copy()
-        # Re-assign the 'Age' column to the new, older age
-        new_age_df['Age'] = age
-        age_dfs_to_append.append(new_age_df)
-
-# Rebuild the wage DataFrame with the new ages included
-# This df now has ages from 15 up to target_max_age (e.g., 90)
-# but still only for the original years (e.g., 1990-2024)
-wage_df_filled_age = pd.concat(age_dfs_to_append, ignore_index=True)
-
-# --- 11.3 Prepare Wage Panel (Extrapolate Years) ---
-# (Rule 3: "To interpolate salaries to years after 2024, use 2% annual growth rate")
-
-# Find the target boundaries from the main DataFrame
-target_max_year = final_combined_df['Year'].max()
-target_min_year = final_combined_df['Year'].min()
-
-# This list will hold all data (past, present, and future)
-all_year_dfs_to_append = []
-
-# --- Part A: Extrapolate Future Years (2025-2100) with 2% Growth ---
-print(f"Extrapolating future wages (2025-{target_max_year}) with 2% annual growth...")
-
-# Get the data for the base year (2024), now including all ages 15-90
-# This will be the starting point for our growth calculation
-base_year_data = wage_df_filled_age[wage_df_filled_age['Year'] == max_wage_year].copy()
+    df_reval = df_reval.rename(columns={
+        'Adaptation des salaires de ': 'Year',
+        'Facteur de revalorisation': 'Revaleurisation_rate'
+    })
 
-# Add the known data (1990-2024) to our list
-all_year_dfs_to_append.append(wage_df_filled_age)
+    # Clean data types
+    df_reval['Year'] = pd.to_numeric(df_reval['Year'], errors='coerce')
+    df_reval['Revaleurisation_rate'] = pd.to_numeric(df_reval['Revaleurisation_rate'], errors='coerce')
+    df_reval = df_reval.dropna(subset=['Year', 'Revaleurisation_rate'])
+    df_reval['Year'] = df_reval['Year'].astype(int)
+
+    # --- 7.2 Extrapolate Past and Future Values ---
+    # Rule: "for years after 2023 keep Revaleurisation_rate at 1.595"
+    # Early years (e.g., 1960-1969) take the *first* available rate.
+    target_max_year = final_combined_df['Year'].max() # e.g., 2100
+    max_reval_year = df_reval['Year'].max()           # e.g., 2023
+    last_rate_value = df_reval.loc[df_reval['Year'] == max_reval_year, 'Revaleurisation_rate'].values[0]
+
+    if target_max_year > max_reval_year:
+        log.info(f"Extrapolating revalorisation rate for years {max_reval_year + 1} to {target_max_year}...")
+        log.info(f"Using rate from {max_reval_year}: {last_rate_value}")
+
+    reval_ready_to_merge = extend_panel(
+        df_reval[['Year', 'Revaleurisation_rate']],
+        axes={'Year': final_combined_df['Year'].unique()},
+        fill={'Year': 'edge'},
+    )
+
+    # --- 7.3 Perform the Final Merge ---
+    log.info("Merging revalorisation rate into final DataFrame...")
+    final_combined_df = join_sources(final_combined_df, [reval_ready_to_merge])
+
+    log.info("--- Merge Complete ---")
+    log.debug("Final DataFrame with Population, Life Expectancy, and Revaleurisation Rate:")
+    log.debug("%s", final_combined_df.head())
+    log.debug("%s", final_combined_df.tail())
+
+    return final_combined_df, {
+        'population_and_life_exp_reval_panel_data_1960-2100.csv': final_combined_df,
+    }
+
+
+def stage_index(final_combined_df, params):
+    """Merges the price index and converts it to the 1984 adjustment factor."""
+    log.info("--- Starting Adjustment Factor 1984 Merge ---")
+
+    # --- 8.1 Load and Clean Data ---
+    try:
+        df_index = read_excel_or_exit(INDEX_FILE)
+    except Exception as e:
+        log.error(f"Error reading Excel file: {e}")
+        log.error("This might be a file format issue (e.g., .xls vs .xlsx) or a protected file.")
+        sys.exit(1)
+
+    df_index = df_index.rename(columns={
+        'Année et mois': 'Year',
+        'raccordés à la base 1948': 'Adjustment_factor_1984'
+    })
 
-current_year_data = base_year_data
-for year in range(max_wage_year + 1, target_max_year + 1):
-    # Create a new DataFrame for this future year
-    future_year_data = current_year_data.copy()
-    
-    # Set the new year
-    future_year_data['Year'] = year
-    
-    # Apply the 2% growth rate
-    future_year_data['Income_per_year'] *= 1
-    
-    # Add this new year's data to our list
-    all_year_dfs_to_append.append(future_year_data)
-    
-    # Set this as the base for the *next* year's calculation
-    current_year_data = future_year_data
-
-# --- Part B: Extrapolate Past Years (1960-1989) ---
-# (Implied Rule: Use the earliest available data for all prior years)
-print(f"Extrapolating past wages ({target_min_year}-1989) using 1990 data...")
-
-# Get data for the earliest available year (1990), for all ages 15-90
-wage_at_min_year = wage_df_filled_age[wage_df_filled_age['Year'] == min_wage_year]
-
-for year in range(target_min_year, min_wage_year):
-    # Copy the 1990 data
-    new_year_df = wage_at_min_year.copy()
-    # Set the year to the past year
-    new_year_df['Year'] = year
-    # Add to our list
-    all_year_dfs_to_append.append(new_year_df)
-
-# --- 11.4 Create the Final Wage Panel ---
-# Combine all the DataFrames (past, present, future) into one
-wage_panel_ready_to_merge = pd.concat(all_year_dfs_to_append, ignore_index=True)
-
-# --- 11.5 Perform the Final Merge ---
-print("Merging prepared wage data into final DataFrame...")
-# We use a 'left' merge to keep all rows from our filtered main DataFrame
-# and add the matching income data.
-final_combined_df = pd.merge(
-    final_combined_df,
-    wage_panel_ready_to_merge,
-    on=['Year', 'Age'],
-    how='left'
-)
-
-# Calculate salary by dividing Income_per_year by Revaleurisation_rate
-final_combined_df['Salary'] = final_combined_df['Income_per_year'] / final_combined_df['Revaleurisation_rate']
-
-# --- 11.6 Final Save ---
-final_combined_df = final_combined_df.sort_values(by=['Age', 'Year']).reset_index(drop=True)
-
-
-final_combined_df.loc[final_combined_df['Age'] > 90, 'Life_Expectancy'] = 5
-
-final_combined_df.to_csv('final_dataset_with_wages_1960-2100.csv', index=False)
-
-print("\n--- Merge Complete ---")
-print("Final DataFrame with Population, Life Exp, Reval, Index, and Wages:")
-print(final_combined_df.head())
-print("...")
-print(final_combined_df.tail())
-print("Saved to 'final_dataset_with_wages_1960-2100.csv'")
-
-
-
-
-stats = final_combined_df.describe()
-
-# You would then print the 'stats' variable to see the output
-print(stats)
-
-# Get descriptive stats and save to a file
-stats_df = final_combined_df.describe()
-stats_df.to_csv('descriptive_stats.csv')
\ No newline at end of file
+    df_index['Year'] = pd.to_numeric(df_index['Year'], errors='coerce')
+    df_index['Adjustment_factor_1984'] = pd.to_numeric(df_index['Adjustment_factor_1984'], errors='coerce')
+    df_index = df_index.dropna(subset=['Year', 'Adjustment_factor_1984'])
+    df_index['Year'] = df_index['Year'].astype(int)
+    log.info(f"Loaded index data from {df_index['Year'].min()} to {df_index['Year'].max()}.")
+
+    # --- 8.2 Perform the Merge ---
+    log.info("Merging adjustment factor into final DataFrame...")
+    final_combined_df = join_sources(final_combined_df, [df_index])
+
+    # --- 8.3 Fill Missing Values Based on Rules ---
+    # 1. Forward-fill, then 2. backward-fill the gaps of the series.
+    log.info("Applying gap-fill rule (ffill)...")
+    final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'].ffill()
+    log.info("Applying past-fill rule (bfill)...")
+    final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'].bfill()
+
+    # 3. Explicit rules for the future and the pre-1970 years
+    log.info("Applying future rule (for years > 2024)...")
+    final_combined_df.loc[final_combined_df['Year'] > params['last_index_year'], 'Adjustment_factor_1984'] = params['future_index']
+    final_combined_df.loc[final_combined_df['Year'] < params['first_index_year'], 'Adjustment_factor_1984'] = params['past_index']
+
+    # Rebase to 1984
+    final_combined_df['Adjustment_factor_1984'] = final_combined_df['Adjustment_factor_1984'] / params['index_1984']
+
+    index_snapshot = final_combined_df
+
+    log.info("--- Merge Complete ---")
+    log.debug("Final DataFrame with Population, Life Expectancy, Reval Rate, and Index:")
+    log.debug("%s", final_combined_df.head())
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("%s", final_combined_df[final_combined_df['Year'].isin([1969, 1970, 1983, 2024, 2025]) & (final_combined_df['Age'] == 1)].to_string())
+    log.debug("%s", final_combined_df.tail())
+
+    # Placeholder salaries (replaced by the wage data in the 'wages' stage)
+    random_salaries = np.random.randint(30000, 120001, size=len(final_combined_df))
+    final_combined_df = final_combined_df.copy(deep=False)
+    final_combined_df['Salary'] = random_salaries
+
+    return final_combined_df, {
+        'population_and_life_exp_reval_index_panel_data_1960-2100.csv': index_snapshot,
+        'final_1960-2100.csv': final_combined_df,
+    }
+
+
+def load_min_salary(input_file):
+    """
+    Yearly minimum social wage (salaire social minimum) from min_salary.xls:
+    the yearly average of the nominal monthly amount. Returns a frame with
+    Year and Minimum_salary_monthly.
+
+    The headers are below a title block. From 1983 to 1994 every year has
+    three lines (reference amount, without and with family charges) and
+    only the first one, which carries the refixation date (or '-'), is
+    kept. These lines have no year label: the year is read from the date,
+    or counted on from the last labelled year for '-'.
+    """
+    raw = read_excel_or_exit(input_file, header=None)
+    header_row = raw.index[raw[0] == 'Année'][0]
+    df = raw.iloc[header_row + 1:, [0, 1, 2, 3, 4]]
+    df.columns = ['Year', 'Date', 'Amount_index_100', 'Index', 'Minimum_salary_monthly']
+
+    # First line of every year (the family-charge lines have neither a year nor a date)
+    df = df[df['Year'].notna() | df['Date'].notna()].copy()
+    year = pd.to_numeric(df['Year'], errors='coerce')
+    date_year = pd.to_numeric(df['Date'].astype(str).str.extract(r'(\d{4})$')[0], errors='coerce')
+    year = year.fillna(date_year)
+    labelled = year.notna().cumsum()
+    df['Year'] = year.ffill() + df.groupby(labelled.to_numpy()).cumcount().to_numpy()
+
+    for col in ['Amount_index_100', 'Index', 'Minimum_salary_monthly']:
+        # Some amounts are text with dots as thousands separators ('1.282.35')
+        text = df[col].astype(str).str.replace(r'\.(?=.*\.)', '', regex=True)
+        df[col] = pd.to_numeric(text, errors='coerce')
+    # A missing yearly average (2012) is the amount at index 100 times the average index
+    missing = df['Minimum_salary_monthly'].isna()
+    df.loc[missing, 'Minimum_salary_monthly'] = df.loc[missing, 'Amount_index_100'] * df.loc[missing, 'Index'] / 100
+    # A refixation during the year repeats the year; the last line has the yearly average
+    df = df[df['Minimum_salary_monthly'] > 0].dropna(subset=['Year'])
+    df['Year'] = df['Year'].astype(int)
+    return df.drop_duplicates(subset='Year', keep='last')[['Year', 'Minimum_salary_monthly']]
+
+
+def stage_salary_limits(final_combined_df, params):
+    """Merges the contribution ceiling (plafond.xls) and the minimum wage (min_salary.xls)."""
+    log.info("--- Starting Contribution Ceiling and Minimum Wage Merge ---")
+
+    # --- 10.1 Load and Clean Data ---
+    df_ceiling = read_excel_or_exit(CEILING_FILE, usecols=CEILING_COLUMNS)
+    df_ceiling = df_ceiling.rename(columns={
+        'Année': 'Year',
+        'Plafond cotisable annuel Montant nominal': 'Contribution_ceiling'
+    })
+    df_ceiling['Year'] = pd.to_numeric(df_ceiling['Year'], errors='coerce')
+    df_ceiling['Contribution_ceiling'] = pd.to_numeric(df_ceiling['Contribution_ceiling'], errors='coerce')
+    df_ceiling = df_ceiling.dropna(subset=['Year', 'Contribution_ceiling'])
+    df_ceiling['Year'] = df_ceiling['Year'].astype(int)
+
+    df_min = load_min_salary(MIN_SALARY_FILE)
+    # Annual amount (the panel's wages are annual)
+    df_min['Minimum_salary'] = df_min.pop('Minimum_salary_monthly') * 12
+
+    log.info(f"Loaded contribution ceiling from {df_ceiling['Year'].min()} to {df_ceiling['Year'].max()} "
+             f"and minimum wage from {df_min['Year'].min()} to {df_min['Year'].max()}.")
+
+    # --- 10.2 Average Wage Index ---
+    # Yearly average wage of the wage stage (Annual wages.xlsx, projected to
+    # 2050 by Reval_avg_An_wages), growing by future_wage_growth a year
+    # after that, as the wages do.
+    Wages_data_annually = Reval_avg_An_wages(read_excel_or_exit(WAGES_FILE, header=0).copy())
+    wage_years = [col for col in Wages_data_annually.columns if str(col).isdigit()]
+    df_wage = pd.DataFrame({
+        'Year': [int(year) for year in wage_years],
+        'Average_wage': Wages_data_annually[wage_years].iloc[0].astype(float).to_numpy(),
+    })
+    years = final_combined_df['Year'].unique()
+    wage_index = extend_panel(
+        df_wage, axes={'Year': years},
+        fill={'Year': {'after': ('growth', params['future_wage_growth'])}},
+    ).set_index('Year')['Average_wage']
+
+    # --- 10.3 Extrapolate and Merge ---
+    # The limits only apply where they are consistent with the wages:
+    #   - before the first wage year (wages held at that year's level, so
+    #     wage_index has no row) and before the first year of a series,
+    #     there is no limit (NaN),
+    #   - after the last year of a series, the limit moves with the average
+    #     wage, so the share of capped salaries stays as in that year.
+    limits = []
+    for df, col in ((df_ceiling, 'Contribution_ceiling'), (df_min, 'Minimum_salary')):
+        series = df.set_index('Year')[col]
+        last_year = series.index.max()
+        yearly = series.reindex(wage_index.index)
+        later = yearly.index > last_year
+        yearly[later] = series[last_year] * wage_index[later] / wage_index[last_year]
+        limits.append(yearly.dropna().rename_axis('Year').reset_index())
+
+    log.info("Merging contribution ceiling and minimum wage into final DataFrame...")
+    final_combined_df = join_sources(final_combined_df, limits)
+
+    log.info("--- Merge Complete ---")
+    log.debug("%s", final_combined_df.head())
+    log.debug("%s", final_combined_df.tail())
+
+    return final_combined_df, {
+        'population_and_life_exp_reval_index_limits_panel_data_1960-2100.csv': final_combined_df,
+    }
+
+
+def stage_wages(final_combined_df, params):
+    """Builds the wage panel and derives the Salary column."""
+    Wages_data_annually = read_excel_or_exit(WAGES_FILE, header=0)
+    income_data = read_excel_or_exit(INCOME_FILE, sheet_name=None)
+
+    df_new123 = Reval_avg_An_wages(Wages_data_annually)
+    wage_panel_df = Wages_Calculation(df_new123, income_data)
+
+    log.debug("Wage panel:")
+    log.debug("%s", wage_panel_df.head())
+    log.debug("%s", wage_panel_df.tail())
+
+    # --- 11. Load, Prepare, and Merge Wage Data ---
+    log.info("--- Starting Wage Data Merge ---")
+
+    # --- 11.1 (Rule 1) Filter main DataFrame ---
+    # Drop the youngest ages from the main DataFrame *before* merging
+    log.info(f"Original main df shape: {final_combined_df.shape}")
+    final_combined_df = final_combined_df[final_combined_df['Age'] > params['max_excluded_age']].reset_index(drop=True)
+    log.info(f"New main df shape (ages {params['max_excluded_age'] + 1}+): {final_combined_df.shape}")
+
+    # --- 11.2 Prepare Wage Panel (Extrapolate Ages and Years) ---
+    # (Rule 2: "For people with age above maximum... keep the salary at the max age")
+    # Future years grow by future_wage_growth a year from the last wage
+    # year; past years (implied rule) use the earliest available data.
+    max_wage_age = wage_panel_df['Age'].max()
+    max_wage_year = wage_panel_df['Year'].max()
+    min_wage_year = wage_panel_df['Year'].min()
+    target_max_age = final_combined_df['Age'].max()
+    target_max_year = final_combined_df['Year'].max()
+    target_min_year = final_combined_df['Year'].min()
+
+    log.info(f"Extrapolating wages for ages {max_wage_age + 1} to {target_max_age}...")
+    log.info(f"Extrapolating future wages ({max_wage_year + 1}-{target_max_year})...")
+    log.info(f"Extrapolating past wages ({target_min_year}-{min_wage_year - 1}) using {min_wage_year} data...")
+
+    # --- 11.4 Create the Final Wage Panel ---
+    wage_panel_ready_to_merge = extend_panel(
+        wage_panel_df,
+        axes={'Age': final_combined_df['Age'].unique(), 'Year': final_combined_df['Year'].unique()},
+        fill={'Age': {'after': 'edge'},
+              'Year': {'before': 'edge', 'after': ('growth', params['future_wage_growth'])}},
+    )
+
+    # --- 11.5 Perform the Final Merge ---
+    log.info("Merging prepared wage data into final DataFrame...")
+    final_combined_df = join_sources(final_combined_df, [wage_panel_ready_to_merge])
+
+    # Calculate salary by dividing Income_per_year by Revaleurisation_rate
+    final_combined_df['Salary'] = final_combined_df['Income_per_year'] / final_combined_df['Revaleurisation_rate']
+
+    # --- 11.6 Final Save ---
+    final_combined_df['Life_Expectancy'] = final_combined_df['Life_Expectancy'].mask(
+        final_combined_df['Age'] > params['max_life_expectancy_age'], params['old_age_life_expectancy'])
+
+    log.info("--- Merge Complete ---")
+    log.debug("Final DataFrame with Population, Life Exp, Reval, Index, and Wages:")
+    log.debug("%s", final_combined_df.head())
+    log.debug("%s", final_combined_df.tail())
+
+    stats_df = final_combined_df.describe()
+    log.debug("%s", stats_df)
+
+    return final_combined_df, {
+        'final_dataset_with_wages_1960-2100.csv': final_combined_df,
+        'descriptive_stats.csv': stats_df,
+    }
+
+
+# Stage definitions, in execution order. 'inputs' are the source files the
+# stage reads, 'params' its tunable rules, 'outputs' the panels it writes
+# and 'reports' any summary tables (always plain CSV). 'year_columns' lists
+# the columns a stage adds that depend on the Year only; a revision of such
+# a stage's input can be patched into the panel (see incremental.py).
+# 'helpers' lists the functions the stage calls besides SHARED_HELPERS;
+# their source is part of the stage's cache key (see stage_cache_key).
+STAGES = [
+    {
+        'name': 'population',
+        'inputs': [POPULATION_FILE],
+        'params': {},
+        'outputs': ['population_panel_data.csv'],
+        'helpers': [load_age_year_panel],
+        'run': stage_population,
+    },
+    {
+        'name': 'projection',
+        'inputs': [PROJECTION_FILE],
+        'params': {},
+        'outputs': ['population_panel_data_projected.csv',
+                    'population_panel_data_combined_1960-2100.csv'],
+        'helpers': [load_age_year_panel],
+        'run': stage_projection,
+    },
+    {
+        'name': 'life_expectancy',
+        'inputs': [LIFETIME_FILE],
+        'params': {'last_observed_year': 2023},
+        'outputs': ['life_expectancy_panel_data.csv',
+                    'population_and_life_exp_panel_data_1960-2100.csv',
+                    'population_and_life_exp_panel_data_1960-2100_interpolated.csv'],
+        'helpers': [load_age_year_panel, extend_panel, join_sources],
+        'run': stage_life_expectancy,
+    },
+    {
+        'name': 'retirement_age',
+        'inputs': [RETIREMENT_FILE],
+        'params': {'contribution_rate': 0.24, 'reform_year': 1999,
+                   'reference_amount_1984': 2085},
+        'outputs': ['population_life_exp_retire_panel_data_1960-2100.csv',
+                    'population_life_exp_retire_crate_panel_data_1960-2100.csv'],
+        'helpers': [extend_panel, join_sources],
+        'run': stage_retirement_age,
+    },
+    {
+        'name': 'revaluation',
+        'inputs': [REVALUATION_FILE],
+        'params': {},
+        'outputs': ['population_and_life_exp_reval_panel_data_1960-2100.csv'],
+        'year_columns': ['Revaleurisation_rate'],
+        'helpers': [extend_panel, join_sources],
+        'run': stage_revaluation,
+    },
+    {
+        'name': 'index',
+        'inputs': [INDEX_FILE],
+        'params': {'first_index_year': 1970, 'past_index': 150,
+                   'last_index_year': 2024, 'future_index': 981.89,
+                   'index_1984': 432.37},
+        'outputs': ['population_and_life_exp_reval_index_panel_data_1960-2100.csv',
+                    'final_1960-2100.csv'],
+        'year_columns': ['Adjustment_factor_1984'],
+        'helpers': [join_sources],
+        'run': stage_index,
+    },
+    {
+        'name': 'salary_limits',
+        'inputs': [CEILING_FILE, MIN_SALARY_FILE, WAGES_FILE],
+        'params': {'future_wage_growth': FUTURE_WAGE_GROWTH},
+        'outputs': ['population_and_life_exp_reval_index_limits_panel_data_1960-2100.csv'],
+        'year_columns': ['Contribution_ceiling', 'Minimum_salary'],
+        'helpers': [load_min_salary, Reval_avg_An_wages, extend_panel, join_sources],
+        'run': stage_salary_limits,
+    },
+    {
+        'name': 'wages',
+        'inputs': [WAGES_FILE, INCOME_FILE],
+        'params': {'max_excluded_age': 14, 'future_wage_growth': FUTURE_WAGE_GROWTH,
+                   'max_life_expectancy_age': 90, 'old_age_life_expectancy': 5},
+        'outputs': ['final_dataset_with_wages_1960-2100.csv'],
+        'reports': ['descriptive_stats.csv'],
+        'helpers': [Reval_avg_An_wages, Wages_Calculation, extend_panel, join_sources],
+        'run': stage_wages,
+    },
+]
+
+
+# -----------------------------------------------------------------------------
+# Cache
+# -----------------------------------------------------------------------------
+
+# Helpers every stage reads its sources through
+SHARED_HELPERS = [read_excel_or_exit, load_source]
+
+
+def _helper_source(helper):
+    """
+    Source hashed for a helper: the function itself when it is defined in
+    this module, otherwise its whole module (so the private functions and
+    settings it relies on there count too, e.g. panel_extend._fill_side or
+    ingest.SOURCES).
+    """
+    module = inspect.getmodule(helper)
+    if module is sys.modules[__name__]:
+        return inspect.getsource(helper)
+    return inspect.getsource(module)
+
+
+def stage_cache_key(stage, upstream_key):
+    """
+    Hash identifying one build of a stage: its input files' content, its
+    parameters, the source of its function and helpers (SHARED_HELPERS and
+    the stage's 'helpers') and the key of the stage before it.
+    """
+    digest = hashlib.sha256()
+    digest.update(stage['name'].encode())
+    digest.update(upstream_key.encode())
+    for path in stage['inputs']:
+        digest.update(path.encode())
+        digest.update(file_hash(path).encode())
+    digest.update(json.dumps(stage['params'], sort_keys=True).encode())
+    digest.update(inspect.getsource(stage['run']).encode())
+    for helper in SHARED_HELPERS + stage.get('helpers', []):
+        digest.update(_helper_source(helper).encode())
+    return digest.hexdigest()
+
+
+def cache_path(stage, key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{stage['name']}-{key[:16]}.pkl")
+
+
+def write_cache(stage, key, panel_df, cache_dir=CACHE_DIR):
+    """Stores a stage's panel, removing older entries of the same stage."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith(stage['name'] + '-'):
+            os.remove(os.path.join(cache_dir, name))
+    panel_df.to_pickle(cache_path(stage, key, cache_dir))
+
+
+def cohort_index_path(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"cohorts-{key[:16]}.pkl")
+
+
+def write_cohort_index(key, panel_df, cache_dir=CACHE_DIR):
+    """Stores the cohort index of the final panel, removing older entries."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith('cohorts-'):
+            os.remove(os.path.join(cache_dir, name))
+    CohortIndex.from_frame(panel_df).save(cohort_index_path(key, cache_dir))
+
+
+def pipeline_key(stages=STAGES):
+    """Cache key of the last stage (identifies the current final panel)."""
+    key = ''
+    for stage in stages:
+        key = stage_cache_key(stage, key)
+    return key
+
+
+def load_cohort_index(stages=STAGES, cache_dir=CACHE_DIR):
+    """
+    Cohort index of the final panel, or None if the pipeline has not been
+    run since its inputs changed.
+    """
+    path = cohort_index_path(pipeline_key(stages), cache_dir)
+    return CohortIndex.load(path) if os.path.exists(path) else None
+
+
+def expected_files(stage, panel_format=PANEL_FORMAT, write_csv=WRITE_CSV, panels=True):
+    """Files a completed stage leaves on disk (panels=False: its reports only)."""
+    files = []
+    if panels:
+        files += [with_format(path, panel_format) for path in stage['outputs']]
+        if write_csv:
+            files += stage['outputs']
+    return files + stage.get('reports', [])
+
+
+def write_outputs(stage, outputs, panel_format=PANEL_FORMAT, write_csv=WRITE_CSV, panels=True):
+    """
+    Writes a stage's panels (typed, plus optional CSV) and reports;
+    panels=False only writes the reports.
+    """
+    for path, frame in outputs.items():
+        if path in stage.get('reports', []):
+            frame.to_csv(path)
+            log.info(f"Saved to '{path}'")
+        elif panels:
+            written = save_panel(frame, path, fmt=panel_format, csv=write_csv)
+            log.info(f"Saved to '{written}'" + (f" and '{path}'" if write_csv else ""))
+
+
+def _source_rows(data):
+    """Rows of a parsed source (summed over the sheets of a workbook)."""
+    if isinstance(data, dict):
+        return sum(len(sheet) for sheet in data.values())
+    return len(data)
+
+
+def run_pipeline(stages=STAGES, force=False, cache_dir=CACHE_DIR,
+                 panel_format=PANEL_FORMAT, write_csv=WRITE_CSV, snapshots=WRITE_SNAPSHOTS):
+    """
+    Runs the stages in order, skipping those whose cached panel is up to
+    date and whose output files all exist. snapshots=False only writes the
+    panels of the last stage. Returns the final panel.
+    """
+    plan = []
+    upstream_key = ''
+    for stage in stages:
+        key = stage_cache_key(stage, upstream_key)
+        panels = snapshots or stage is stages[-1]
+        up_to_date = (
+            not force
+            and os.path.exists(cache_path(stage, key, cache_dir))
+            and all(os.path.exists(path)
+                    for path in expected_files(stage, panel_format, write_csv, panels))
+        )
+        plan.append((stage, key, panels, up_to_date))
+        upstream_key = key
+
+    # Parse the source workbooks of all the stages to build at once
+    to_read = [path for stage, key, panels, up_to_date in plan if not up_to_date
+               for path in stage['inputs']]
+    if to_read:
+        try:
+            with PROFILER.stage('merge.load_sources') as record:
+                sources = load_sources(list(dict.fromkeys(to_read)))
+                record['rows'] = sum(_source_rows(data) for data in sources.values())
+        except FileNotFoundError as e:
+            log.error(f"Error: The file '{e.filename}' was not found.")
+            sys.exit(1)
+
+    previous_cache = None
+    panel_df = None
+
+    for stage, key, panels, up_to_date in plan:
+        stage_cache = cache_path(stage, key, cache_dir)
+        if up_to_date:
+            log.info(f"=== Stage '{stage['name']}': up to date, skipping ===")
+            panel_df = None
+        else:
+            log.info(f"=== Stage '{stage['name']}': building ===")
+            if panel_df is None and previous_cache is not None:
+                panel_df = pd.read_pickle(previous_cache)
+            with PROFILER.stage(f"merge.{stage['name']}") as record:
+                panel_df, outputs = stage['run'](panel_df, stage['params'])
+                write_outputs(stage, outputs, panel_format, write_csv, panels)
+                write_cache(stage, key, panel_df, cache_dir)
+                record['rows'] = len(panel_df)
+
+        previous_cache = stage_cache
+
+    if panel_df is None and previous_cache is not None:
+        panel_df = pd.read_pickle(previous_cache)
+    if panel_df is not None and not os.path.exists(cohort_index_path(upstream_key, cache_dir)):
+        write_cohort_index(upstream_key, panel_df, cache_dir)
+    return panel_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the 1960-2100 pension panel.")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every stage, ignoring the cache.")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help=f"Directory of the stage cache (default: {CACHE_DIR}).")
+    parser.add_argument('--format', default=PANEL_FORMAT,
+                        choices=['parquet', 'feather', 'pickle'],
+                        help=f"Format of the written panels (default: {PANEL_FORMAT}).")
+    parser.add_argument('--no-csv', action='store_true',
+                        help="Do not export a CSV copy of each panel.")
+    parser.add_argument('--no-snapshots', action='store_true',
+                        help="Only write the final panel, not the intermediate panel of each stage.")
+    parser.add_argument('--log-level', default='INFO',
+                        help="DEBUG also shows previews of the intermediate DataFrames.")
+    parser.add_argument('--summary', default=None,
+                        help="Write the run summary (stage timings, warnings) to this JSON file.")
+    parser.add_argument('--profile', nargs='?', const='merge_profile.json', default=None,
+                        help="Record wall/CPU time, peak RSS and rows per stage to a JSON "
+                             "report (default: merge_profile.json).")
+    parser.add_argument('--cprofile', default=None,
+                        help="Also dump cProfile stats of the whole run to this file.")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    if args.profile:
+        PROFILER.enable()
+    elif PROFILER.enabled:
+        args.profile = 'merge_profile.json'
+    with cprofile(args.cprofile) if args.cprofile else contextlib.nullcontext():
+        run_pipeline(force=args.force, cache_dir=args.cache_dir,
+                     panel_format=args.format, write_csv=not args.no_csv,
+                     snapshots=not args.no_snapshots)
+    if args.profile:
+        PROFILER.write_report(args.profile)
+    if args.summary:
+        SUMMARY.write(args.summary)
@@ -0,0 +1,346 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from ledger import ledger_frame
+from logs import configure_logging, get_logger
+from panel_store import load_panel
+from pension_engine import (SALARY_LIMIT_COLUMNS, build_cohort_grid, contributable_salary,
+                            prepare_panel, prop_rates_for_years)
+from regimes import DEFAULT_REGIMES, combine_regimes
+from streaming import ResultWriter
+
+log = get_logger('microsim')
+
+# -----------------------------------------------------------------------------
+# Heterogeneous-agent microsimulation
+# -----------------------------------------------------------------------------
+# Calculations.py models each cohort as one representative agent (a fixed
+# PCT_PUBLIC share, one WORK_START_AGE). Here every cohort is a population of
+# n_agents synthetic individuals, each with their own:
+#   - work start age: normal around the scenario's WORK_START_AGE, rounded
+#     and clipped to START_AGE_RANGE,
+#   - career gaps: every working year is not contributed with probability
+#     gap_rate (gap years add no contributions, no earnings and no
+#     insurance years),
+#   - public/private status: public servant with probability PCT_PUBLIC
+#     (only matters for cohorts under the pre-1999 regime, 1999_dummy = 0),
+#   - wage profile: Salary times a permanent individual factor and a
+#     transitory factor per year (both log-normal with mean 1).
+# Each agent then goes through the same formulas as pension_engine.
+#
+# Agents are evaluated in vectorized batches of (agents x ages) arrays
+# (float32, int8 and bool), batch_size agents at a time, and cohorts are
+# processed in groups whose per-agent results are summarized (mean,
+# quantiles) and dropped, so memory is bounded by the batch size whatever
+# the number of agents. With a ledger file, the yearly flows of every agent
+# are appended to it batch by batch (see ledger.py).
+
+# Distribution of the individual characteristics
+AGENT_DISTRIBUTION = {
+    'start_age_sd': 2.0,
+    'gap_rate': 0.03,
+    'wage_permanent_sigma': 0.3,
+    'wage_transitory_sigma': 0.1,
+}
+
+START_AGE_RANGE = (16, 30)
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Grid columns the agents need, stored as float32
+AGENT_COLUMNS = [
+    'Life_Expectancy', 'Retirement_age', 'Contribution_rate', '1999_dummy',
+    'Reference_amount_1984', 'Revaleurisation_rate', 'Salary', 'Adjustment_factor_1984'
+]
+
+DTYPE = np.float32
+
+# Column types of the agent ledger (millions of rows): the key columns are
+# stored as small integers, as in panel_store.PANEL_SCHEMA
+AGENT_LEDGER_DTYPES = {
+    'Birth_Year': 'int16',
+    'Agent': 'int32',
+    'Year': 'int16',
+    'Age': 'int16',
+    'Population': DTYPE,
+}
+
+
+def compact_grid(grid):
+    """
+    Cohort grid with the AGENT_COLUMNS (and the salary limits, when the
+    grid has them, and the Population for the ledger) as float32 arrays.
+    """
+    compact = {'cohorts': grid['cohorts'], 'ages': grid['ages'], 'present': grid['present']}
+    optional = [c for c in SALARY_LIMIT_COLUMNS + ['Population'] if c in grid]
+    for col in AGENT_COLUMNS + optional:
+        compact[col] = grid[col].astype(DTYPE)
+    return compact
+
+
+def sample_agents(cohort_idx, n_ages, pct_public, work_start_age, distribution, rng):
+    """
+    Draws the characteristics of one batch of agents (cohort_idx: grid row
+    of each agent). Returns a dict of per-agent arrays plus the (agents x
+    ages) 'gap' mask and 'wage_factor'.
+    """
+    n = len(cohort_idx)
+    start_age = np.rint(work_start_age + distribution['start_age_sd'] * rng.standard_normal(n))
+    start_age = np.clip(start_age, *START_AGE_RANGE).astype(np.int8)
+    is_public = rng.random(n) < pct_public
+    gap = rng.random((n, n_ages), dtype=DTYPE) < distribution['gap_rate']
+
+    # Log-normal factors with mean 1
+    sigma_p = distribution['wage_permanent_sigma']
+    sigma_t = distribution['wage_transitory_sigma']
+    permanent = np.exp(sigma_p * rng.standard_normal(n, dtype=DTYPE) - sigma_p ** 2 / 2)
+    transitory = np.exp(sigma_t * rng.standard_normal((n, n_ages), dtype=DTYPE) - sigma_t ** 2 / 2)
+    wage_factor = (permanent[:, None] * transitory).astype(DTYPE)
+
+    return {'cohort_idx': cohort_idx, 'start_age': start_age, 'is_public': is_public,
+            'gap': gap, 'wage_factor': wage_factor}
+
+
+def evaluate_agents(grid, agents, prop_rate_table, fixed_increase_rate=None, regimes=None,
+                    ledger=False, salary_limits=True):
+    """
+    Lifetime pension calculation for a batch of agents (see
+    pension_engine.evaluate_cohorts for the formulas; here the work start
+    age, public status, gaps and wages are per agent). The regimes (see
+    regimes.py) see the agent's public status (0 or 1) as pct_public.
+    salary_limits=False uses the uncapped wages, as in the engine.
+
+    Returns a dict of per-agent float32 arrays, NaN for agents that could
+    not be computed (same checks as the skipped cohorts of the engine).
+    ledger=True adds the (agents x ages) yearly flows, as the engine does.
+    """
+    ages = grid['ages']
+    n_ages = len(ages)
+    age0 = ages[0] if n_ages else 0
+    rows = agents['cohort_idx']
+    n = len(rows)
+    agent = np.arange(n)
+    start_age = agents['start_age'].astype(np.int64)
+
+    present = grid['present'][rows]
+    salary = grid['Salary'][rows] * agents['wage_factor']
+    # Each agent's wage is limited, not the cohort average
+    limited_salary = contributable_salary(salary, grid, rows) if salary_limits else salary
+
+    # --- A. Agent-level data from the work-start row ---
+    start_idx = start_age - age0
+    has_start = (start_idx >= 0) & (start_idx < n_ages)
+    safe_start = np.where(has_start, start_idx, 0)
+    has_start &= present[agent, safe_start]
+    retirement_age = np.round(grid['Retirement_age'][rows, safe_start])
+    life_expectancy = np.round(grid['Life_Expectancy'][rows, safe_start])
+    dummy_1999 = grid['1999_dummy'][rows, safe_start]
+
+    end_life_age = start_age + life_expectancy
+    age_axis = ages.astype(DTYPE)
+    in_lifespan = (present
+                   & (age_axis >= start_age[:, None])
+                   & (age_axis < end_life_age[:, None]))
+    in_working = in_lifespan & (age_axis <= (retirement_age - 1)[:, None])
+    contributing = in_working & ~agents['gap']
+
+    # --- B. Checks (as in the engine) ---
+    valid = has_start & in_lifespan.any(axis=1) & in_working.any(axis=1)
+    retire_idx = np.nan_to_num(retirement_age - age0, nan=-1).astype(np.int64)
+    valid &= ((retire_idx >= 0) & (retire_idx < n_ages)
+              & (retirement_age >= start_age) & (retirement_age < end_life_age))
+    safe_retire = np.where(valid, retire_idx, 0)
+    valid &= present[agent, safe_retire]
+    final_idx = retire_idx - 1
+    valid &= (final_idx >= 0) & (final_idx < n_ages)
+    safe_final = np.where(valid, final_idx, 0)
+    valid &= in_working[agent, safe_final]
+
+    # --- Formula 1: Total Lifetime Contributions ---
+    total_contributions = np.where(
+        contributing, limited_salary * grid['Contribution_rate'][rows], 0
+    ).sum(axis=1)
+
+    # --- Formula 2, Stage 1: Initial Annual Pension ---
+    # Gap years are not insurance years
+    gap_years = (in_working & agents['gap']).sum(axis=1)
+    N_years = np.minimum(retirement_age - start_age - gap_years, 40)
+    fixed_increases = (N_years / 40) * grid['Reference_amount_1984'][rows, safe_retire]
+    if fixed_increase_rate is not None:
+        fixed_increases = fixed_increases * fixed_increase_rate
+
+    sum_adjusted_earnings = np.where(
+        contributing,
+        limited_salary / grid['Adjustment_factor_1984'][rows] / grid['Revaleurisation_rate'][rows],
+        0
+    ).sum(axis=1)
+    retirement_year = grid['cohorts'][rows] + np.nan_to_num(retirement_age).astype(np.int64)
+    prop_rate = prop_rates_for_years(prop_rate_table, retirement_year).astype(DTYPE)
+    final_salary = salary[agent, safe_final]
+
+    context = {
+        'cohorts': grid['cohorts'][rows], 'pct_public': agents['is_public'],
+        'dummy_1999': dummy_1999, 'N_years': N_years, 'retirement_year': retirement_year,
+        'fixed_increases': fixed_increases, 'sum_adjusted_earnings': sum_adjusted_earnings,
+        'prop_rate': prop_rate, 'final_salary': final_salary,
+    }
+    iap_C = combine_regimes(DEFAULT_REGIMES if regimes is None else regimes, context)[0]
+
+    # --- Formula 2, Stage 2 and Formula 3 ---
+    num_retire_years = np.maximum(end_life_age - retirement_age, 0)
+    total_benefits = iap_C * num_retire_years
+
+    results = {
+        'Total_Contributions': total_contributions,
+        'Total_Benefits': total_benefits,
+        'Net_Benefit': total_benefits - total_contributions,
+    }
+    for name, values in results.items():
+        results[name] = np.where(valid, values, np.nan).astype(DTYPE)
+
+    if ledger:
+        retired = ((age_axis >= retirement_age[:, None])
+                   & (age_axis < end_life_age[:, None]) & valid[:, None])
+        contributing = contributing & valid[:, None]
+        results['Contributing'] = contributing
+        results['Retired'] = retired
+        results['Contribution_flows'] = np.where(
+            contributing, limited_salary * grid['Contribution_rate'][rows], 0).astype(DTYPE)
+        results['Benefit_flows'] = np.where(retired, iap_C[:, None], 0).astype(DTYPE)
+    return results
+
+
+def summarize_cohort(cohort, results, agents, quantiles=QUANTILES):
+    """One row of distributional outputs for the agents of a cohort."""
+    net = results['Net_Benefit']
+    computed = ~np.isnan(net)
+    row = {
+        'Cohort': cohort,
+        'Agents': len(net),
+        'Agents_Computed': int(computed.sum()),
+        'Public_Share': float(agents['is_public'].mean()),
+        'Mean_Start_Age': float(agents['start_age'].mean()),
+    }
+    for name in ('Total_Contributions', 'Total_Benefits', 'Net_Benefit'):
+        row[f"{name}_Mean"] = float(np.nanmean(results[name])) if computed.any() else np.nan
+    for q in quantiles:
+        row[f"Net_Benefit_Q{int(round(q * 100)):02d}"] = (
+            float(np.nanquantile(net, q)) if computed.any() else np.nan
+        )
+    row['Share_Net_Positive'] = float((net[computed] > 0).mean()) if computed.any() else np.nan
+    return row
+
+
+def run_microsimulation(panel, scenario=None, n_agents=10_000, batch_size=50_000, seed=None,
+                        distribution=None, quantiles=QUANTILES, grid=None, regimes=None,
+                        ledger_path=None):
+    """
+    Simulates n_agents individuals per cohort and returns one row per cohort
+    with the distribution of their lifetime contributions, benefits and net
+    benefit. batch_size bounds the agents held in memory at once.
+
+    The scenario's SALARY_LIMITS switch (default on) applies to every
+    agent's wage.
+
+    ledger_path, when given, receives the cashflow ledger of every agent
+    (.parquet or .csv; one row per agent and year, Agent numbered from 0
+    within its cohort, Population = cohort population / n_agents).
+    """
+    if scenario is None:
+        from scenarios import default_scenario
+        scenario = default_scenario()
+    distribution = {**AGENT_DISTRIBUTION, **(distribution or {})}
+
+    if grid is None:
+        grid = build_cohort_grid(prepare_panel(panel))
+    grid = compact_grid(grid)
+    cohorts, n_ages = grid['cohorts'], len(grid['ages'])
+
+    rng = np.random.default_rng(seed)
+    cohorts_per_group = max(1, batch_size // n_agents)
+    rows = []
+    ledger_writer = ResultWriter(ledger_path) if ledger_path else None
+    for first in range(0, len(cohorts), cohorts_per_group):
+        group = np.arange(first, min(first + cohorts_per_group, len(cohorts)))
+        cohort_idx = np.repeat(group, n_agents)
+
+        # Per-agent results of the group, filled batch by batch
+        results = {name: np.empty(len(cohort_idx), dtype=DTYPE)
+                   for name in ('Total_Contributions', 'Total_Benefits', 'Net_Benefit')}
+        start_age = np.empty(len(cohort_idx), dtype=np.int8)
+        is_public = np.empty(len(cohort_idx), dtype=bool)
+        for start in range(0, len(cohort_idx), batch_size):
+            stop = min(start + batch_size, len(cohort_idx))
+            agents = sample_agents(cohort_idx[start:stop], n_ages, scenario['PCT_PUBLIC'],
+                                   int(scenario['WORK_START_AGE']), distribution, rng)
+            batch = evaluate_agents(grid, agents, scenario['PROP_RATE_TABLE'],
+                                    fixed_increase_rate=scenario.get('FIXED_INCREASE_RATE'),
+                                    regimes=regimes, ledger=ledger_writer is not None,
+                                    salary_limits=bool(scenario.get('SALARY_LIMITS', True)))
+            if ledger_writer is not None:
+                flows = {name: batch.pop(name) for name in
+                         ('Contributing', 'Retired', 'Contribution_flows', 'Benefit_flows')}
+                chunk = ledger_frame(grid, agents['cohort_idx'], flows,
+                                     population_weight=1 / n_agents,
+                                     agents=np.arange(start, stop) % n_agents)
+                ledger_writer.write(chunk.astype(AGENT_LEDGER_DTYPES))
+            for name, values in batch.items():
+                results[name][start:stop] = values
+            start_age[start:stop] = agents['start_age']
+            is_public[start:stop] = agents['is_public']
+
+        for k, c in enumerate(group):
+            agent_slice = slice(k * n_agents, (k + 1) * n_agents)
+            rows.append(summarize_cohort(
+                int(cohorts[c]),
+                {name: values[agent_slice] for name, values in results.items()},
+                {'start_age': start_age[agent_slice], 'is_public': is_public[agent_slice]},
+                quantiles=quantiles,
+            ))
+
+    if ledger_writer is not None:
+        ledger_writer.close()
+        log.info(f"--- Agent ledger ({ledger_writer.rows} rows) saved to {os.path.abspath(ledger_path)} ---")
+
+    distribution_df = pd.DataFrame(rows)
+    return distribution_df[distribution_df['Agents_Computed'] > 0].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heterogeneous-agent pension microsimulation.")
+    parser.add_argument('--panel', default=None,
+                        help="Panel file (default: Calculations.FILE_PATH).")
+    parser.add_argument('--agents', type=int, default=10_000,
+                        help="Synthetic individuals per cohort.")
+    parser.add_argument('--batch-size', type=int, default=50_000,
+                        help="Agents evaluated per batch (bounds memory).")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--gap-rate', type=float, default=AGENT_DISTRIBUTION['gap_rate'])
+    parser.add_argument('--start-age-sd', type=float, default=AGENT_DISTRIBUTION['start_age_sd'])
+    parser.add_argument('--output', default='pension_microsim_distribution.csv')
+    parser.add_argument('--ledger', default=None,
+                        help="Also write the cashflow ledger of every agent (.parquet or .csv).")
+    parser.add_argument('--log-level', default=None,
+                        help="Batch runs only show errors by default (e.g. INFO for progress).")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level or 'ERROR', batch=args.log_level is None)
+
+    import Calculations
+    panel_path = args.panel or Calculations.FILE_PATH
+
+    log.info(f"Simulating {args.agents} agents per cohort in batches of {args.batch_size}...")
+    distribution_df = run_microsimulation(
+        load_panel(panel_path), n_agents=args.agents, batch_size=args.batch_size, seed=args.seed,
+        distribution={'gap_rate': args.gap_rate, 'start_age_sd': args.start_age_sd},
+        regimes=Calculations.pension_regimes(), ledger_path=args.ledger,
+    )
+    distribution_df.to_csv(args.output, index=False, float_format='%.2f')
+    log.info(f"--- Distribution per cohort saved to {os.path.abspath(args.output)} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,149 @@
 import pandas as pd
 import numpy as np
-from typing import Union
 
-def disaggregate_population_data(input_excel_path: str, output_excel_path: str):
+AGE_GROUP_PATTERN = r'From\s+(\d+)\s+to\s+(\d+)\s+years'
+
+SPLIT_METHODS = ('uniform', 'spline')
+
+
+def parse_age_groups(labels: pd.Series) -> pd.DataFrame:
+    """
+    Extracts start and end ages from age group labels, all at once.
+    Example: 'From 5 to 9 years' -> (5, 9). Labels that are not a
+    'From ... to ... years' group (e.g. 'Total') give NaN.
+    """
+    ages = labels.astype(str).str.extract(AGE_GROUP_PATTERN)
+    ages.columns = ['start', 'end']
+    return ages.apply(pd.to_numeric)
+
+
+def _monotone_split(start: np.ndarray, end: np.ndarray, total: np.ndarray,
+                    key_id: np.ndarray, ages: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """
+    Single-age values from a monotone cubic (PCHIP) interpolation of the
+    cumulative population. Groups are the intervals [start, end + 1] of the
+    cumulative curve; adjacent groups of the same key share a knot. Every
+    group's single ages sum back to the group total, and no value is negative.
+
+    Inputs are sorted by key then start. `ages`/`group` give, for every
+    single age, its age and the position of its group.
+    """
+    width = (end - start + 1).astype(float)
+    slope = total / width
+
+    # Neighbouring group within the same contiguous run of groups
+    has_next = np.zeros(len(start), dtype=bool)
+    has_next[:-1] = (key_id[1:] == key_id[:-1]) & (start[1:] == end[:-1] + 1)
+    has_prev = np.zeros(len(start), dtype=bool)
+    has_prev[1:] = has_next[:-1]
+
+    # Interior knots: weighted harmonic mean of the two slopes (0 at a local extremum)
+    h1, h2 = width[:-1], width[1:]
+    s1, s2 = slope[:-1], slope[1:]
+    w1, w2 = 2 * h2 + h1, h2 + 2 * h1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior = np.where(s1 * s2 > 0, (w1 + w2) / (w1 / s1 + w2 / s2), 0.0)
+
+    # End knots: three-point estimate, kept monotone
+    def end_slope(h_in, h_out, s_in, s_out):
+        d = ((2 * h_in + h_out) * s_in - h_in * s_out) / (h_in + h_out)
+        d = np.where(np.sign(d) != np.sign(s_in), 0.0, d)
+        return np.where((np.sign(s_in) != np.sign(s_out)) & (np.abs(d) > 3 * np.abs(s_in)),
+                        3 * s_in, d)
+
+    d_left = slope.copy()
+    d_right = slope.copy()
+    d_right[:-1] = np.where(has_next[:-1], interior, d_right[:-1])
+    d_left[1:] = np.where(has_prev[1:], interior, d_left[1:])
+    first = has_next & ~has_prev
+    last = has_prev & ~has_next
+    first_idx, last_idx = np.flatnonzero(first), np.flatnonzero(last)
+    d_left[first_idx] = end_slope(width[first_idx], width[first_idx + 1],
+                                  slope[first_idx], slope[first_idx + 1])
+    d_right[last_idx] = end_slope(width[last_idx], width[last_idx - 1],
+                                  slope[last_idx], slope[last_idx - 1])
+
+    # Cubic Hermite cumulative curve on each group, differenced per single age
+    def cumulative(t):
+        h = width[group]
+        return ((-2 * t**3 + 3 * t**2) * total[group]
+                + (t**3 - 2 * t**2 + t) * h * d_left[group]
+                + (t**3 - t**2) * h * d_right[group])
+
+    t0 = (ages - start[group]) / width[group]
+    t1 = (ages + 1 - start[group]) / width[group]
+    return cumulative(t1) - cumulative(t0)
+
+
+def disaggregate_age_groups(df_long: pd.DataFrame, method: str = 'uniform',
+                            min_age: int = 5, max_age: int = 90,
+                            group_col: str = 'Age_Group_5y',
+                            value_col: str = 'Population_5y_Group') -> pd.DataFrame:
+    """
+    Expands a long table of age groups into single-year ages in one pass.
+
+    Every column other than group_col and value_col (e.g. 'Year', or a
+    source column when several extracts are stacked) is a key and is
+    carried over to the output. Rows whose label is not a
+    'From ... to ... years' group, or whose value is missing, are skipped.
+
+    method='uniform' divides each group total evenly between its ages
+    (truncated to whole persons, as before). method='spline' splits it with
+    a monotone spline through the cumulative population, which removes the
+    step every five years while keeping each group total.
+
+    Returns the key columns plus 'Age' and 'Population', restricted to
+    min_age <= Age <= max_age.
+    """
+    if method not in SPLIT_METHODS:
+        raise ValueError(f"Unknown split method '{method}', expected one of {SPLIT_METHODS}.")
+
+    keys = [c for c in df_long.columns if c not in (group_col, value_col)]
+    groups = pd.concat([df_long[keys].reset_index(drop=True),
+                        parse_age_groups(df_long[group_col]).reset_index(drop=True)], axis=1)
+    groups['total'] = pd.to_numeric(df_long[value_col], errors='coerce').to_numpy()
+    groups = groups.dropna(subset=['start', 'end', 'total'])
+    groups = groups.sort_values(keys + ['start'], kind='stable').reset_index(drop=True)
+
+    start = groups['start'].to_numpy(dtype=int)
+    end = groups['end'].to_numpy(dtype=int)
+    total = groups['total'].to_numpy(dtype=float)
+    width = end - start + 1
+
+    # One output row per single age: repeat each group, then count up from its start
+    group = np.repeat(np.arange(len(groups)), width)
+    offset = np.arange(len(group)) - np.repeat(np.cumsum(width) - width, width)
+    ages = start[group] + offset
+
+    if method == 'uniform':
+        population = np.trunc(total / width)[group]
+    else:
+        key_id = groups.groupby(keys, sort=False).ngroup().to_numpy() if keys else np.zeros(len(groups), dtype=int)
+        population = _monotone_split(start, end, total, key_id, ages, group)
+
+    df_final = groups.loc[group, keys].reset_index(drop=True)
+    df_final['Age'] = ages
+    df_final['Population'] = population
+
+    # Apply the required age filter (5 to 90 by default)
+    in_range = (df_final['Age'] >= min_age) & (df_final['Age'] <= max_age)
+    return df_final[in_range].reset_index(drop=True)
+
+
+def disaggregate_population_data(input_excel_path: str, output_excel_path: str,
+                                 method: str = 'uniform'):
     """
     Transforms aggregated population data (5-year age groups) from an Excel file
     into a disaggregated (single-year age) format, then saves it to a new Excel file.
 
-    The disaggregation is performed by dividing the 5-year group total by 5.
+    The disaggregation is performed by dividing the 5-year group total by 5
+    (method='uniform') or with a monotone spline (method='spline'), see
+    disaggregate_age_groups.
 
     Args:
         input_excel_path (str): Path to the source Excel file.
         output_excel_path (str): Path to save the resulting Excel file.
+        method (str): 'uniform' or 'spline'.
     """
     print("🚀 Starting population data disaggregation...")
 
@@ -75,56 +207,13 @@ def disaggregate_population_data(input_excel_path: str, output_excel_path: str):
     print(f"✅ Data unpivoted. Total {len(df_long)} aggregated data points to disaggregate.")
 
     # --- 3. Disaggregating Age Groups ---
-
-    def parse_age_group(group: str) -> Union[tuple[int, int], None]:
-        """Extracts start and end age from the age group string."""
-        if 'From' in group and 'to' in group:
-            try:
-                # Example: 'From 5 to 9 years' -> (5, 9)
-                parts = group.replace('From', '').replace('to', '').replace('years', '').strip().split()
-                start_age = int(parts[0])
-                end_age = int(parts[1])
-                return start_age, end_age
-            except:
-                return None
-        return None
-
-    def expand_and_divide(row: pd.Series) -> pd.DataFrame:
-        """
-        Creates new rows for each single age within the 5-year group and estimates
-        the population per year age by dividing the 5-year total by 5.
-        """
-        parsed_ages = parse_age_group(row['Age_Group_5y'])
-        if parsed_ages is None:
-            return pd.DataFrame()
-
-        start, end = parsed_ages
-        
-        # Calculate the single-age population: 5-year total divided by 5
-        population_per_age = int(row['Population_5y_Group'] / 5)
-
-        # Create a new row for every single age within the group
-        new_rows = []
-        for age in range(start, end + 1): # +1 to include the end age (e.g., 9 in 5-9)
-            if 5 <= age <= 90: # Apply the required age filter (5 to 90)
-                new_rows.append({
-                    'Year': row['Year'],
-                    'Age': age,
-                    'Population': population_per_age
-                })
-        
-        return pd.DataFrame(new_rows)
-
-    # Apply the disaggregation function to every aggregated data point
-    # Using a list comprehension and pd.concat is very efficient
-    df_disaggregated_list = [expand_and_divide(row) for _, row in df_long.iterrows()]
-    df_final = pd.concat(df_disaggregated_list, ignore_index=True)
+    df_final = disaggregate_age_groups(df_long, method=method)
 
     # --- 4. Final Touches and Saving ---
     # Ensure columns have the correct types for a clean output
     df_final['Year'] = df_final['Year'].astype(int)
     df_final['Age'] = df_final['Age'].astype(int)
-    df_final['Population'] = df_final['Population'].astype(int)
+    df_final['Population'] = df_final['Population'].round().astype(int)
 
     # Order the final columns as requested: Year, Age, Population
     df_final = df_final[['Year', 'Age', 'Population']]
@@ -138,13 +227,12 @@ def disaggregate_population_data(input_excel_path: str, output_excel_path: str):
 
 
 
-# Run the function
-# disaggregate_population_data(INPUT_FILE, OUTPUT_FILE)
-# --- EXECUTION EXAMPLE ---
-# Define your file paths
-INPUT_FILE = r'C:\Users\Nikita.Gaponiuk\Desktop\Statec Hackathon\STATEC-Hackathon\Data\Benefits\Population 1960-2024 by age.xlsx'
-OUTPUT_FILE = 'disaggregated_population_data.xlsx'
+if __name__ == "__main__":
+    # --- EXECUTION EXAMPLE ---
+    # Define your file paths
+    INPUT_FILE = r'C:\Users\Nikita.Gaponiuk\Desktop\Statec Hackathon\STATEC-Hackathon\Data\Benefits\Population 1960-2024 by age.xlsx'
+    OUTPUT_FILE = 'disaggregated_population_data.xlsx'
 
-# Run the function
-disaggregate_population_data(INPUT_FILE, OUTPUT_FILE)
-print("\nExecution completed. Check your output file.")
\ No newline at end of file
+    # Run the function ('spline' avoids the steps every five years)
+    disaggregate_population_data(INPUT_FILE, OUTPUT_FILE, method='uniform')
+    print("\nExecution completed. Check your output file.")
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# Extension of source tables to the panel grid
+# -----------------------------------------------------------------------------
+# The source tables cover fewer ages and years than the 1960-2100 panel (life
+# expectancy stops at age 85 and in 2024, wages in 2050, ...). extend_panel()
+# reindexes a long table onto the full target axes in one pass: the table is
+# laid out as a dense array with one dimension per key (Age x Year, or Year
+# only), and the labels missing on each side of an axis are filled at once
+# according to a fill policy:
+#   - 'edge':             value at the edge of the table (the first or last
+#                         age/year), i.e. the value is held,
+#   - ('constant', v):    the value v,
+#   - 'trend' or ('trend', n):
+#                         straight line fitted (least squares) through the
+#                         last n labels at that edge (default 2),
+#   - ('growth', factor): value at the edge compounded by `factor` per label
+#                         away from the table (divided by it before the
+#                         table), e.g. ('growth', 1.02) for +2% a year,
+#   - None:               no rows.
+# A policy is given per axis, either for both sides or as
+# {'before': ..., 'after': ...}. The axes are extended in the order they are
+# given, so the corner cells (e.g. ages above 85 after 2024) come from the
+# table already extended along the first axis.
+#
+# Only cells that exist in the table (or whose edge cell exists) get a row:
+# a gap in the table stays a gap, like with the row copies this replaces.
+
+POLICIES = ('edge', 'constant', 'trend', 'growth')
+
+DEFAULT_TREND_POINTS = 2
+
+
+def _parse_policy(spec):
+    """(name, parameter) of a policy given as 'edge', ('growth', 1.02), ... or None."""
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        name, param = spec, None
+    else:
+        name, param = spec
+    if name not in POLICIES:
+        raise ValueError(f"Unknown fill policy '{name}' (expected one of {POLICIES}).")
+    if name in ('constant', 'growth') and param is None:
+        raise ValueError(f"The '{name}' fill policy needs a value, e.g. ('{name}', 1.0).")
+    if name == 'trend':
+        param = DEFAULT_TREND_POINTS if param is None else int(param)
+        if param < 2:
+            raise ValueError("The 'trend' fill policy needs at least 2 points.")
+    return name, param
+
+
+def _sides(spec):
+    """(before, after) policies of an axis."""
+    if isinstance(spec, dict):
+        unknown = set(spec) - {'before', 'after'}
+        if unknown:
+            raise ValueError(f"Unknown fill side(s) {sorted(unknown)} (expected 'before' and 'after').")
+        return _parse_policy(spec.get('before')), _parse_policy(spec.get('after'))
+    policy = _parse_policy(spec)
+    return policy, policy
+
+
+def _along(vector, axis, ndim):
+    """Reshapes a 1-D array to broadcast along `axis` of an ndim array."""
+    shape = [1] * ndim
+    shape[axis] = -1
+    return np.asarray(vector).reshape(shape)
+
+
+def _fill_side(arr, labels, targets, axis, policy, after):
+    """
+    Values for the target labels beyond one edge of `labels` (sorted, all
+    outside the table), given in the order of `targets`.
+    """
+    ndim = arr.ndim
+    edge_idx = len(labels) - 1 if after else 0
+    edge = np.take(arr, [edge_idx], axis=axis)
+    distance = (targets - labels[edge_idx]) if after else (labels[edge_idx] - targets)
+    name, param = policy
+
+    if name == 'edge':
+        return np.repeat(edge, len(targets), axis=axis)
+    if name == 'constant':
+        shape = list(arr.shape)
+        shape[axis] = len(targets)
+        return np.full(shape, float(param))
+    if name == 'trend':
+        n = min(param, len(labels))
+        window = np.arange(len(labels) - n, len(labels)) if after else np.arange(n)
+        x = labels[window].astype(np.float64)
+        y = np.take(arr, window, axis=axis)
+        x_mean = x.mean()
+        y_mean = y.mean(axis=axis, keepdims=True)
+        dx = _along(x - x_mean, axis, ndim)
+        slope = (dx * (y - y_mean)).sum(axis=axis, keepdims=True) / (dx ** 2).sum()
+        return y_mean + slope * _along(targets - x_mean, axis, ndim)
+
+    # 'growth': compounded one step at a time (value * f * f * ...), in order
+    # of distance from the table
+    order = np.argsort(distance, kind='stable')
+    steps = np.diff(np.concatenate([[0], distance[order]]))
+    factor = float(param) if after else 1 / float(param)
+    multipliers = np.ones_like(edge) * _along(factor ** steps, axis, ndim)
+    compounded = np.cumprod(np.concatenate([edge, multipliers], axis=axis), axis=axis)
+    compounded = np.take(compounded, np.arange(1, len(targets) + 1), axis=axis)
+    return np.take(compounded, np.argsort(order), axis=axis)
+
+
+def _extend_axis(values, present, labels, targets, axis, before, after):
+    """Reindexes the arrays along one axis from `labels` onto `targets`."""
+    ndim = present.ndim
+    pos = np.clip(np.searchsorted(labels, targets), 0, len(labels) - 1)
+    found = labels[pos] == targets
+    take = np.where(found, pos, 0)
+
+    new_present = np.take(present, take, axis=axis) & _along(found, axis, ndim)
+    new_values = {}
+    for col, arr in values.items():
+        new = np.take(arr, take, axis=axis)
+        new_values[col] = np.where(_along(found, axis, ndim), new, np.nan)
+
+    for policy, side, is_after in ((before, targets < labels[0], False),
+                                   (after, targets > labels[-1], True)):
+        if policy is None or not side.any():
+            continue
+        side_idx = np.flatnonzero(side)
+        edge_present = np.take(present, [len(labels) - 1 if is_after else 0], axis=axis)
+        index = [slice(None)] * ndim
+        index[axis] = side_idx
+        new_present[tuple(index)] = np.repeat(edge_present, len(side_idx), axis=axis)
+        for col, arr in values.items():
+            new_values[col][tuple(index)] = _fill_side(arr, labels, targets[side_idx], axis,
+                                                      policy, is_after)
+    return new_values, new_present
+
+
+def extend_panel(df, axes, fill, columns=None):
+    """
+    Reindexes a long table onto target axes, filling the labels outside the
+    table with the fill policies (see above).
+
+    axes maps each key column to its target labels, in extension order, e.g.
+    {'Age': range(1, 100), 'Year': range(1960, 2101)}; fill maps each key
+    column to its policy (a key without a policy is not extended). `columns`
+    defaults to every non-key column.
+
+    Returns a long DataFrame with the keys and the columns, one row per
+    target cell that exists, sorted by the keys in the order of `axes`.
+    """
+    keys = list(axes)
+    if columns is None:
+        columns = [c for c in df.columns if c not in keys]
+    df = df.dropna(subset=keys)
+
+    # --- Dense array of the table, one dimension per key ---
+    labels, codes = [], []
+    for key in keys:
+        key_labels, key_codes = np.unique(df[key].to_numpy(dtype=np.int64), return_inverse=True)
+        labels.append(key_labels)
+        codes.append(key_codes)
+    shape = tuple(len(key_labels) for key_labels in labels)
+    present = np.zeros(shape, dtype=bool)
+    present[tuple(codes)] = True
+    values = {}
+    for col in columns:
+        arr = np.full(shape, np.nan)
+        arr[tuple(codes)] = df[col].to_numpy(dtype=np.float64)
+        values[col] = arr
+
+    # --- Reindex each axis onto its targets ---
+    for axis, key in enumerate(keys):
+        targets = np.unique(np.asarray(axes[key], dtype=np.int64))
+        if not len(labels[axis]):
+            break
+        before, after = _sides(fill.get(key))
+        values, present = _extend_axis(values, present, labels[axis], targets, axis, before, after)
+        labels[axis] = targets
+
+    # --- Back to the long format ---
+    cells = np.nonzero(present)
+    out = pd.DataFrame({key: labels[axis][cells[axis]] for axis, key in enumerate(keys)})
+    for col in columns:
+        out[col] = values[col][cells]
+        dtype = df[col].dtype
+        if dtype.kind in 'iub' and not out[col].isna().any():
+            out[col] = out[col].astype(dtype)
+    return out
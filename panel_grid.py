@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+from panel_store import apply_schema, load_panel, save_panel
+
+# -----------------------------------------------------------------------------
+# Array-backed Age x Year panel
+# -----------------------------------------------------------------------------
+# The long-format panel repeats Age, Year and Birth_Year on every row, and a
+# cell is found with a boolean mask over the whole frame. A PanelGrid holds
+# one dense (Age x Year) float array per variable instead, so:
+#   - a cell is an index lookup: values[col][age - first_age, year - first_year],
+#   - a cohort's life-course (Birth_Year = Year - Age) is a diagonal of the
+#     arrays, and all cohorts can be taken at once as a (Birth_Year x Age)
+#     grid (used by pension_engine),
+#   - the keys are stored once, as the two axes.
+# Cells without a row in the long panel are NaN and False in `present`.
+
+
+class PanelGrid:
+    """Dense (Age x Year) arrays of panel variables."""
+
+    def __init__(self, ages, years, values, present=None):
+        self.ages = np.asarray(ages, dtype=np.int64)
+        self.years = np.asarray(years, dtype=np.int64)
+        self.values = dict(values)
+        shape = (len(self.ages), len(self.years))
+        if present is None:
+            present = np.ones(shape, dtype=bool)
+        self.present = present
+        for col, arr in self.values.items():
+            if arr.shape != shape:
+                raise ValueError(f"Column '{col}' has shape {arr.shape}, expected {shape}.")
+
+    # --- Conversion from / to the long format ---
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """
+        Builds the grid from a long-format panel. Ages are taken from the Age
+        column, or from Year - Birth_Year when there is none. `columns`
+        defaults to every column except the keys. If a cell appears more
+        than once, the last row wins.
+        """
+        year = df['Year'].to_numpy(dtype=np.int64)
+        if 'Age' in df.columns:
+            age = df['Age'].to_numpy(dtype=np.int64)
+        else:
+            age = year - df['Birth_Year'].to_numpy(dtype=np.int64)
+        if columns is None:
+            columns = [c for c in df.columns if c not in ('Age', 'Year', 'Birth_Year')]
+
+        if len(df):
+            ages = np.arange(age.min(), age.max() + 1)
+            years = np.arange(year.min(), year.max() + 1)
+        else:
+            ages = years = np.arange(0)
+        a_idx = age - (ages[0] if len(ages) else 0)
+        y_idx = year - (years[0] if len(years) else 0)
+        shape = (len(ages), len(years))
+
+        present = np.zeros(shape, dtype=bool)
+        present[a_idx, y_idx] = True
+        values = {}
+        for col in columns:
+            arr = np.full(shape, np.nan)
+            arr[a_idx, y_idx] = df[col].to_numpy(dtype=np.float64)
+            values[col] = arr
+        return cls(ages, years, values, present)
+
+    @classmethod
+    def from_file(cls, path, columns=None):
+        """Loads a panel file (CSV, Parquet, ...; see panel_store.load_panel)."""
+        read = None if columns is None else ['Age', 'Year'] + list(columns)
+        return cls.from_frame(load_panel(path, columns=read), columns=columns)
+
+    def to_frame(self):
+        """
+        Long-format panel (one row per present cell, sorted by Age then Year,
+        with Birth_Year), typed with the panel schema.
+        """
+        a_idx, y_idx = np.nonzero(self.present)
+        age = self.ages[a_idx]
+        year = self.years[y_idx]
+        df = pd.DataFrame({'Age': age, 'Year': year})
+        for col, arr in self.values.items():
+            df[col] = arr[a_idx, y_idx]
+        df['Birth_Year'] = year - age
+        return apply_schema(df)
+
+    def save(self, path, fmt=None, csv=False):
+        """Writes the long-format panel (see panel_store.save_panel)."""
+        return save_panel(self.to_frame(), path, fmt=fmt, csv=csv)
+
+    # --- Lookups ---
+
+    @property
+    def columns(self):
+        return list(self.values)
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays."""
+        return self.present.nbytes + sum(arr.nbytes for arr in self.values.values())
+
+    def __getitem__(self, col):
+        return self.values[col]
+
+    def __contains__(self, col):
+        return col in self.values
+
+    def cell(self, col, age, year):
+        """Value of one (Age, Year) cell; NaN outside the grid."""
+        a, y = age - self.ages[0], year - self.years[0]
+        if 0 <= a < len(self.ages) and 0 <= y < len(self.years):
+            return self.values[col][a, y]
+        return np.nan
+
+    def cohorts(self):
+        """Birth years with at least one present cell."""
+        a_idx, y_idx = np.nonzero(self.present)
+        return np.unique(self.years[y_idx] - self.ages[a_idx])
+
+    def cohort(self, col, birth_year):
+        """Life-course of one cohort: values of `col` at every age of the grid."""
+        return self.cohort_grid([col], cohorts=[birth_year])[col][0]
+
+    def cohort_grid(self, columns=None, cohorts=None):
+        """
+        Diagonals of the grid for many cohorts at once.
+
+        Returns a dict with the 'cohorts' and 'ages' axes, the 'present'
+        mask (True where the cell exists and none of `columns` is NaN) and
+        one (Birth_Year x Age) float array per column, with
+        [cohort, age] holding the cell (age, cohort + age).
+        """
+        if columns is None:
+            columns = self.columns
+        cohorts = self.cohorts() if cohorts is None else np.asarray(cohorts, dtype=np.int64)
+
+        y_idx = cohorts[:, None] + self.ages[None, :] - (self.years[0] if len(self.years) else 0)
+        valid = (y_idx >= 0) & (y_idx < len(self.years))
+        # Flat position of cell (age, cohort + age) in the (Age x Year) arrays
+        flat = np.arange(len(self.ages)) * len(self.years) + np.where(valid, y_idx, 0)
+        if len(self.years):
+            exists = valid & self.present.ravel()[flat]
+        else:
+            exists = valid
+
+        present = exists.copy()
+        grid = {'cohorts': cohorts, 'ages': self.ages}
+        for col in columns:
+            if len(self.years):
+                values = np.where(exists, self.values[col].ravel()[flat], np.nan)
+            else:
+                values = np.full(y_idx.shape, np.nan)
+            present &= ~np.isnan(values)
+            grid[col] = values
+        grid['present'] = present
+        return grid
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# Typed columnar storage for the panel and the pipeline intermediates
+# -----------------------------------------------------------------------------
+# merge.py writes every panel in a binary columnar format (Parquet by
+# default, Feather as an alternative) next to the optional CSV export.
+# Binary files carry their column types, so loading them skips CSV parsing
+# and the pd.to_numeric pass entirely.
+#
+# Parquet/Feather need pyarrow. Without it, panels fall back to pickle,
+# which also keeps the column types.
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Fixed schema of the known panel columns. Keys and years fit in int16; every
+# value that enters the pension calculation stays float64 so results are
+# unchanged compared with reading the CSV.
+PANEL_SCHEMA = {
+    'Age': 'int16',
+    'Year': 'int16',
+    'Birth_Year': 'int16',
+    '1999_dummy': 'int8',
+    'Population': 'float64',
+    'Life_Expectancy': 'float64',
+    'Retirement_age': 'float64',
+    'Contribution_rate': 'float64',
+    'Reference_amount_1984': 'float64',
+    'Revaleurisation_rate': 'float64',
+    'Adjustment_factor_1984': 'float64',
+    'Salary': 'float64',
+    'Income_per_year': 'float64',
+    'Contribution_ceiling': 'float64',
+    'Minimum_salary': 'float64',
+}
+
+EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'pickle': '.pkl',
+    'csv': '.csv',
+}
+
+
+def default_format():
+    """Parquet when pyarrow is installed, pickle otherwise."""
+    return 'parquet' if HAS_PYARROW else 'pickle'
+
+
+def format_of(path):
+    """Storage format implied by a file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, fmt_ext in EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"Unknown panel file extension '{ext}' for '{path}'.")
+
+
+def with_format(path, fmt):
+    """Same path with the extension of the given format (x.csv -> x.parquet)."""
+    return os.path.splitext(path)[0] + EXTENSIONS[fmt]
+
+
+def apply_schema(df):
+    """
+    Casts the known panel columns to their PANEL_SCHEMA types. Other columns
+    are left as they are. Integer columns holding NaN are kept as float64.
+    """
+    df = df.copy()
+    for col, dtype in PANEL_SCHEMA.items():
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        if np.dtype(dtype).kind == 'i' and values.isna().any():
+            dtype = 'float64'
+        df[col] = values.astype(dtype)
+    return df
+
+
+def save_panel(df, path, fmt=None, csv=False):
+    """
+    Writes a panel with the fixed schema. The format comes from `fmt` or,
+    if not given, from the extension of `path`. With csv=True a CSV copy
+    (same name, .csv extension) is exported from the untyped frame as well.
+    Returns the path of the binary file.
+    """
+    if fmt is None:
+        fmt = format_of(path)
+    path = with_format(path, fmt)
+
+    typed = apply_schema(df)
+    if fmt == 'parquet':
+        # Parquet needs string column names and no custom index
+        typed.reset_index(drop=True).to_parquet(path, index=False)
+    elif fmt == 'feather':
+        typed.reset_index(drop=True).to_feather(path)
+    elif fmt == 'pickle':
+        typed.to_pickle(path)
+    elif fmt == 'csv':
+        typed.to_csv(path, index=False)
+    else:
+        raise ValueError(f"Unknown panel format '{fmt}'.")
+
+    if csv and fmt != 'csv':
+        df.to_csv(with_format(path, 'csv'), index=False)
+    return path
+
+
+def resolve_panel_path(path):
+    """
+    For a CSV path, the up-to-date binary sibling (same name, newer or equal
+    modification time) when one exists; otherwise the path itself.
+    """
+    if format_of(path) == 'csv':
+        for binary_fmt in ('parquet', 'feather', 'pickle'):
+            candidate = with_format(path, binary_fmt)
+            if (os.path.exists(candidate)
+                    and (not os.path.exists(path)
+                         or os.path.getmtime(candidate) >= os.path.getmtime(path))):
+                return candidate
+    return path
+
+
+def load_panel(path, columns=None):
+    """
+    Loads a panel. Binary files are read as stored; a CSV is parsed and
+    coerced to the schema. For a CSV path, an up-to-date binary sibling
+    is used instead when one exists (see resolve_panel_path).
+    """
+    path = resolve_panel_path(path)
+    fmt = format_of(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if fmt == 'feather':
+        return pd.read_feather(path, columns=columns)
+    if fmt == 'pickle':
+        df = pd.read_pickle(path)
+        return df[columns] if columns is not None else df
+
+    df = pd.read_csv(path, usecols=columns)
+    return apply_schema(df)
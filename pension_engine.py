@@ -0,0 +1,426 @@
+import numpy as np
+import pandas as pd
+
+from annuity import annuity_factor
+from panel_grid import PanelGrid
+from rate_schedule import RateSchedule
+from regimes import DEFAULT_REGIMES, combine_regimes
+
+# -----------------------------------------------------------------------------
+# Vectorized all-cohort pension engine
+# -----------------------------------------------------------------------------
+# The panel is laid out on a dense (Birth_Year x Age) grid, where the cell
+# [cohort, age] holds the row for Year = cohort + age. A cohort's life-course
+# is then a single grid row, so the per-cohort lookups done in the original
+# loop (work start row, retirement row, final working year, lifespan and
+# working-life windows) become index arithmetic and masked sums that run for
+# every cohort at once.
+
+# Columns the calculation needs (rows missing any of them are ignored).
+REQUIRED_COLUMNS = [
+    'Birth_Year', 'Year', 'Population', 'Life_Expectancy',
+    'Retirement_age', 'Contribution_rate', '1999_dummy',
+    'Reference_amount_1984', 'Revaleurisation_rate', 'Salary',
+    'Adjustment_factor_1984'
+]
+
+# Statutory limits of the contributable salary (see contributable_salary).
+# Optional: a panel without them is computed on the uncapped Salary.
+SALARY_LIMIT_COLUMNS = ['Contribution_ceiling', 'Minimum_salary']
+
+# Result columns, in the order they are written to the results CSV.
+RESULT_COLUMNS = [
+    'Cohort', 'Total_Contributions', 'Total_Benefits', 'Net_Benefit',
+    'Lifetime_Fixed_Benefit', 'Lifetime_Prop_Benefit', 'Lifetime_Public_Benefit'
+]
+
+# Result column of each regime's benefits, written when the regimes are
+# given explicitly (see regimes.py).
+REGIME_RESULT_COLUMN = 'Lifetime_Benefit_{}'
+
+# Reasons a cohort can be skipped, in the order the checks are applied.
+SKIP_REASONS = {
+    1: 'No data found for assumed work start year',
+    2: 'No lifespan data found',
+    3: 'No working life data found',
+    4: 'No data found for retirement year',
+    5: 'No data found for final working year',
+}
+
+
+def prepare_panel(df):
+    """
+    Checks that the panel has the REQUIRED_COLUMNS and drops the rows where
+    any of them is missing. Raises ValueError listing missing columns.
+    """
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Panel is missing required columns: {', '.join(missing_cols)}")
+    return df.dropna(subset=REQUIRED_COLUMNS)
+
+
+def build_cohort_grid(df, columns=None):
+    """
+    Pivots the long-format panel onto a dense (Birth_Year x Age) grid
+    (see PanelGrid.cohort_grid).
+
+    Returns a dict with the sorted 'cohorts' and 'ages' axes, a boolean
+    'present' mask (True where a complete row exists) and one 2-D float
+    array per column. Missing cells are NaN. The SALARY_LIMIT_COLUMNS of
+    the panel are added too, without being part of the 'present' mask.
+    """
+    if columns is None:
+        columns = [c for c in REQUIRED_COLUMNS if c not in ('Birth_Year', 'Year')]
+    limits = [c for c in SALARY_LIMIT_COLUMNS if c in df.columns and c not in columns]
+
+    # Rows are laid out on (Age x Year) arrays, whose diagonals are the cohorts
+    panel_grid = PanelGrid.from_frame(df, columns=columns + limits)
+    grid = panel_grid.cohort_grid(columns)
+    if limits:
+        limit_grid = panel_grid.cohort_grid(limits, cohorts=grid['cohorts'])
+        for col in limits:
+            grid[col] = limit_grid[col]
+    return grid
+
+
+def prop_rates_for_years(rate_map, years):
+    """
+    Proportional rates for an array of retirement years. rate_map is a
+    {RetirementYear: Rate} table (nearest-year lookup, ties go to the year
+    listed first; an empty table gives a rate of 0) or a RateSchedule.
+    Tables are compiled once (see rate_schedule.py).
+    """
+    return RateSchedule.of(rate_map).rates(years)
+
+
+def population_survival(grid):
+    """
+    Survival curve of every cohort from the Population diagonal: the share
+    of the cohort still alive at each age of the grid, relative to the
+    first age. Year-on-year ratios above 1 (net immigration) are capped at
+    1, so the curve never increases. Where a ratio cannot be computed
+    (missing population), the cohort is assumed to survive the year; an
+    empty cohort (population 0) does not.
+
+    Computed with one ratio over the whole (Birth_Year x Age) array; the
+    result has the shape of grid['Population'].
+    """
+    population = grid['Population']
+    current, following = population[..., :-1], population[..., 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.minimum(following / current, 1.0)
+    ratio = np.where(current == 0, 0.0, ratio)
+    ratio = np.where(np.isnan(ratio), 1.0, ratio)
+    first = np.ones(population.shape[:-1] + (1,))
+    return np.concatenate([first, np.cumprod(ratio, axis=-1)], axis=-1)
+
+
+def contributable_salary(salary, grid, rows=slice(None)):
+    """
+    Salary clipped to the statutory limits of its year: at least the
+    minimum wage and at most the contribution ceiling. The limits are
+    nominal annual amounts, so they are put on the scale of Salary
+    (Income_per_year / Revaleurisation_rate) first. `rows` selects the grid
+    rows matching `salary`. Without the SALARY_LIMIT_COLUMNS in the grid,
+    or where a limit is NaN, the salary is not limited.
+    """
+    if not all(col in grid for col in SALARY_LIMIT_COLUMNS):
+        return salary
+    revaluation = grid['Revaleurisation_rate'][rows]
+    floor = np.nan_to_num(grid['Minimum_salary'][rows] / revaluation, nan=-np.inf)
+    ceiling = np.nan_to_num(grid['Contribution_ceiling'][rows] / revaluation, nan=np.inf)
+    return np.clip(salary, floor, ceiling)
+
+
+def _take(values, idx, valid):
+    """Picks values[..., c, idx[..., c]] along the age axis; NaN where invalid."""
+    values = np.broadcast_to(values, idx.shape + values.shape[-1:])
+    safe_idx = np.where(valid, idx, 0)
+    picked = np.take_along_axis(values, safe_idx[..., None], axis=-1)[..., 0]
+    return np.where(valid, picked, np.nan)
+
+
+def evaluate_cohorts(grid, pct_public, work_start_age, prop_rate_table,
+                     fixed_increase_rate=None, discount_rate=0.0, indexation_rate=0.0,
+                     annuity_table=None, survival_weighting=False, salary_limits=True,
+                     regimes=None, ledger=False):
+    """
+    Runs the lifetime pension calculation for every cohort of the grid.
+
+    prop_rate_table is a {RetirementYear: Rate} table (nearest year) or a
+    rate_schedule.RateSchedule.
+
+    fixed_increase_rate, when given, scales the fixed (duration-based) part
+    of the private IAP. None keeps the current model, where the fixed part
+    is (N_years / 40) * Reference_amount_1984.
+
+    discount_rate and indexation_rate value the benefit stream with the
+    annuity factor a(num_retire_years, r, g) instead of num_retire_years
+    (see annuity.py); with a discount rate, contributions are accumulated
+    to the retirement year at that rate too, so all amounts are valued at
+    the retirement year. annuity_table, a precomputed annuity.AnnuityTable
+    holding the two rates, replaces the closed form. The defaults (0, 0,
+    no table) are the current model.
+
+    survival_weighting replaces the rounded Life_Expectancy window by the
+    cohort's survival curve (see population_survival; grid['Survival'] is
+    used when present, so it can be computed once for many calls): every
+    yearly contribution and benefit is weighted by the probability of being
+    alive at that age given alive at work_start_age, and benefits are paid
+    at every age of the grid from the retirement age on. annuity_table must
+    then be a survival table of the grid (annuity.AnnuityTable.for_survival).
+
+    salary_limits clips the Salary to the minimum wage and the contribution
+    ceiling of each year in the contributions and the adjusted earnings
+    (see contributable_salary), when the grid has the limit columns. The
+    final salary of the old public regime is not limited.
+
+    regimes lists the pension regimes the cohorts are split across (see
+    regimes.py); all are evaluated at once and the IAP is their weighted
+    average. None is the current model (DEFAULT_REGIMES: general regime
+    plus the old public regime for pct_public of the pre-1999 cohorts).
+    With explicit regimes, the benefits of each regime are returned too
+    (REGIME_RESULT_COLUMN).
+
+    ledger=True also returns the yearly flows behind the totals, as
+    (cohort x age) arrays (see ledger.py): 'Contributing' and 'Retired'
+    masks and the 'Contribution_flows' and 'Benefit_flows' of each year.
+    The flows are not discounted (benefits are indexed), so they add up
+    to the totals when discount_rate is 0.
+
+    Field arrays may carry extra leading dimensions (e.g. simulated paths);
+    everything is computed along the last (age) axis. Returns a dict of
+    result arrays shaped like the cohort axis, NaN for skipped cohorts, plus
+    an integer 'skip_code' array (0 = processed, see SKIP_REASONS).
+    """
+    ages = grid['ages']
+    present = grid['present']
+    n_ages = len(ages)
+    age0 = ages[0] if n_ages else 0
+    age_axis = ages.astype(np.float64)
+
+    # Shape of the cohort axis plus any leading (e.g. path) dimensions
+    batch_shape = np.broadcast_shapes(
+        present.shape[:-1],
+        *(np.shape(grid[col])[:-1] for col in REQUIRED_COLUMNS if col in grid)
+    )
+
+    # --- A. Cohort-level data from the work-start row ---
+    start_idx = work_start_age - age0
+    if 0 <= start_idx < n_ages:
+        has_start = present[..., start_idx]
+        retirement_age = np.round(grid['Retirement_age'][..., start_idx])
+        life_expectancy = np.round(grid['Life_Expectancy'][..., start_idx])
+        dummy_1999 = grid['1999_dummy'][..., start_idx]
+    else:
+        has_start = np.zeros(present.shape[:-1], dtype=bool)
+        retirement_age = life_expectancy = dummy_1999 = np.full(has_start.shape, np.nan)
+
+    has_start = np.broadcast_to(has_start, batch_shape)
+    retirement_age = np.broadcast_to(retirement_age, batch_shape)
+    life_expectancy = np.broadcast_to(life_expectancy, batch_shape)
+    dummy_1999 = np.broadcast_to(dummy_1999, batch_shape)
+
+    # Ages covered by the lifespan [start, start + LE) and the working life
+    # [start, retirement - 1] (both expressed in ages, Year = cohort + age).
+    end_life_age = work_start_age + life_expectancy
+    end_work_age = retirement_age - 1
+    in_lifespan = (
+        present
+        & (age_axis >= work_start_age)
+        & (age_axis < end_life_age[..., None])
+    )
+    in_working = in_lifespan & (age_axis <= end_work_age[..., None])
+
+    # --- B./C. Skip checks, in the same order as the original loop ---
+    skip_code = np.zeros(batch_shape, dtype=np.int8)
+    pending = has_start.copy()
+    skip_code[~pending] = 1
+
+    has_lifespan = in_lifespan.any(axis=-1)
+    skip_code[pending & ~has_lifespan] = 2
+    pending &= has_lifespan
+
+    has_working = in_working.any(axis=-1)
+    skip_code[pending & ~has_working] = 3
+    pending &= has_working
+
+    retire_idx = np.nan_to_num(retirement_age - age0, nan=-1).astype(np.int64)
+    retire_valid = (
+        pending
+        & (retire_idx >= 0) & (retire_idx < n_ages)
+        & (retirement_age >= work_start_age) & (retirement_age < end_life_age)
+    )
+    retire_valid &= _take(present.astype(np.float64), retire_idx, retire_valid) == 1
+    skip_code[pending & ~retire_valid] = 4
+    pending &= retire_valid
+
+    final_idx = retire_idx - 1
+    final_valid = pending & (final_idx >= 0) & (final_idx < n_ages)
+    final_valid &= _take(in_working.astype(np.float64), final_idx, final_valid) == 1
+    skip_code[pending & ~final_valid] = 5
+    pending &= final_valid
+
+    salary = grid['Salary']
+    if salary_limits:
+        salary = contributable_salary(salary, grid)
+
+    # --- Formula 1: Total Lifetime Contributions ---
+    contributions = salary * grid['Contribution_rate']
+    if discount_rate:
+        contributions = contributions * (1 + discount_rate) ** (retirement_age[..., None] - age_axis)
+    if survival_weighting:
+        survival = grid['Survival'] if 'Survival' in grid else population_survival(grid)
+        # Probability of being alive at each age, given alive at the work start age
+        if 0 <= start_idx < n_ages:
+            start_survival = survival[..., start_idx:start_idx + 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                alive = np.where(start_survival > 0, survival / start_survival, 0.0)
+        else:
+            start_survival = np.zeros(survival.shape[:-1] + (1,))
+            alive = np.zeros(survival.shape)
+        contributing = (present
+                        & (age_axis >= work_start_age)
+                        & (age_axis <= end_work_age[..., None]))
+        total_contributions = np.where(contributing, contributions * alive, 0.0).sum(axis=-1)
+    else:
+        total_contributions = np.where(in_working, contributions, 0.0).sum(axis=-1)
+
+    # --- Formula 2, Stage 1: Initial Annual Pension ---
+    N_years = np.minimum(retirement_age - work_start_age, 40)
+    reference_amount = _take(grid['Reference_amount_1984'], retire_idx, pending)
+    fixed_increases = (N_years / 40) * reference_amount
+    if fixed_increase_rate is not None:
+        fixed_increases = fixed_increases * fixed_increase_rate
+
+    sum_adjusted_earnings = np.where(
+        in_working,
+        salary / grid['Adjustment_factor_1984'] / grid['Revaleurisation_rate'],
+        0.0
+    ).sum(axis=-1)
+    cohorts = grid['cohorts']
+    retirement_year = cohorts + np.nan_to_num(retirement_age).astype(np.int64)
+    prop_rate = prop_rates_for_years(prop_rate_table, retirement_year)
+    proportional_increases = sum_adjusted_earnings * prop_rate
+
+    final_salary = _take(grid['Salary'], final_idx, pending)
+
+    # IAP of every regime, combined by the regimes' shares of the cohort
+    regime_list = DEFAULT_REGIMES if regimes is None else regimes
+    context = {
+        'cohorts': cohorts, 'pct_public': pct_public, 'dummy_1999': dummy_1999,
+        'N_years': N_years, 'retirement_year': retirement_year,
+        'fixed_increases': fixed_increases, 'sum_adjusted_earnings': sum_adjusted_earnings,
+        'prop_rate': prop_rate, 'final_salary': final_salary,
+    }
+    iap_C, weights, iaps = combine_regimes(regime_list, context)
+    general = next(i for i, regime in enumerate(regime_list) if regime.get('share') is None)
+    weight_private = weights[general]
+    # Weighted IAP of the regimes other than the general one
+    iap_public = np.delete(weights * iaps, general, axis=0).sum(axis=0)
+
+    # --- Formula 2, Stage 2: Sum IAP over retirement ---
+    num_retire_years = np.maximum((work_start_age + life_expectancy) - retirement_age, 0)
+    # Value of one unit of IAP per retirement year (the number of years when
+    # it is not indexed nor discounted)
+    if annuity_table is not None and annuity_table.by_cohort != bool(survival_weighting):
+        raise ValueError("Survival-weighted runs need an AnnuityTable.for_survival table, "
+                         "and the other runs a table by retirement year.")
+    if survival_weighting and annuity_table is not None:
+        # Payments from the retirement age to the last age of the grid,
+        # brought from the first age of the grid to the retirement age and
+        # conditioned on being alive at the work start age
+        q = (1 + indexation_rate) / (1 + discount_rate)
+        after_retirement = (annuity_table.lookup(cohorts, n_ages, discount_rate, indexation_rate)
+                            - annuity_table.lookup(cohorts, retire_idx, discount_rate, indexation_rate))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annuity = np.where(start_survival[..., 0] > 0,
+                               after_retirement * q ** -retire_idx / start_survival[..., 0], 0.0)
+    elif survival_weighting:
+        years_retired = age_axis - retirement_age[..., None]
+        payment = alive * ((1 + indexation_rate) / (1 + discount_rate)) ** years_retired
+        annuity = np.where(present & (years_retired >= 0), payment, 0.0).sum(axis=-1)
+    elif annuity_table is not None:
+        retirement_year = cohorts + np.nan_to_num(retirement_age)
+        annuity = annuity_table.lookup(retirement_year, num_retire_years,
+                                       discount_rate, indexation_rate)
+    elif discount_rate or indexation_rate:
+        annuity = annuity_factor(num_retire_years, discount_rate, indexation_rate)
+    else:
+        annuity = num_retire_years
+    total_lifetime_benefits = iap_C * annuity
+
+    # --- Formula 3: Net Lifetime Benefit ---
+    net_benefit = total_lifetime_benefits - total_contributions
+
+    results = {
+        'Total_Contributions': total_contributions,
+        'Total_Benefits': total_lifetime_benefits,
+        'Net_Benefit': net_benefit,
+        'Lifetime_Fixed_Benefit': fixed_increases * weight_private * annuity,
+        'Lifetime_Prop_Benefit': proportional_increases * weight_private * annuity,
+        'Lifetime_Public_Benefit': iap_public * annuity,
+    }
+    if regimes is not None:
+        for i, regime in enumerate(regime_list):
+            results[REGIME_RESULT_COLUMN.format(regime['name'])] = weights[i] * iaps[i] * annuity
+    for name, values in results.items():
+        results[name] = np.where(pending, values, np.nan)
+
+    if ledger:
+        # Yearly flows of the processed cohorts (cash amounts, not discounted)
+        processed = pending[..., None]
+        years_retired = age_axis - retirement_age[..., None]
+        if survival_weighting:
+            contributing = contributing & processed
+            retired = present & (years_retired >= 0) & processed
+            weight = alive
+        else:
+            contributing = in_working & processed
+            retired = (years_retired >= 0) & (age_axis < end_life_age[..., None]) & processed
+            weight = 1.0
+        indexation = (1 + indexation_rate) ** np.where(retired, years_retired, 0.0)
+        results['Contributing'] = contributing
+        results['Retired'] = retired
+        results['Contribution_flows'] = np.where(
+            contributing, salary * grid['Contribution_rate'] * weight, 0.0)
+        results['Benefit_flows'] = np.where(retired, iap_C[..., None] * indexation * weight, 0.0)
+    results['skip_code'] = skip_code
+    return results
+
+
+def compute_cohort_results(df, pct_public, work_start_age, prop_rate_table, grid=None,
+                           fixed_increase_rate=None, discount_rate=0.0, indexation_rate=0.0,
+                           annuity_table=None, survival_weighting=False, salary_limits=True,
+                           regimes=None):
+    """
+    Vectorized replacement for the per-cohort loop of calculate_pension_wealth.
+
+    Returns (results_df, skipped_df): one row per processed cohort with the
+    RESULT_COLUMNS (plus one benefit column per regime when `regimes` is
+    given), and one row per skipped cohort with the reason.
+    A prebuilt grid (see build_cohort_grid) can be passed to avoid
+    re-pivoting the panel when running several scenarios.
+    """
+    if grid is None:
+        grid = build_cohort_grid(df)
+
+    results = evaluate_cohorts(grid, pct_public, work_start_age, prop_rate_table,
+                               fixed_increase_rate=fixed_increase_rate,
+                               discount_rate=discount_rate, indexation_rate=indexation_rate,
+                               annuity_table=annuity_table,
+                               survival_weighting=survival_weighting,
+                               salary_limits=salary_limits, regimes=regimes)
+    cohorts = grid['cohorts']
+    skip_code = results.pop('skip_code')
+    processed = skip_code == 0
+
+    results_df = pd.DataFrame({'Cohort': cohorts[processed]})
+    for name in RESULT_COLUMNS[1:] + [c for c in results if c not in RESULT_COLUMNS]:
+        results_df[name] = results[name][processed]
+
+    skipped_df = pd.DataFrame({
+        'Cohort': cohorts[~processed],
+        'Reason': [SKIP_REASONS[code] for code in skip_code[~processed]],
+    })
+    return results_df, skipped_df
@@ -0,0 +1,155 @@
+import cProfile
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from logs import SUMMARY, get_logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = get_logger('profiling')
+
+# -----------------------------------------------------------------------------
+# Per-stage profiling
+# -----------------------------------------------------------------------------
+# PROFILER.stage(name) wraps a pipeline stage or a calculator phase:
+#
+#     with PROFILER.stage('calculations.load') as record:
+#         df = load_panel(path)
+#         record['rows'] = len(df)
+#
+# (or @profiled('name') on a function). When profiling is off, a stage only
+# adds its wall time to the run summary (see logs.py). When it is on
+# (PROFILER.enable(), the --profile flags, PENSION_PROFILE=1), every stage
+# records:
+#   - wall time and CPU time (user + system, including finished child
+#     processes, e.g. the workbook parsing pool),
+#   - peak RSS during the stage (the kernel's high-water mark is reset at
+#     the start of each stage where Linux allows it, otherwise the peak of
+#     the process so far) and RSS at the end,
+#   - the row count the stage reports.
+# write_report() saves the records as JSON; cprofile(path) additionally runs
+# the block under cProfile and dumps the stats (view with pstats/snakeviz).
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _proc_status(field):
+    """A memory field of /proc/self/status in MB, or None."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Resets the peak RSS of the process (Linux only). Returns True if done."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    peak = _proc_status('VmHWM')
+    if peak is None and resource is not None:
+        # ru_maxrss is in KB on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if os.uname().sysname == 'Darwin':
+            peak /= 1024
+    return peak
+
+
+class Profiler:
+    """Collects one record per profiled stage."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        return self
+
+    def reset(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name):
+        """Profiles the block; yields a dict where the block can set 'rows'."""
+        record = {'stage': name}
+        if not self.enabled:
+            with SUMMARY.timed(name):
+                yield record
+            return
+
+        peak_reset = _reset_peak_rss()
+        wall_start, cpu_start = time.perf_counter(), _cpu_seconds()
+        try:
+            with SUMMARY.timed(name):
+                yield record
+        finally:
+            record.update({
+                'wall_seconds': round(time.perf_counter() - wall_start, 6),
+                'cpu_seconds': round(_cpu_seconds() - cpu_start, 6),
+                'peak_rss_mb': _peak_rss_mb(),
+                'peak_rss_scope': 'stage' if peak_reset else 'process',
+                'rss_end_mb': _proc_status('VmRSS'),
+            })
+            record.setdefault('rows', None)
+            self.records.append(record)
+            log.debug(f"[profile] {name}: {record['wall_seconds']:.3f}s wall, "
+                      f"{record['cpu_seconds']:.3f}s CPU, peak RSS {record['peak_rss_mb']} MB")
+
+    def report(self):
+        return {'stages': list(self.records)}
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        log.info(f"--- Profile report saved to {os.path.abspath(path)} ---")
+        return path
+
+
+@contextmanager
+def cprofile(path):
+    """Runs the block under cProfile and dumps the stats to `path`."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        log.info(f"--- cProfile stats saved to {os.path.abspath(path)} ---")
+
+
+def profiled(name=None):
+    """Decorator: profiles every call of the function as a stage."""
+    def decorate(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Profiler of the current run (on when PENSION_PROFILE is set)
+PROFILER = Profiler(enabled=os.environ.get('PENSION_PROFILE', '') not in ('', '0'))
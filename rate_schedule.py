@@ -0,0 +1,98 @@
+from functools import lru_cache
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Statutory rate schedules
+# -----------------------------------------------------------------------------
+# A statutory table ({Year: Rate}, e.g. PROP_RATE_TABLE) is compiled once into
+# a dense array with one rate per year from the first to the last year of the
+# table. A lookup is then an index into that array, for a single year or a
+# whole array of years. Years outside the table take the rate of the nearest
+# end of the table.
+#
+# Interpolation between the years of the table:
+#   - 'nearest': rate of the closest year (ties go to the year listed first,
+#                as min() over the keys did),
+#   - 'linear':  straight line between the two surrounding years,
+#   - 'step':    rate of the latest year at or before (the rate stays in
+#                force until the next entry).
+#
+# RateSchedule.of() memoizes the compiled schedules, so passing the same
+# table to the engine again (e.g. in a scenario sweep) compiles nothing.
+
+METHODS = ('nearest', 'linear', 'step')
+
+
+class RateSchedule:
+    """Dense year -> rate array compiled from a {Year: Rate} table."""
+
+    def __init__(self, table, method='nearest'):
+        if method not in METHODS:
+            raise ValueError(f"Unknown interpolation method '{method}' (expected one of {METHODS}).")
+        self.table = dict(table)
+        self.method = method
+
+        if not self.table:
+            # No table: a rate of 0 for every year
+            self.first_year = 0
+            self.rates_by_year = np.zeros(1)
+            return
+
+        table_years = np.array(list(self.table.keys()), dtype=np.int64)
+        table_rates = np.array(list(self.table.values()), dtype=np.float64)
+        self.first_year = int(table_years.min())
+        years = np.arange(self.first_year, table_years.max() + 1)
+
+        if method == 'nearest':
+            distance = np.abs(years[:, None] - table_years[None, :])
+            self.rates_by_year = table_rates[np.argmin(distance, axis=1)]
+        else:
+            order = np.argsort(table_years, kind='stable')
+            sorted_years, sorted_rates = table_years[order], table_rates[order]
+            if method == 'linear':
+                self.rates_by_year = np.interp(years, sorted_years, sorted_rates)
+            else:
+                position = np.searchsorted(sorted_years, years, side='right') - 1
+                self.rates_by_year = sorted_rates[position]
+
+    @classmethod
+    def of(cls, table, method='nearest'):
+        """
+        Compiled schedule of a table (memoized on its content and method).
+        A RateSchedule is returned as it is.
+        """
+        if isinstance(table, RateSchedule):
+            return table
+        return _compiled(tuple(table.items()), method)
+
+    @property
+    def last_year(self):
+        return self.first_year + len(self.rates_by_year) - 1
+
+    def rates(self, years):
+        """
+        Rates for a year or an array of years (same shape). Fractional
+        years are interpolated ('linear'), rounded ('nearest') or rounded
+        down ('step').
+        """
+        years = np.asarray(years)
+        if self.method == 'linear' and years.dtype.kind == 'f':
+            dense_years = np.arange(self.first_year, self.last_year + 1)
+            rates = np.interp(years, dense_years, self.rates_by_year)
+        else:
+            if years.dtype.kind == 'f':
+                years = np.rint(years) if self.method == 'nearest' else np.floor(years)
+            idx = np.clip(years.astype(np.int64) - self.first_year, 0, len(self.rates_by_year) - 1)
+            rates = self.rates_by_year[idx]
+        return rates[()] if rates.ndim == 0 else rates
+
+    __call__ = rates
+
+    def __repr__(self):
+        return f"RateSchedule({self.table!r}, method={self.method!r})"
+
+
+@lru_cache(maxsize=64)
+def _compiled(items, method):
+    return RateSchedule(dict(items), method)
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+from ingest import SPECIAL_REGIMES_FILE, load_source
+from rate_schedule import RateSchedule
+
+# -----------------------------------------------------------------------------
+# Pension regimes
+# -----------------------------------------------------------------------------
+# The Initial Annual Pension of a cohort is the weighted average of the IAP
+# of every regime its members belong to. A regime is a dict:
+#
+#     {'name': 'public_transitional',
+#      'accrual': lambda ctx: (5 / 6) * ctx['final_salary'] * (ctx['N_years'] / 40),
+#      'share': lambda ctx: ctx['pct_public'] * (1 - ctx['dummy_1999'])}
+#
+# 'accrual' returns the regime's IAP and 'share' the fraction of the cohort
+# in the regime, both as arrays over the cohorts (and any leading path
+# dimension). They receive the cohort-level quantities the engine computes
+# once for all regimes (see REGIME_CONTEXT). Exactly one regime has no
+# 'share': it takes the rest of the cohort (the general regime).
+#
+# pension_engine.evaluate_cohorts evaluates the regimes with one array
+# operation each, stacks them and combines them by weight in one step, so a
+# new regime is a new entry in the list, not a new branch in the engine.
+#
+# DEFAULT_REGIMES is the current model: the general regime plus the old
+# public-sector regime (5/6 of the final salary) for a PCT_PUBLIC share of
+# the cohorts that started working before the 1999 reform.
+# special_regimes() splits that public share across the special regime
+# funds (CGPO: state civil servants, CFL: railways, CPFEC: municipal
+# civil servants) by their number of personal pensions in the year of
+# retirement (specialregims2.xlsx). The workbooks only count pensions (per
+# fund in specialregims2.xlsx, per type of pension without a split by fund
+# in specialregims1.xlsx, which is not used); they hold no accrual rules.
+# So the split alone only breaks the public benefits down by fund, with the
+# same totals; a fund accrues differently only when it is given its own
+# accrual formula (the `accruals` argument).
+
+# Cohort-level quantities available to 'accrual' and 'share'
+REGIME_CONTEXT = [
+    'cohorts', 'pct_public', 'dummy_1999', 'N_years', 'retirement_year',
+    'fixed_increases', 'sum_adjusted_earnings', 'prop_rate', 'final_salary',
+]
+
+# Columns of specialregims2.xlsx with the personal pensions of each fund
+SPECIAL_REGIME_FUNDS = {
+    'cgpo': 'Pensions personnelles CGPO',
+    'cfl': 'Pensions personnelles CFL',
+    'cpfec': 'Pensions personnelles CPFEC',
+}
+
+
+def general_accrual(ctx):
+    """Régime général: fixed increases plus the proportional increases."""
+    return ctx['fixed_increases'] + ctx['sum_adjusted_earnings'] * ctx['prop_rate']
+
+
+def public_transitional_accrual(ctx):
+    """Old public-sector regime: 5/6 of the final salary, pro rata of 40 years."""
+    return (5 / 6) * ctx['final_salary'] * (ctx['N_years'] / 40)
+
+
+def public_transitional_share(ctx):
+    """PCT_PUBLIC of the cohorts that started working before the reform."""
+    return ctx['pct_public'] * (1 - ctx['dummy_1999'])
+
+
+GENERAL_REGIME = {'name': 'general', 'accrual': general_accrual}
+
+PUBLIC_TRANSITIONAL_REGIME = {
+    'name': 'public_transitional',
+    'accrual': public_transitional_accrual,
+    'share': public_transitional_share,
+}
+
+DEFAULT_REGIMES = [GENERAL_REGIME, PUBLIC_TRANSITIONAL_REGIME]
+
+
+def check_regimes(regimes):
+    """Raises ValueError unless exactly one regime has no 'share'."""
+    residual = [regime['name'] for regime in regimes if regime.get('share') is None]
+    if len(residual) != 1:
+        raise ValueError(f"Exactly one regime must take the rest of the cohort (no 'share'), "
+                         f"got {residual or 'none'}.")
+    names = [regime['name'] for regime in regimes]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Regime names must be unique, got {names}.")
+
+
+def combine_regimes(regimes, ctx):
+    """
+    Evaluates every regime on the context and returns (iap, weights, iaps):
+    the weighted IAP of the cohorts and the stacked (regime x cohort)
+    weights and IAPs, in the order of `regimes`.
+    """
+    check_regimes(regimes)
+    iaps = np.stack(np.broadcast_arrays(*(regime['accrual'](ctx) for regime in regimes)))
+    weights = np.zeros(iaps.shape)
+    residual = None
+    for i, regime in enumerate(regimes):
+        if regime.get('share') is None:
+            residual = i
+        else:
+            weights[i] = regime['share'](ctx)
+    weights[residual] = 1 - np.delete(weights, residual, axis=0).sum(axis=0)
+    return (weights * iaps).sum(axis=0), weights, iaps
+
+
+def load_special_regime_split(path=SPECIAL_REGIMES_FILE, funds=SPECIAL_REGIME_FUNDS):
+    """
+    Share of each special regime fund in the personal pensions of the
+    special regimes, per year: a DataFrame indexed by Year with one column
+    per fund (the rows sum to 1).
+    """
+    df = load_source(path)
+    counts = pd.DataFrame({fund: pd.to_numeric(df[col], errors='coerce') for fund, col in funds.items()})
+    counts.index = pd.to_numeric(df['Year'], errors='coerce')
+    counts = counts[counts.index.notna()].dropna()
+    counts.index = counts.index.astype(int)
+    counts.index.name = 'Year'
+    return counts.div(counts.sum(axis=1), axis=0)
+
+
+def special_regimes(split, method='nearest', accruals=None):
+    """
+    The general regime plus one old public-sector regime per special
+    regime fund, splitting the public share by the fund's share of the
+    year of retirement (split: see load_special_regime_split; years
+    outside the table take the nearest one, see rate_schedule.py).
+
+    accruals maps a fund to its accrual formula (a function of the
+    context, like public_transitional_accrual); the other funds accrue
+    like the old public regime.
+    """
+    accruals = accruals or {}
+    unknown = set(accruals) - set(split.columns)
+    if unknown:
+        raise ValueError(f"Unknown special regime fund(s) {sorted(unknown)} "
+                         f"(expected some of {list(split.columns)}).")
+    regimes = [GENERAL_REGIME]
+    for fund in split.columns:
+        schedule = RateSchedule(split[fund].to_dict(), method)
+
+        def share(ctx, schedule=schedule):
+            return public_transitional_share(ctx) * schedule.rates(ctx['retirement_year'])
+
+        regimes.append({'name': f'public_{fund}',
+                        'accrual': accruals.get(fund, public_transitional_accrual),
+                        'share': share})
+    return regimes
@@ -0,0 +1,318 @@
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from annuity import AnnuityTable
+from logs import configure_logging, get_logger
+from panel_store import load_panel
+from pension_engine import (REGIME_RESULT_COLUMN, RESULT_COLUMNS, build_cohort_grid,
+                            evaluate_cohorts, population_survival, prepare_panel)
+from rate_schedule import RateSchedule
+from regimes import load_special_regime_split, special_regimes
+
+log = get_logger('scenarios')
+
+# -----------------------------------------------------------------------------
+# Scenario sweeps
+# -----------------------------------------------------------------------------
+# Runs the pension calculation for many parameter sets without editing
+# Calculations.py. The panel is loaded and pivoted to the cohort grid once;
+# the grid is handed to each worker process a single time (pool initializer)
+# and then only read. Results are returned as one tidy table with one row per
+# (scenario, cohort).
+#
+# A scenario is a dict with the keys of SCENARIO_PARAMETERS. PROP_RATE_TABLE
+# is a {RetirementYear: Rate} dict (nearest year) or a RateSchedule;
+# PROP_RATE_TABLE_NAME labels it in the output table. DISCOUNT_RATE and
+# INDEXATION_RATE value the benefit stream (see annuity.py); the annuity
+# factors of every rate in the sweep are precomputed once and shipped to the
+# workers with the grid.
+# SURVIVAL_WEIGHTING switches to survival-weighted flows; the survival
+# curves are also computed once, on the grid, with a survival-weighted
+# annuity table of every rate (see annuity.AnnuityTable.for_survival).
+# SALARY_LIMITS and SPECIAL_REGIMES are the switches of the same name in
+# Calculations.py. The special regime split is read once and the regimes
+# are built in each worker; their benefit columns are only filled for the
+# scenarios that use them.
+
+SCENARIO_PARAMETERS = ['PCT_PUBLIC', 'WORK_START_AGE', 'FIXED_INCREASE_RATE', 'PROP_RATE_TABLE',
+                       'DISCOUNT_RATE', 'INDEXATION_RATE', 'SURVIVAL_WEIGHTING', 'SALARY_LIMITS',
+                       'SPECIAL_REGIMES']
+
+# Worker-side copies of the cohort grid, annuity tables and special regimes
+# (set once per process)
+_GRID = None
+_ANNUITY_TABLE = None
+_SURVIVAL_TABLE = None
+_SPECIAL_REGIMES = None
+
+# Prefix of the per-regime benefit columns
+REGIME_PREFIX = REGIME_RESULT_COLUMN.format('')
+
+
+def default_scenario():
+    """The assumptions currently set at the top of Calculations.py."""
+    import Calculations
+    return {
+        'PCT_PUBLIC': Calculations.PCT_PUBLIC,
+        'WORK_START_AGE': Calculations.WORK_START_AGE,
+        # None keeps the current model (fixed part not scaled), as Calculations.py
+        'FIXED_INCREASE_RATE': None,
+        'PROP_RATE_TABLE': RateSchedule.of(Calculations.PROP_RATE_TABLE,
+                                           Calculations.PROP_RATE_INTERPOLATION),
+        'PROP_RATE_TABLE_NAME': 'default',
+        # Benefits summed without indexation or discounting, as Calculations.py
+        'DISCOUNT_RATE': 0.0,
+        'INDEXATION_RATE': 0.0,
+        'SURVIVAL_WEIGHTING': Calculations.SURVIVAL_WEIGHTING,
+        'SALARY_LIMITS': Calculations.SALARY_LIMITS,
+        'SPECIAL_REGIMES': Calculations.SPECIAL_REGIMES,
+    }
+
+
+def expand_grid(**values):
+    """
+    Cartesian product of parameter values, e.g.
+    expand_grid(PCT_PUBLIC=[0.1, 0.2], WORK_START_AGE=[18, 20]).
+    Parameters not given take their default_scenario() value. PROP_RATE_TABLE
+    values may be given as a {name: table} dict to label them.
+    """
+    base = default_scenario()
+    tables = values.pop('PROP_RATE_TABLE', None)
+    if tables is None:
+        tables = {base['PROP_RATE_TABLE_NAME']: base['PROP_RATE_TABLE']}
+    elif isinstance(tables, dict) and not all(isinstance(t, (dict, RateSchedule)) for t in tables.values()):
+        # A single {year: rate} table
+        tables = {'table_1': tables}
+    elif not isinstance(tables, dict):
+        tables = {f"table_{i + 1}": table for i, table in enumerate(tables)}
+
+    names = list(values)
+    scenarios = []
+    for combo in itertools.product(*[values[name] for name in names]):
+        for table_name, table in tables.items():
+            scenario = dict(base)
+            scenario.update(zip(names, combo))
+            scenario['PROP_RATE_TABLE'] = table
+            scenario['PROP_RATE_TABLE_NAME'] = table_name
+            scenarios.append(scenario)
+    return scenarios
+
+
+def _init_worker(grid, annuity_table=None, special_regime_split=None, survival_table=None):
+    global _GRID, _ANNUITY_TABLE, _SURVIVAL_TABLE, _SPECIAL_REGIMES
+    _GRID = grid
+    _ANNUITY_TABLE = annuity_table
+    _SURVIVAL_TABLE = survival_table
+    # Regimes hold closures, so the (picklable) split is shipped instead
+    _SPECIAL_REGIMES = (None if special_regime_split is None
+                        else special_regimes(special_regime_split))
+
+
+def _run_batch(batch):
+    """Evaluates a list of (scenario_id, scenario) pairs on the worker's grid."""
+    frames = []
+    for scenario_id, scenario in batch:
+        frames.append(run_scenario(_GRID, scenario, scenario_id, annuity_table=_ANNUITY_TABLE,
+                                   special_regime_list=_SPECIAL_REGIMES,
+                                   survival_table=_SURVIVAL_TABLE))
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_scenario(grid, scenario, scenario_id=0, annuity_table=None, special_regime_list=None,
+                 survival_table=None):
+    """
+    Tidy results of one scenario: scenario columns + one row per processed
+    cohort. annuity_table, when given, must hold the scenario's discount
+    and indexation rates; survival_table (AnnuityTable.for_survival) takes
+    its place in SURVIVAL_WEIGHTING scenarios. special_regime_list (see
+    regimes.special_regimes) is required when the scenario has
+    SPECIAL_REGIMES on.
+    """
+    survival_weighting = bool(scenario.get('SURVIVAL_WEIGHTING', False))
+    regimes = None
+    if scenario.get('SPECIAL_REGIMES'):
+        if special_regime_list is None:
+            raise ValueError("A SPECIAL_REGIMES scenario needs the special regimes.")
+        regimes = special_regime_list
+    results = evaluate_cohorts(
+        grid,
+        scenario['PCT_PUBLIC'],
+        int(scenario['WORK_START_AGE']),
+        scenario['PROP_RATE_TABLE'],
+        fixed_increase_rate=scenario.get('FIXED_INCREASE_RATE'),
+        discount_rate=scenario.get('DISCOUNT_RATE', 0.0),
+        indexation_rate=scenario.get('INDEXATION_RATE', 0.0),
+        annuity_table=survival_table if survival_weighting else annuity_table,
+        survival_weighting=survival_weighting,
+        salary_limits=bool(scenario.get('SALARY_LIMITS', True)),
+        regimes=regimes,
+    )
+    processed = results['skip_code'] == 0
+
+    out = pd.DataFrame({'Scenario_ID': scenario_id,
+                        'Cohort': grid['cohorts'][processed]})
+    out.insert(1, 'PCT_PUBLIC', scenario['PCT_PUBLIC'])
+    out.insert(2, 'WORK_START_AGE', int(scenario['WORK_START_AGE']))
+    out.insert(3, 'FIXED_INCREASE_RATE', scenario.get('FIXED_INCREASE_RATE'))
+    out.insert(4, 'PROP_RATE_TABLE', scenario.get('PROP_RATE_TABLE_NAME', ''))
+    out.insert(5, 'DISCOUNT_RATE', scenario.get('DISCOUNT_RATE', 0.0))
+    out.insert(6, 'INDEXATION_RATE', scenario.get('INDEXATION_RATE', 0.0))
+    out.insert(7, 'SURVIVAL_WEIGHTING', bool(scenario.get('SURVIVAL_WEIGHTING', False)))
+    out.insert(8, 'SALARY_LIMITS', bool(scenario.get('SALARY_LIMITS', True)))
+    out.insert(9, 'SPECIAL_REGIMES', bool(scenario.get('SPECIAL_REGIMES', False)))
+    for name in RESULT_COLUMNS[1:] + [c for c in results if c.startswith(REGIME_PREFIX)]:
+        out[name] = results[name][processed]
+    return out
+
+
+def run_scenarios(scenarios, panel=None, panel_path=None, workers=None, batch_size=None):
+    """
+    Runs every scenario and returns a single tidy DataFrame keyed by
+    Scenario_ID (the scenario's position in the list).
+
+    The panel is given as a DataFrame or loaded from panel_path (default:
+    Calculations.FILE_PATH). workers=1 runs in the current process;
+    otherwise a process pool with `workers` processes (default: all cores).
+    """
+    if panel is None:
+        if panel_path is None:
+            import Calculations
+            panel_path = Calculations.FILE_PATH
+        panel = load_panel(panel_path)
+    grid = build_cohort_grid(prepare_panel(panel))
+
+    jobs = list(enumerate(scenarios))
+    if not jobs:
+        return pd.DataFrame()
+
+    rates = {
+        'discount_rates': sorted({s.get('DISCOUNT_RATE', 0.0) for s in scenarios}),
+        'indexation_rates': sorted({s.get('INDEXATION_RATE', 0.0) for s in scenarios}),
+    }
+    annuity_table = AnnuityTable.for_grid(grid, **rates)
+    survival_table = None
+    if any(s.get('SURVIVAL_WEIGHTING') for s in scenarios):
+        grid['Survival'] = population_survival(grid)
+        survival_table = AnnuityTable.for_survival(grid, grid['Survival'], **rates)
+    split = None
+    if any(s.get('SPECIAL_REGIMES') for s in scenarios):
+        split = load_special_regime_split()
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) == 1:
+        _init_worker(grid, annuity_table, split, survival_table)
+        return _run_batch(jobs)
+
+    # A few batches per worker keeps the pool busy without paying the
+    # inter-process overhead once per scenario.
+    if batch_size is None:
+        batch_size = max(1, len(jobs) // (workers * 4))
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(grid, annuity_table, split, survival_table)) as pool:
+        frames = list(pool.map(_run_batch, batches))
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_scenario_file(path):
+    """
+    Reads a list of parameter sets from a JSON file: a list of objects
+    with any of the SCENARIO_PARAMETERS keys (missing keys take their
+    default value).
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    scenarios = []
+    for i, entry in enumerate(entries):
+        scenario = default_scenario()
+        scenario.update(entry)
+        if 'PROP_RATE_TABLE' in entry:
+            scenario['PROP_RATE_TABLE'] = _parse_rate_table(entry['PROP_RATE_TABLE'])
+            scenario['PROP_RATE_TABLE_NAME'] = entry.get('PROP_RATE_TABLE_NAME', f"scenario_{i}")
+        scenarios.append(scenario)
+    return scenarios
+
+
+def _parse_rate_table(table):
+    """JSON object keys are strings; retirement years must be integers."""
+    return {int(year): float(rate) for year, rate in table.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a sweep of pension scenarios.")
+    parser.add_argument('--panel', default=None,
+                        help="Panel file (default: Calculations.FILE_PATH).")
+    parser.add_argument('--scenarios', default=None,
+                        help="JSON file with a list of parameter sets (instead of a grid).")
+    parser.add_argument('--pct-public', type=float, nargs='+', default=None)
+    parser.add_argument('--work-start-age', type=int, nargs='+', default=None)
+    parser.add_argument('--fixed-increase-rate', type=float, nargs='+', default=None,
+                        help="Scale the fixed part of the private IAP (default: not scaled).")
+    parser.add_argument('--discount-rate', type=float, nargs='+', default=None,
+                        help="Discount rates of the benefit stream (default: 0).")
+    parser.add_argument('--indexation-rate', type=float, nargs='+', default=None,
+                        help="Yearly pension indexation rates (default: 0).")
+    parser.add_argument('--survival-weighting', choices=['on', 'off', 'both'], default=None,
+                        help="Weight flows by survival from the Population diagonal.")
+    parser.add_argument('--salary-limits', choices=['on', 'off', 'both'], default=None,
+                        help="Clip the Salary to the minimum wage and contribution ceiling.")
+    parser.add_argument('--special-regimes', choices=['on', 'off', 'both'], default=None,
+                        help="Split the public share across the special regime funds.")
+    parser.add_argument('--prop-rate-table', nargs='+', default=None,
+                        help="JSON files, each holding one {year: rate} table.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes (default: all cores).")
+    parser.add_argument('--output', default='scenario_results.csv')
+    parser.add_argument('--log-level', default=None,
+                        help="Batch runs only show errors by default (e.g. INFO for progress).")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level or 'ERROR', batch=args.log_level is None)
+
+    if args.scenarios:
+        scenarios = load_scenario_file(args.scenarios)
+    else:
+        grid_values = {}
+        if args.pct_public:
+            grid_values['PCT_PUBLIC'] = args.pct_public
+        if args.work_start_age:
+            grid_values['WORK_START_AGE'] = args.work_start_age
+        if args.fixed_increase_rate:
+            grid_values['FIXED_INCREASE_RATE'] = args.fixed_increase_rate
+        if args.discount_rate:
+            grid_values['DISCOUNT_RATE'] = args.discount_rate
+        if args.indexation_rate:
+            grid_values['INDEXATION_RATE'] = args.indexation_rate
+        switches = {'on': [True], 'off': [False], 'both': [False, True]}
+        if args.survival_weighting:
+            grid_values['SURVIVAL_WEIGHTING'] = switches[args.survival_weighting]
+        if args.salary_limits:
+            grid_values['SALARY_LIMITS'] = switches[args.salary_limits]
+        if args.special_regimes:
+            grid_values['SPECIAL_REGIMES'] = switches[args.special_regimes]
+        if args.prop_rate_table:
+            tables = {}
+            for path in args.prop_rate_table:
+                with open(path) as f:
+                    tables[os.path.splitext(os.path.basename(path))[0]] = _parse_rate_table(json.load(f))
+            grid_values['PROP_RATE_TABLE'] = tables
+        scenarios = expand_grid(**grid_values)
+
+    log.info(f"Running {len(scenarios)} scenarios...")
+    results_df = run_scenarios(scenarios, panel_path=args.panel, workers=args.workers)
+    if not results_df.empty:
+        amounts = RESULT_COLUMNS[1:] + [c for c in results_df if c.startswith(REGIME_PREFIX)]
+        results_df[amounts] = results_df[amounts].round(2)
+    results_df.to_csv(args.output, index=False)
+    log.info(f"--- Results for {results_df['Scenario_ID'].nunique() if not results_df.empty else 0} "
+             f"scenarios saved to {os.path.abspath(args.output)} ---")
+
+
+if __name__ == "__main__":
+    main()
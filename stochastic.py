@@ -0,0 +1,272 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from logs import configure_logging, get_logger
+from panel_store import load_panel
+from pension_engine import SALARY_LIMIT_COLUMNS, build_cohort_grid, evaluate_cohorts, prepare_panel
+from regimes import load_special_regime_split, special_regimes
+
+log = get_logger('stochastic')
+
+# -----------------------------------------------------------------------------
+# Monte Carlo projection mode
+# -----------------------------------------------------------------------------
+# In the deterministic panel built by merge.py, the future is fixed: wages
+# grow at their mean historical rate (then stay flat after 2050), life
+# expectancy is frozen at its last observed value and the revalorisation
+# factor stays at its last observed value.
+#
+# This module replaces the years after BASE_YEAR with simulated paths:
+#   - wages: random walk with drift on the log annual wage level
+#     (i.i.d. normal growth around the historical mean growth),
+#   - revalorisation factor: AR(1) on its log annual growth,
+#   - life expectancy: random walk with drift on the average annual change,
+#     added to every age of the frozen profile.
+# The processes are fitted on the panel itself over FIT_YEARS.
+#
+# Paths are evaluated in batches: each batch is a stack of cohort grids with
+# a leading path dimension, run through the vectorized engine in one call.
+# Only the per-path cohort results are kept, so memory is bounded by the
+# batch size, not the number of paths.
+
+# Last year treated as observed; every later year is simulated
+BASE_YEAR = 2023
+
+# Years the processes are fitted on
+FIT_YEARS = (1991, 2023)
+
+# Ages whose life expectancy is projected (older ages keep their fixed value)
+MAX_PROJECTED_AGE = 90
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _year_series(panel, column, ages=None):
+    """One value per Year (mean over the given ages) for a panel column."""
+    rows = panel if ages is None else panel[panel['Age'].isin(ages)]
+    return rows.groupby('Year')[column].mean()
+
+
+def _wage_level(panel, base_year):
+    """
+    Wage level per year relative to base_year, read off Income_per_year
+    (the income profile scales with the annual wage, so any age gives the
+    same ratio; the mean over ages is used).
+    """
+    income = panel.pivot_table(index='Year', columns='Age', values='Income_per_year')
+    return (income / income.loc[base_year]).mean(axis=1)
+
+
+def fit_processes(panel, fit_years=FIT_YEARS, base_year=BASE_YEAR):
+    """
+    Fits the three stochastic processes on the panel. Returns a dict of
+    parameters, plus the deterministic paths they replace.
+    """
+    first, last = fit_years
+    ages = range(int(panel['Age'].min()), MAX_PROJECTED_AGE + 1)
+
+    # --- Wages: random walk with drift on log(wage level) ---
+    wage_level = _wage_level(panel, base_year)
+    wage_growth = np.log(wage_level).diff().loc[first:last].dropna()
+
+    # --- Revalorisation: AR(1) on log growth ---
+    reval = _year_series(panel, 'Revaleurisation_rate')
+    reval_growth = np.log(reval).diff().loc[first:last].dropna().to_numpy()
+    x_prev, x_next = reval_growth[:-1], reval_growth[1:]
+    if len(x_prev) > 1 and x_prev.var() > 0:
+        phi = np.cov(x_prev, x_next, bias=True)[0, 1] / x_prev.var()
+    else:
+        phi = 0.0
+    phi = float(np.clip(phi, -0.99, 0.99))
+    const = x_next.mean() - phi * x_prev.mean()
+    resid = x_next - (const + phi * x_prev)
+
+    # --- Life expectancy: random walk with drift on the average change ---
+    le = panel[panel['Age'].isin(ages)].pivot_table(index='Year', columns='Age',
+                                                    values='Life_Expectancy')
+    le_change = le.diff().mean(axis=1).loc[first:last].dropna()
+
+    return {
+        'base_year': base_year,
+        'wage_drift': float(wage_growth.mean()),
+        'wage_sigma': float(wage_growth.std(ddof=1)),
+        'reval_const': float(const),
+        'reval_phi': phi,
+        'reval_sigma': float(resid.std(ddof=1)) if len(resid) > 1 else 0.0,
+        'reval_last_growth': float(reval_growth[-1]) if len(reval_growth) else 0.0,
+        'le_drift': float(le_change.mean()),
+        'le_sigma': float(le_change.std(ddof=1)),
+        'projected_ages': (ages.start, ages.stop - 1),
+        # Deterministic paths (what the simulated ones replace)
+        'wage_level': wage_level,
+        'reval': reval,
+    }
+
+
+def simulate_paths(processes, years, n_paths, rng):
+    """
+    Draws n_paths future paths. Returns (n_paths x len(years)) arrays of
+    multipliers/shifts to apply to the deterministic panel: 'wage_factor'
+    (on Income_per_year), 'reval_factor' (on Revaleurisation_rate) and
+    'le_shift' (added to Life_Expectancy). Years up to the base year are
+    left unchanged (factor 1, shift 0).
+    """
+    years = np.asarray(years)
+    base_year = processes['base_year']
+    future = years > base_year
+    n_future = int(future.sum())
+
+    wage_factor = np.ones((n_paths, len(years)))
+    reval_factor = np.ones((n_paths, len(years)))
+    le_shift = np.zeros((n_paths, len(years)))
+    if n_future == 0:
+        return {'wage_factor': wage_factor, 'reval_factor': reval_factor, 'le_shift': le_shift}
+
+    future_years = years[future]
+
+    # Wages: simulated level relative to base year / deterministic level
+    shocks = rng.standard_normal((n_paths, n_future))
+    log_level = np.cumsum(processes['wage_drift'] + processes['wage_sigma'] * shocks, axis=1)
+    det_level = processes['wage_level'].reindex(future_years).ffill().to_numpy()
+    wage_factor[:, future] = np.exp(log_level) / det_level
+
+    # Revalorisation: AR(1) growth path, compounded from the base-year value
+    shocks = rng.standard_normal((n_paths, n_future))
+    growth = np.empty((n_paths, n_future))
+    x = np.full(n_paths, processes['reval_last_growth'])
+    for t in range(n_future):
+        x = processes['reval_const'] + processes['reval_phi'] * x + processes['reval_sigma'] * shocks[:, t]
+        growth[:, t] = x
+    reval_det = processes['reval']
+    base_reval = reval_det.loc[base_year]
+    det_future = reval_det.reindex(future_years).ffill().to_numpy()
+    reval_factor[:, future] = base_reval * np.exp(np.cumsum(growth, axis=1)) / det_future
+
+    # Life expectancy: cumulative improvement on top of the frozen profile
+    shocks = rng.standard_normal((n_paths, n_future))
+    le_shift[:, future] = np.cumsum(processes['le_drift'] + processes['le_sigma'] * shocks, axis=1)
+
+    return {'wage_factor': wage_factor, 'reval_factor': reval_factor, 'le_shift': le_shift}
+
+
+def _apply_paths(grid, paths, year_idx, projected_ages):
+    """Stack of cohort grids (leading path axis) with the simulated series applied."""
+    wage = paths['wage_factor'][:, year_idx]
+    reval = paths['reval_factor'][:, year_idx]
+    le_shift = paths['le_shift'][:, year_idx]
+
+    ages = grid['ages']
+    projected = (ages >= projected_ages[0]) & (ages <= projected_ages[1])
+
+    batch = dict(grid)
+    # Salary = Income_per_year / Revaleurisation_rate
+    batch['Salary'] = grid['Salary'] * wage / reval
+    batch['Revaleurisation_rate'] = grid['Revaleurisation_rate'] * reval
+    batch['Life_Expectancy'] = grid['Life_Expectancy'] + le_shift * projected
+    # The salary limits are nominal amounts that follow the wages
+    for col in SALARY_LIMIT_COLUMNS:
+        if col in grid:
+            batch[col] = grid[col] * wage
+    return batch
+
+
+def run_monte_carlo(panel, scenario=None, n_paths=1000, batch_size=250, seed=None,
+                    quantiles=QUANTILES, fit_years=FIT_YEARS, base_year=BASE_YEAR,
+                    special_regime_split=None):
+    """
+    Runs the cohort calculation on n_paths simulated futures and returns
+    quantile bands of Net_Benefit per cohort (plus the mean and the share
+    of paths where the cohort could be computed), with the scenario's
+    SALARY_LIMITS and SPECIAL_REGIMES switches. special_regime_split (see
+    regimes.load_special_regime_split) is required when SPECIAL_REGIMES
+    is on.
+    """
+    if scenario is None:
+        from scenarios import default_scenario
+        scenario = default_scenario()
+    salary_limits = bool(scenario.get('SALARY_LIMITS', True))
+    use_special_regimes = bool(scenario.get('SPECIAL_REGIMES', False))
+    regimes = None
+    if use_special_regimes:
+        if special_regime_split is None:
+            raise ValueError("A SPECIAL_REGIMES scenario needs the special regime split.")
+        regimes = special_regimes(special_regime_split)
+
+    panel = prepare_panel(panel)
+    processes = fit_processes(panel, fit_years=fit_years, base_year=base_year)
+    grid = build_cohort_grid(panel)
+
+    cohorts, ages = grid['cohorts'], grid['ages']
+    years = np.arange(cohorts.min() + ages.min(), cohorts.max() + ages.max() + 1)
+    year_idx = (cohorts[:, None] + ages[None, :]) - years[0]
+
+    rng = np.random.default_rng(seed)
+    net_benefit = np.empty((n_paths, len(cohorts)))
+
+    for start in range(0, n_paths, batch_size):
+        n = min(batch_size, n_paths - start)
+        paths = simulate_paths(processes, years, n, rng)
+        batch = _apply_paths(grid, paths, year_idx, processes['projected_ages'])
+        results = evaluate_cohorts(
+            batch,
+            scenario['PCT_PUBLIC'],
+            int(scenario['WORK_START_AGE']),
+            scenario['PROP_RATE_TABLE'],
+            fixed_increase_rate=scenario.get('FIXED_INCREASE_RATE'),
+            discount_rate=scenario.get('DISCOUNT_RATE', 0.0),
+            indexation_rate=scenario.get('INDEXATION_RATE', 0.0),
+            survival_weighting=bool(scenario.get('SURVIVAL_WEIGHTING', False)),
+            salary_limits=salary_limits,
+            regimes=regimes,
+        )
+        net_benefit[start:start + n] = results['Net_Benefit']
+
+    computed = ~np.isnan(net_benefit)
+    keep = computed.any(axis=0)
+    bands = pd.DataFrame({'Cohort': cohorts[keep]})
+    bands['SALARY_LIMITS'] = salary_limits
+    bands['SPECIAL_REGIMES'] = use_special_regimes
+    bands['Paths_Computed'] = computed[:, keep].mean(axis=0)
+    bands['Net_Benefit_Mean'] = np.nanmean(net_benefit[:, keep], axis=0)
+    for q in quantiles:
+        bands[f"Net_Benefit_Q{int(round(q * 100)):02d}"] = np.nanquantile(net_benefit[:, keep], q, axis=0)
+    return bands
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo projection of net pension benefits.")
+    parser.add_argument('--panel', default=None,
+                        help="Panel file (default: Calculations.FILE_PATH).")
+    parser.add_argument('--paths', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=250,
+                        help="Paths evaluated per engine call (bounds memory).")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='pension_monte_carlo_bands.csv')
+    parser.add_argument('--log-level', default=None,
+                        help="Batch runs only show errors by default (e.g. INFO for progress).")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level or 'ERROR', batch=args.log_level is None)
+
+    panel_path = args.panel
+    if panel_path is None:
+        import Calculations
+        panel_path = Calculations.FILE_PATH
+
+    from scenarios import default_scenario
+    scenario = default_scenario()
+    split = load_special_regime_split() if scenario['SPECIAL_REGIMES'] else None
+
+    log.info(f"Running {args.paths} simulated paths in batches of {args.batch_size}...")
+    bands = run_monte_carlo(load_panel(panel_path), scenario=scenario, n_paths=args.paths,
+                            batch_size=args.batch_size, seed=args.seed,
+                            special_regime_split=split)
+    bands.to_csv(args.output, index=False, float_format='%.2f')
+    log.info(f"--- Quantile bands saved to {os.path.abspath(args.output)} ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import argparse
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from logs import SUMMARY, configure_logging, get_logger
+from panel_store import HAS_PYARROW, apply_schema, format_of, resolve_panel_path
+from pension_engine import (REQUIRED_COLUMNS, SALARY_LIMIT_COLUMNS, compute_cohort_results,
+                            prepare_panel)
+from rate_schedule import RateSchedule
+
+log = get_logger('streaming')
+
+# -----------------------------------------------------------------------------
+# Streaming mode for cohort results
+# -----------------------------------------------------------------------------
+# calculate_pension_wealth loads the whole panel and builds the whole results
+# table. In streaming mode, memory does not grow with the size of the panel:
+#   1. the panel file is read in batches of rows (CSV chunks, Parquet /
+#      Feather record batches) and every row is appended to the bucket of
+#      its Birth_Year range (temporary files, one per `cohorts_per_chunk`
+#      birth years), so the rows of a cohort end up together whatever the
+#      order of the file,
+#   2. the buckets are then read back one at a time, in Birth_Year order,
+#      and the cohorts of each one are computed and yielded,
+#   3. ResultWriter appends every yielded chunk to the results file (CSV
+#      or Parquet).
+# Only one batch of panel rows, or one bucket, is held in memory at a time.
+
+COHORTS_PER_CHUNK = 20
+BATCH_ROWS = 100_000
+
+
+def iter_panel_batches(path, batch_rows=BATCH_ROWS, columns=None):
+    """
+    Reads a panel file in batches of rows (from its up-to-date binary copy
+    when there is one). Pickled panels can only be read whole, and are then
+    split. Of `columns`, the ones the file does not have are skipped.
+    """
+    path = resolve_panel_path(path)
+    fmt = format_of(path)
+    if fmt == 'csv':
+        usecols = None if columns is None else (lambda col: col in columns)
+        for batch in pd.read_csv(path, usecols=usecols, chunksize=batch_rows):
+            yield apply_schema(batch)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [col for col in columns if col in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'feather':
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            if columns is not None:
+                columns = [col for col in columns if col in reader.schema.names]
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).to_pandas()
+                yield batch if columns is None else batch[columns]
+    else:
+        df = pd.read_pickle(path)
+        if columns is not None:
+            df = df[[col for col in columns if col in df.columns]]
+        for start in range(0, len(df), batch_rows):
+            yield df.iloc[start:start + batch_rows]
+
+
+def partition_by_cohort(batches, bucket_dir, cohorts_per_chunk=COHORTS_PER_CHUNK):
+    """
+    Appends the rows of every batch to the bucket file of their Birth_Year
+    range. Returns the bucket files, in Birth_Year order.
+    """
+    buckets = {}
+    for batch in batches:
+        if 'Birth_Year' not in batch.columns:
+            batch = batch.assign(Birth_Year=batch['Year'] - batch['Age'])
+        bucket_of_row = np.floor_divide(batch['Birth_Year'].to_numpy(), cohorts_per_chunk)
+        for bucket, rows in batch.groupby(bucket_of_row, sort=False):
+            path = buckets.setdefault(int(bucket), os.path.join(bucket_dir, f"bucket_{int(bucket)}.pkl"))
+            with open(path, 'ab') as f:
+                pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return [buckets[bucket] for bucket in sorted(buckets)]
+
+
+def read_bucket(path):
+    """All the row batches appended to a bucket file, as one frame."""
+    parts = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                parts.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(parts, ignore_index=True)
+
+
+def iter_panel_chunks(path, cohorts_per_chunk=COHORTS_PER_CHUNK, batch_rows=BATCH_ROWS,
+                      columns=None):
+    """
+    Yields the panel in chunks of complete cohorts (cohorts_per_chunk birth
+    years each), in Birth_Year order, rows sorted by Birth_Year then Year.
+    """
+    bucket_dir = tempfile.mkdtemp(prefix='pension_stream_')
+    try:
+        batches = iter_panel_batches(path, batch_rows, columns)
+        for bucket in partition_by_cohort(batches, bucket_dir, cohorts_per_chunk):
+            chunk = read_bucket(bucket)
+            os.remove(bucket)
+            yield chunk.sort_values(['Birth_Year', 'Year'], kind='stable').reset_index(drop=True)
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+
+def iter_cohort_results(path, pct_public, work_start_age, prop_rate_table,
+                        fixed_increase_rate=None, cohorts_per_chunk=COHORTS_PER_CHUNK,
+                        batch_rows=BATCH_ROWS, survival_weighting=False, salary_limits=True,
+                        regimes=None):
+    """
+    Generator of cohort results: yields (results_df, skipped_df) for every
+    chunk of cohorts of the panel file, in Birth_Year order (see
+    compute_cohort_results for the two frames).
+    """
+    columns = REQUIRED_COLUMNS + SALARY_LIMIT_COLUMNS
+    for chunk in iter_panel_chunks(path, cohorts_per_chunk, batch_rows, columns=columns):
+        yield compute_cohort_results(prepare_panel(chunk), pct_public, work_start_age,
+                                     prop_rate_table, fixed_increase_rate=fixed_increase_rate,
+                                     survival_weighting=survival_weighting,
+                                     salary_limits=salary_limits, regimes=regimes)
+
+
+class ResultWriter:
+    """
+    Appends result chunks to a CSV or Parquet file (format from the
+    extension). Use as a context manager; the file is complete on exit.
+    """
+
+    def __init__(self, path, float_format='%.2f'):
+        self.path = path
+        self.fmt = format_of(path)
+        if self.fmt not in ('csv', 'parquet'):
+            raise ValueError(f"Streaming results can be written to CSV or Parquet, not '{self.fmt}'.")
+        if self.fmt == 'parquet' and not HAS_PYARROW:
+            raise ValueError("Writing Parquet needs pyarrow.")
+        self.float_format = float_format
+        self.rows = 0
+        self._parquet = None
+        self._header_written = False
+
+    def write(self, df):
+        if df.empty:
+            return
+        if self.fmt == 'csv':
+            df.to_csv(self.path, mode='a' if self._header_written else 'w',
+                      header=not self._header_written, index=False, float_format=self.float_format)
+            self._header_written = True
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table.cast(self._parquet.schema))
+        self.rows += len(df)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_cohort_results(panel_path, output_path, pct_public, work_start_age, prop_rate_table,
+                          fixed_increase_rate=None, cohorts_per_chunk=COHORTS_PER_CHUNK,
+                          batch_rows=BATCH_ROWS, survival_weighting=False, salary_limits=True,
+                          regimes=None):
+    """
+    Computes every cohort of the panel file chunk by chunk and appends the
+    results to output_path. Returns (cohorts computed, cohorts skipped).
+    Skipped cohorts are added to the run summary (see logs.py).
+    """
+    computed = skipped = 0
+    with ResultWriter(output_path) as writer:
+        for results_df, skipped_df in iter_cohort_results(
+                panel_path, pct_public, work_start_age, prop_rate_table,
+                fixed_increase_rate=fixed_increase_rate,
+                cohorts_per_chunk=cohorts_per_chunk, batch_rows=batch_rows,
+                survival_weighting=survival_weighting, salary_limits=salary_limits,
+                regimes=regimes):
+            writer.write(results_df)
+            computed += len(results_df)
+            skipped += len(skipped_df)
+            SUMMARY.add_warnings('skipped_cohorts', skipped_df.to_dict('records'))
+            for cohort, reason in zip(skipped_df['Cohort'], skipped_df['Reason']):
+                log.debug(f"  - SKIPPING cohort {cohort}: {reason}.")
+    return computed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute cohort results in streaming mode.")
+    parser.add_argument('--panel', default=None,
+                        help="Panel file (default: Calculations.FILE_PATH).")
+    parser.add_argument('--output', default='pension_lifetime_results.csv',
+                        help="Results file, .csv or .parquet.")
+    parser.add_argument('--cohorts-per-chunk', type=int, default=COHORTS_PER_CHUNK)
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    import Calculations
+    panel_path = args.panel or Calculations.FILE_PATH
+    log.info(f"Streaming cohorts from '{panel_path}' ({args.cohorts_per_chunk} birth years per chunk)...")
+    computed, skipped = stream_cohort_results(
+        panel_path, args.output, Calculations.PCT_PUBLIC, Calculations.WORK_START_AGE,
+        RateSchedule.of(Calculations.PROP_RATE_TABLE, Calculations.PROP_RATE_INTERPOLATION),
+        cohorts_per_chunk=args.cohorts_per_chunk,
+        batch_rows=args.batch_rows, survival_weighting=Calculations.SURVIVAL_WEIGHTING,
+        salary_limits=Calculations.SALARY_LIMITS, regimes=Calculations.pension_regimes())
+    log.info(f"--- All cohorts processed ({computed} computed, {skipped} skipped). ---")
+    log.info(f"--- Results table saved to {os.path.abspath(args.output)} ---")
+    SUMMARY.log_counts(log)
+
+
+if __name__ == "__main__":
+    main()